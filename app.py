@@ -1,19 +1,68 @@
 # === Standard imports ===
-import os, csv, random, datetime, sqlite3, uuid
+import os, sys, csv, json, logging, mmap, random, datetime, sqlite3, uuid, threading, asyncio, time, queue
+import base64, binascii, bisect, cProfile, functools, gzip, hashlib, heapq, hmac, io, marshal, mimetypes, re, types
 from pathlib import Path
-from contextlib import contextmanager
+from array import array
+from collections import OrderedDict, deque
+from itertools import accumulate, compress, count
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager, asynccontextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from math import radians, sin, cos, asin, sqrt
 from typing import List, Tuple, Iterable
 
+try:
+    import numpy as np  # valfritt: vektoriserade avstånd + kompakta float-arrayer
+except ImportError:
+    np = None
+try:
+    import brotli  # valfritt: .br-varianter i build-assets (gzip används annars)
+except ImportError:
+    brotli = None
+
 # === FastAPI / Pydantic ===
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse, HTMLResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel, conint
 
+log = logging.getLogger("geoguessr")
+
 # --- App ---
-app = FastAPI(title="Geoguessr - The Nabo Way (API)")
+# Start/stopp-hooks registreras med _on_startup/_on_shutdown där respektive del definieras
+# och körs av lifespan: start i registreringsordning, stopp i omvänd ordning.
+_STARTUP: list = []
+_SHUTDOWN: list = []
+
+def _on_startup(fn):
+    _STARTUP.append(fn)
+    return fn
+
+def _on_shutdown(fn):
+    _SHUTDOWN.append(fn)
+    return fn
+
+async def _run_hook(fn):
+    if asyncio.iscoroutinefunction(fn):
+        await fn()
+    else:
+        await run_in_threadpool(fn)
+
+@asynccontextmanager
+async def _lifespan(_app):
+    for fn in _STARTUP:
+        await _run_hook(fn)
+    try:
+        yield
+    finally:
+        for fn in reversed(_SHUTDOWN):
+            await _run_hook(fn)
+
+app = FastAPI(title="Geoguessr - The Nabo Way (API)", lifespan=_lifespan)
 
 # --- Paths ---
 APP_DIR       = Path(__file__).parent.resolve()
@@ -27,43 +76,580 @@ DATA_DIR      = APP_DIR / "data"
 DB_URL = os.getenv("DATABASE_URL", "").strip()
 USE_PG = bool(DB_URL)
 if USE_PG:
-    import psycopg  # psycopg v3
+    from psycopg_pool import ConnectionPool, AsyncConnectionPool, PoolTimeout
 
-def _connect():
-    if USE_PG:
-        return psycopg.connect(DB_URL, autocommit=True)
-    # SQLite
-    conn = sqlite3.connect(str(SQLITE_PATH))
+# --- Connection pool (konfig via env) ---
+DB_POOL_MIN     = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX     = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))      # sek att vänta på ledig conn
+DB_POOL_CHECK   = os.getenv("DB_POOL_CHECK", "1") != "0"         # hälsokoll vid utcheckning
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))   # PG: stäng conns som legat still
+
+# --- SQLite-profil: WAL + en skrivartråd (läsare väntar aldrig på skrivare) ---
+SQLITE_JOURNAL_MODE    = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+SQLITE_SYNCHRONOUS     = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()   # NORMAL räcker med WAL
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_MB         = int(os.getenv("SQLITE_MMAP_MB", "64"))
+SQLITE_CACHE_MB        = int(os.getenv("SQLITE_CACHE_MB", "16"))             # per connection
+SQLITE_WRITER          = os.getenv("SQLITE_WRITER", "1") != "0"              # alla skrivningar via en tråd
+
+_pg_pool = None
+_sqlite_local = threading.local()
+_sqlite_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_sqlite_stats_lock = threading.Lock()
+_sqlite_stats = {"connections_created": 0, "checkouts": 0, "in_use": 0,
+                 "timeouts": 0, "health_failures": 0}
+
+def _sqlite_stat(key: str, delta: int = 1):
+    with _sqlite_stats_lock:
+        _sqlite_stats[key] += delta
+
+def _new_sqlite_conn():
+    conn = sqlite3.connect(str(SQLITE_PATH), timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
     # Viktigt för ON DELETE CASCADE m.m.
     conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_MB * 1024 * 1024}")
+    conn.execute(f"PRAGMA cache_size = {-SQLITE_CACHE_MB * 1024}")  # negativt = KiB
     conn.row_factory = sqlite3.Row
+    _sqlite_stat("connections_created")
+    return conn
+
+def _get_pg_pool():
+    global _pg_pool
+    if _pg_pool is None:
+        _pg_pool = ConnectionPool(
+            DB_URL,
+            min_size=DB_POOL_MIN,
+            max_size=max(DB_POOL_MIN, DB_POOL_MAX),
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            kwargs={"autocommit": True},
+            check=ConnectionPool.check_connection if DB_POOL_CHECK else None,
+            name="geoguessr",
+            open=True,
+        )
+    return _pg_pool
+
+def _sqlite_checkout():
+    """Återanvänd trådens SQLite-connection (max DB_POOL_MAX utcheckade samtidigt)."""
+    depth = getattr(_sqlite_local, "depth", 0)
+    if depth == 0:
+        if not _sqlite_slots.acquire(timeout=DB_POOL_TIMEOUT):
+            _sqlite_stat("timeouts")
+            raise HTTPException(status_code=503, detail="Databasen är upptagen, försök igen")
+        _sqlite_stat("in_use")
+    _sqlite_local.depth = depth + 1
+    _sqlite_stat("checkouts")
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is not None and DB_POOL_CHECK and depth == 0:
+        try:
+            conn.execute("SELECT 1")
+        except sqlite3.Error:
+            _sqlite_stat("health_failures")
+            try:
+                conn.close()
+            except Exception:
+                pass
+            conn = None
+    if conn is None:
+        conn = _sqlite_local.conn = _new_sqlite_conn()
     return conn
 
+def _sqlite_checkin():
+    _sqlite_local.depth -= 1
+    if _sqlite_local.depth == 0:
+        _sqlite_stat("in_use", -1)
+        _sqlite_slots.release()
+
 @contextmanager
-def _db():
-    conn = _connect()
+def _connection():
+    """Låna en connection ur poolen (PG) eller trådens återanvända conn (SQLite)."""
+    if USE_PG:
+        try:
+            with _get_pg_pool().connection() as conn:
+                yield conn
+        except PoolTimeout:
+            raise HTTPException(status_code=503, detail="Databasen är upptagen, försök igen")
+        return
+    conn = _sqlite_checkout()
+    # nästlade utcheckningar delar conn; bara den yttersta committar/rullar tillbaka
+    outer = _sqlite_local.depth == 1
     try:
-        cur = conn.cursor()
-        yield cur
-        if not USE_PG:
+        yield conn
+        if outer:
             conn.commit()
+    except BaseException:
+        if outer:
+            conn.rollback()
+        raise
     finally:
+        _sqlite_checkin()
+
+def pool_stats() -> dict:
+    if USE_PG:
+        out = {"backend": "postgres", "open": False}
+        if _pg_pool is not None:
+            out = {"backend": "postgres", "open": True, "min_size": _pg_pool.min_size,
+                   "max_size": _pg_pool.max_size, "timeout": DB_POOL_TIMEOUT, **_pg_pool.get_stats()}
+        if _apg_pool is not None:
+            out["async"] = _apg_pool.get_stats()
+        return out
+    with _sqlite_stats_lock:
+        st = dict(_sqlite_stats)
+    out = {"backend": "sqlite", "max_size": DB_POOL_MAX, "timeout": DB_POOL_TIMEOUT,
+           "journal_mode": SQLITE_JOURNAL_MODE, "async": DB_ASYNC, **st}
+    if _sqlite_writer is not None:
+        out["writer"] = _sqlite_writer.stats()
+    if _sqlite_workers is not None:
+        out["async_workers"] = _sqlite_workers.stats()
+    return out
+
+def close_pool():
+    global _pg_pool, _sqlite_writer
+    if _pg_pool is not None:
+        _pg_pool.close()
+        _pg_pool = None
+    with _sqlite_workers_lock:
+        writer, _sqlite_writer = _sqlite_writer, None
+    if writer is not None:
+        writer.close()
+
+# --- Mätvärden (Prometheus-format på /metrics) ---
+# Varje tråd skriver i egna rader (ingen lås på mätvägen); /metrics summerar raderna.
+METRICS = os.getenv("METRICS", "1") != "0"
+HTTP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS   = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+
+class Histogram:
+    """Förbucketat histogram per etikettuppsättning. observe() rör bara trådens egna
+    listor ([antal per hink..., +Inf, summa]); samples() slår ihop alla trådars."""
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...], buckets: tuple[float, ...]):
+        self.name, self.help, self.labels, self.buckets = name, help_, labels, buckets
+        self._local = threading.local()
+        self._shards: list[dict] = []
+        self._lock = threading.Lock()
+
+    def _rows(self) -> dict:
+        rows = getattr(self._local, "rows", None)
+        if rows is None:
+            rows = self._local.rows = {}
+            with self._lock:
+                self._shards.append(rows)
+        return rows
+
+    def observe(self, labels: tuple, value: float):
+        rows = self._rows()
+        row = rows.get(labels)
+        if row is None:
+            row = rows[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def merged(self) -> dict[tuple, list]:
+        out: dict[tuple, list] = {}
+        with self._lock:
+            shards = list(self._shards)
+        for rows in shards:
+            for labels, row in list(rows.items()):
+                acc = out.get(labels)
+                out[labels] = list(row) if acc is None else [a + b for a, b in zip(acc, row)]
+        return out
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, row in sorted(self.merged().items()):
+            base = _prom_labels(zip(self.labels, labels))
+            cum = 0
+            for le, n in zip((*map(repr, self.buckets), "+Inf"), row):
+                cum += n
+                lines.append(f"{self.name}_bucket{{{base}{',' if base else ''}le=\"{le}\"}} {cum}")
+            lines.append(f"{self.name}_sum{{{base}}} {row[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {cum}")
+        return lines
+
+def _prom_labels(pairs) -> str:
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{k}="{esc(v)}"' for k, v in pairs)
+
+HTTP_LATENCY = Histogram("geo_http_request_duration_seconds", "Svarstid per route, metod och status.",
+                         ("route", "method", "status"), HTTP_BUCKETS)
+HTTP_DB_TIME = Histogram("geo_http_request_db_seconds", "Total DB-tid per request (summa av alla satser).",
+                         ("route", "method"), HTTP_BUCKETS)
+DB_LATENCY   = Histogram("geo_db_query_duration_seconds", "Tid per SQL-sats per frågeetikett.",
+                         ("query",), DB_BUCKETS)
+
+_request_db: ContextVar[list | None] = ContextVar("_request_db", default=None)  # [sekunder] för pågående request
+_SQL_LABEL = re.compile(r"^\s*(?:(UPDATE)\s+(\w+)|(\w+)(?:.*?\b(?:FROM|INTO|TABLE|INDEX)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+))?)", re.I | re.S)
+_sql_labels: dict[str, str] = {}
+
+def _query_label(sql: str) -> str:
+    """"select games", "insert game_players" ... ur SQL-texten (cachad per sats)."""
+    label = _sql_labels.get(sql)
+    if label is None:
+        m = _SQL_LABEL.match(sql)
+        label = " ".join(p.lower() for p in m.groups() if p) if m else "other"
+        if len(_sql_labels) < 2000:   # dynamiska IN-listor o.d. ska inte växa obegränsat
+            _sql_labels[sql] = label
+    return label
+
+def _db_observe(label: str, seconds: float):
+    DB_LATENCY.observe((label,), seconds)
+    acc = _request_db.get()
+    if acc is not None:
+        acc[0] += seconds
+
+class _TimedCursor:
+    """Cursor-proxy som mäter varje execute()/executemany() under sin frågeetikett."""
+    __slots__ = ("_cur",)
+
+    def __init__(self, cur):
+        self._cur = cur
+
+    def execute(self, sql, params=(), *args, **kwargs):
+        t0 = time.perf_counter()
         try:
-            cur.close()
-        except Exception:
-            pass
-        conn.close()
+            return self._cur.execute(sql, params, *args, **kwargs)
+        finally:
+            _db_observe(_query_label(sql), time.perf_counter() - t0)
+
+    def executemany(self, sql, params_seq, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return self._cur.executemany(sql, params_seq, *args, **kwargs)
+        finally:
+            _db_observe(_query_label(sql), time.perf_counter() - t0)
+
+    def __iter__(self):
+        return iter(self._cur)
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
 
-def _exec(sql: str, params: tuple = ()):
-    with _connect() as conn:
+class _ATimedCursor(_TimedCursor):
+    __slots__ = ()
+
+    async def execute(self, sql, params=(), *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await self._cur.execute(sql, params, *args, **kwargs)
+        finally:
+            _db_observe(_query_label(sql), time.perf_counter() - t0)
+
+    async def executemany(self, sql, params_seq, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return await self._cur.executemany(sql, params_seq, *args, **kwargs)
+        finally:
+            _db_observe(_query_label(sql), time.perf_counter() - t0)
+
+@contextmanager
+def _db(write: bool = False):
+    """Cursor för en transaktion. write=True: SQLite-skrivningar går via skrivartråden."""
+    if METRICS:
+        t0 = time.perf_counter()
+        with _db_raw(write) as cur:
+            # väntan på connection/skrivartråd räknas som egen etikett
+            _db_observe("checkout write" if write else "checkout", time.perf_counter() - t0)
+            yield _TimedCursor(cur)
+        return
+    with _db_raw(write) as cur:
+        yield cur
+
+@contextmanager
+def _db_raw(write: bool = False):
+    if write and not USE_PG and SQLITE_WRITER:
+        with _sqlite_write() as cur:
+            yield cur
+        return
+    with _connection() as conn:
         cur = conn.cursor()
+        try:
+            yield cur
+        finally:
+            try:
+                cur.close()
+            except Exception:
+                pass
+
+def _exec(sql: str, params: tuple = (), write: bool = False):
+    with _db(write) as cur:
         cur.execute(sql, params)
-        if not USE_PG:
-            conn.commit()
         if getattr(cur, "description", None):
             return cur.fetchall()
         return []
 
+# --- Async DB-läge (DB_ASYNC=1): async handlers för /api/match/* och topplistan ---
+# PG kör psycopgs AsyncConnectionPool; SQLite kör på egna trådar (en conn per tråd)
+# så att eventloopen och Starlettes threadpool aldrig blockeras av DB-väntan.
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+
+_apg_pool = None
+_apg_pool_open: "asyncio.Task | None" = None
+
+async def _aget_pg_pool():
+    global _apg_pool, _apg_pool_open
+    if _apg_pool_open is None:
+        _apg_pool = AsyncConnectionPool(
+            DB_URL,
+            min_size=DB_POOL_MIN,
+            max_size=max(DB_POOL_MIN, DB_POOL_MAX),
+            timeout=DB_POOL_TIMEOUT,
+            max_idle=DB_POOL_MAX_IDLE,
+            kwargs={"autocommit": True},
+            check=AsyncConnectionPool.check_connection if DB_POOL_CHECK else None,
+            name="geoguessr-async",
+            open=False,
+        )
+        _apg_pool_open = asyncio.ensure_future(_apg_pool.open(wait=False))
+    await asyncio.shield(_apg_pool_open)
+    return _apg_pool
+
+class _SqliteWorker:
+    """En tråd + en SQLite-connection; alla anrop för en transaktion körs här."""
+    def __init__(self, name: str):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self.conn = None
+
+    def _call(self, fn, *args):
+        if self.conn is None:
+            self.conn = _new_sqlite_conn()
+        return fn(self.conn, *args)
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, fn, *args)
+
+    def run_sync(self, fn, *args):
+        return self.executor.submit(self._call, fn, *args).result()
+
+    def close(self):
+        def _close(conn):
+            conn.close()
+        if self.conn is not None:
+            self.run_sync(_close)
+            self.conn = None
+        self.executor.shutdown(wait=True)
+
+class _SqliteWorkerPool:
+    """Utlåning av workers, både sync och async, utan att binda sig till en viss
+    eventloop (trådsäkra Futures). Storlek 1 = skrivartråden."""
+    def __init__(self, size: int, name: str):
+        self._free = [_SqliteWorker(f"{name}-{i}") for i in range(size)]
+        self._all = list(self._free)
+        self._waiters: list[Future] = []
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+
+    def _take(self) -> "_SqliteWorker | Future":
+        with self._lock:
+            self.checkouts += 1
+            if self._free:
+                return self._free.pop()
+            self.waits += 1
+            fut: Future = Future()
+            self._waiters.append(fut)
+            return fut
+
+    def _gave_up(self, fut: Future):
+        # kan ha fått en worker precis när vi gav upp – lämna tillbaka den
+        if not fut.cancel():
+            self.release(fut.result())
+        with self._lock:
+            self.timeouts += 1
+        raise HTTPException(status_code=503, detail="Databasen är upptagen, försök igen")
+
+    async def acquire(self) -> _SqliteWorker:
+        w = self._take()
+        if not isinstance(w, Future):
+            return w
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(w), timeout=DB_POOL_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._gave_up(w)
+
+    def acquire_sync(self) -> _SqliteWorker:
+        w = self._take()
+        if not isinstance(w, Future):
+            return w
+        try:
+            return w.result(timeout=DB_POOL_TIMEOUT)
+        except FutureTimeout:
+            self._gave_up(w)
+
+    def release(self, w: _SqliteWorker):
+        with self._lock:
+            while self._waiters:
+                fut = self._waiters.pop(0)
+                if fut.set_running_or_notify_cancel():
+                    fut.set_result(w)
+                    return
+            self._free.append(w)
+
+    def close(self):
+        for w in self._all:
+            w.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._all), "free": len(self._free), "waiting": len(self._waiters),
+                    "checkouts": self.checkouts, "waits": self.waits, "timeouts": self.timeouts}
+
+_sqlite_workers: _SqliteWorkerPool | None = None
+_sqlite_writer: _SqliteWorkerPool | None = None
+_sqlite_workers_lock = threading.Lock()
+
+def _get_sqlite_workers() -> _SqliteWorkerPool:
+    global _sqlite_workers
+    with _sqlite_workers_lock:
+        if _sqlite_workers is None:
+            _sqlite_workers = _SqliteWorkerPool(DB_POOL_MAX, "sqlite-async")
+        return _sqlite_workers
+
+def _get_sqlite_writer() -> _SqliteWorkerPool:
+    global _sqlite_writer
+    with _sqlite_workers_lock:
+        if _sqlite_writer is None:
+            _sqlite_writer = _SqliteWorkerPool(1, "sqlite-writer")
+        return _sqlite_writer
+
+def _sqlite_cursor_call(conn, op: str, sql: str | None = None, params=()):
+    cur = conn.cursor()
+    if op == "executemany":
+        cur.executemany(sql, params)
+        return cur.lastrowid, None, []
+    cur.execute(sql, params)
+    return cur.lastrowid, cur.description, cur.fetchall() if cur.description else []
+
+class _AsyncSqliteCursor:
+    """Minimal async-cursor (execute/executemany/fetchone/fetchall) ovanpå en worker."""
+    def __init__(self, worker: _SqliteWorker):
+        self._w = worker
+        self._rows: list = []
+        self.lastrowid = None
+        self.description = None
+
+    async def execute(self, sql: str, params: tuple = ()):
+        self.lastrowid, self.description, self._rows = await self._w.run(
+            _sqlite_cursor_call, "execute", sql, params)
+
+    async def executemany(self, sql: str, params_seq):
+        self.lastrowid, self.description, self._rows = await self._w.run(
+            _sqlite_cursor_call, "executemany", sql, list(params_seq))
+
+    async def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    async def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+class _SqliteWriteCursor:
+    """Synkron cursor vars satser körs på skrivartråden (lånad för hela transaktionen)."""
+    def __init__(self, worker: _SqliteWorker):
+        self._w = worker
+        self._rows: list = []
+        self.lastrowid = None
+        self.description = None
+
+    def execute(self, sql: str, params: tuple = ()):
+        self.lastrowid, self.description, self._rows = self._w.run_sync(
+            _sqlite_cursor_call, "execute", sql, params)
+
+    def executemany(self, sql: str, params_seq):
+        self.lastrowid, self.description, self._rows = self._w.run_sync(
+            _sqlite_cursor_call, "executemany", sql, list(params_seq))
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+@contextmanager
+def _sqlite_write():
+    """Skrivtransaktion på skrivartråden; nästlade anrop i samma tråd delar transaktionen."""
+    cur = getattr(_sqlite_local, "write_cur", None)
+    if cur is not None:
+        yield cur
+        return
+    writer = _get_sqlite_writer()
+    w = writer.acquire_sync()
+    _sqlite_local.write_cur = cur = _SqliteWriteCursor(w)
+    try:
+        yield cur
+        w.run_sync(lambda conn: conn.commit())
+    except BaseException:
+        w.run_sync(lambda conn: conn.rollback())
+        raise
+    finally:
+        _sqlite_local.write_cur = None
+        writer.release(w)
+
+@asynccontextmanager
+async def _adb(write: bool = False):
+    """Async motsvarighet till _db(): cursor med await execute()/fetchone()/fetchall()."""
+    if METRICS:
+        t0 = time.perf_counter()
+        async with _adb_raw(write) as cur:
+            _db_observe("checkout write" if write else "checkout", time.perf_counter() - t0)
+            yield _ATimedCursor(cur)
+        return
+    async with _adb_raw(write) as cur:
+        yield cur
+
+@asynccontextmanager
+async def _adb_raw(write: bool = False):
+    if USE_PG:
+        pool = await _aget_pg_pool()
+        try:
+            async with pool.connection() as conn:
+                async with conn.cursor() as cur:
+                    yield cur
+        except PoolTimeout:
+            raise HTTPException(status_code=503, detail="Databasen är upptagen, försök igen")
+        return
+    writer = write and SQLITE_WRITER
+    workers = _get_sqlite_writer() if writer else _get_sqlite_workers()
+    w = await workers.acquire()
+    if not writer:
+        _sqlite_stat("checkouts")
+        _sqlite_stat("in_use")
+    try:
+        yield _AsyncSqliteCursor(w)
+        await w.run(lambda conn: conn.commit())
+    except BaseException:
+        await w.run(lambda conn: conn.rollback())
+        raise
+    finally:
+        if not writer:
+            _sqlite_stat("in_use", -1)
+        workers.release(w)
+
+async def _aexec(sql: str, params: tuple = (), write: bool = False):
+    async with _adb(write) as cur:
+        await cur.execute(sql, params)
+        if cur.description:
+            return await cur.fetchall()
+        return []
+
+async def aclose_pool():
+    global _apg_pool, _apg_pool_open, _sqlite_workers
+    if _apg_pool is not None:
+        await _apg_pool.close()
+        _apg_pool = _apg_pool_open = None
+    with _sqlite_workers_lock:
+        workers, _sqlite_workers = _sqlite_workers, None
+    if workers is not None:
+        await asyncio.to_thread(workers.close)
+
 def _table_exists(cur, table_name: str) -> bool:
     if USE_PG:
         cur.execute("""
@@ -74,6 +660,23 @@ def _table_exists(cur, table_name: str) -> bool:
     cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=? LIMIT 1;", (table_name,))
     return cur.fetchone() is not None
 
+def _index_exists(cur, index_name: str) -> bool:
+    if USE_PG:
+        cur.execute("SELECT 1 FROM pg_indexes WHERE schemaname='public' AND indexname=%s LIMIT 1", (index_name,))
+        return cur.fetchone() is not None
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name=? LIMIT 1;", (index_name,))
+    return cur.fetchone() is not None
+
+def _column_exists(cur, table_name: str, column: str) -> bool:
+    if USE_PG:
+        cur.execute("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema='public' AND table_name=%s AND column_name=%s LIMIT 1
+        """, (table_name, column))
+        return cur.fetchone() is not None
+    cur.execute("SELECT 1 FROM pragma_table_info(?) WHERE name=? LIMIT 1;", (table_name, column))
+    return cur.fetchone() is not None
+
 # ===== SQL-script helpers (kör flera statements för PG/SQLite) =====
 def _split_sql_statements(sql: str) -> Iterable[str]:
     """Enkel split på ';' (räcker för CREATE/INDEX/INSERT), ignorerar '--' kommentarer."""
@@ -94,35 +697,47 @@ def _split_sql_statements(sql: str) -> Iterable[str]:
 
 def _run_sql_script(sql: str):
     """Kör ett helt .sql-skript, oavsett PG eller SQLite."""
-    if USE_PG:
-        with _connect() as conn:
+    with _connection() as conn:
+        if USE_PG:
             cur = conn.cursor()
             for stmt in _split_sql_statements(sql):
                 cur.execute(stmt)
-    else:
-        with _connect() as conn:
+        else:
             conn.executescript(sql)
 
+def _games_migrations(cur) -> list[str]:
+    """Migreringsskript (i ordning) som en befintlig games-tabell saknar."""
+    scripts = []
+    if not _index_exists(cur, "idx_games_code_open"):
+        scripts.append("migrate_games_code")         # gamla kodschemat: 3 siffror, unik för alltid
+    if not _column_exists(cur, "games", "finished_at"):
+        scripts.append("migrate_games_finished_at")  # kodkarantänen räknas från avslut
+    return scripts
+
 def _ensure_multiplayer_tables():
-    """Skapa multiplayer-tabeller om de saknas (väljer rätt script för PG/SQLite)."""
+    """Skapa multiplayer-tabeller om de saknas (väljer rätt script för PG/SQLite).
+    Finns de redan med ett äldre schema migreras games (se _games_migrations)."""
+    scripts = ["create_multiplayer"]
     with _db() as cur:
         try:
             if _table_exists(cur, "games"):
-                return
+                scripts = _games_migrations(cur)
         except Exception:
             pass
-    sql_path = APP_DIR / "db" / ("create_multiplayer.sql" if USE_PG else "create_multiplayer.sqlite.sql")
-    if not sql_path.exists():
-        raise RuntimeError(f"Saknar SQL-filen: {sql_path}")
-    _run_sql_script(sql_path.read_text(encoding="utf-8"))
+    for script in scripts:
+        sql_path = APP_DIR / "db" / (f"{script}.sql" if USE_PG else f"{script}.sqlite.sql")
+        if not sql_path.exists():
+            raise RuntimeError(f"Saknar SQL-filen: {sql_path}")
+        _run_sql_script(sql_path.read_text(encoding="utf-8"))
 
-def _find_row_by_id(city: str, place_id: str) -> dict | None:
+def _find_row_by_id(city: str, place_id: str) -> "PlaceRow | None":
     key = (city or "").lower().strip()
     pid = (place_id or "").strip()
-    for r in CITY_PLACES.get(key, []):
-        if (r.get("id") or "").strip() == pid:
-            return r
-    return None
+    places = CITIES.places(key)
+    if places is None:
+        return None
+    i = CITY_PLACE_INDEX.get(key, {}).get(pid)
+    return places[i] if i is not None and i < len(places) else None
 
 
 # --- Ping ---
@@ -130,12 +745,79 @@ def _find_row_by_id(city: str, place_id: str) -> dict | None:
 def ping():
     return {"ok": True, "msg": "pong", "use_pg": USE_PG, "has_db_url": bool(DB_URL)}
 
+class MetricsMiddleware:
+    """Ren ASGI-middleware (strömmar/SSE passerar orörda): svarstid, status och
+    DB-tid per route-mall. Okända sökvägar samlas under "unmatched"."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        acc = [0.0]
+        token = _request_db.set(acc)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _request_db.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe((path, scope["method"], str(status[0])), elapsed)
+            HTTP_DB_TIME.observe((path, scope["method"]), acc[0])
+
+if METRICS:
+    app.add_middleware(MetricsMiddleware)
+
+def _gauge(name: str, help_: str, samples) -> list[str]:
+    lines = [f"# HELP {name} {help_}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{{{_prom_labels(labels)}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+def _game_counts() -> dict[str, int]:
+    with _db() as cur:
+        if not _table_exists(cur, "games"):
+            return {}
+        cur.execute("SELECT status, COUNT(*) FROM games GROUP BY status")
+        return {r[0]: r[1] for r in cur.fetchall()}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus text-format: HTTP- och DB-histogram plus några mätare över tillståndet."""
+    lines = []
+    for h in (HTTP_LATENCY, HTTP_DB_TIME, DB_LATENCY):
+        lines += h.render()
+    games = _game_counts()
+    lines += _gauge("geo_games", "Matcher per status i games-tabellen.",
+                    [((("status", st),), games.get(st, 0)) for st in ("lobby", "active", "finished", "cancelled")])
+    rounds = PLACES.stats()
+    lines += _gauge("geo_round_store_entries", "Utdelade rundor i PLACES (RoundStore).", [((), rounds["size"])])
+    lines += _gauge("geo_round_store_bytes", "Uppskattad minnesstorlek för PLACES.", [((), rounds["bytes"])])
+    cities = [(c, CITIES.info(c)) for c in CITIES.keys()]
+    lines += _gauge("geo_city_places", "Antal platser per stad (ur registret, laddar inget).",
+                    [((("city", c),), ci.n or 0) for c, ci in cities])
+    lines += _gauge("geo_city_places_loaded", "Laddade rader i CITY_PLACES per stad.",
+                    [((("city", c),), len(CITY_PLACES.get(c) or ())) for c, _ in cities])
+    return Response("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def _admin_authorized(request: Request) -> bool:
+    token_env = os.environ.get("INIT_TOKEN", "")
+    token_req = request.headers.get("X-Init-Token") or request.query_params.get("token")
+    return bool(token_env) and token_req == token_env
+
 # --- Init DB (tillfällig, kör EN gång efter deploy) ---
 @app.post("/__admin/init_db_once")
 async def init_db_once(request: Request):
-    token_env = os.environ.get("INIT_TOKEN", "")
-    token_req = request.headers.get("X-Init-Token") or request.query_params.get("token")
-    if not token_env or token_req != token_env:
+    if not _admin_authorized(request):
         return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
     try:
         _ensure_multiplayer_tables()
@@ -143,278 +825,2323 @@ async def init_db_once(request: Request):
     except Exception as e:
         return JSONResponse({"ok": False, "error": f"SQL-exec fel: {e}"}, status_code=500)
 
-# --- Skapa mappar och mounta statiskt ---
-STATIC_DIR.mkdir(exist_ok=True)
-IMG_DIR.mkdir(parents=True, exist_ok=True)
-TEMPLATES_DIR.mkdir(parents=True, exist_ok=True)
+@_on_startup
+def _migrate_match_codes():
+    """Befintlig games-tabell med äldre schema migreras direkt vid start: annars kan koder
+    från avslutade matcher aldrig återanvändas, eller återanvändas för tidigt (se CodeAllocator)."""
+    with _db() as cur:
+        if not _table_exists(cur, "games") or not _games_migrations(cur):
+            return
+    _ensure_multiplayer_tables()
 
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
-app.mount("/img",    StaticFiles(directory=str(IMG_DIR)),    name="img")
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+# --- Städning av matchtabellerna (se GameReaper) ---
+@app.get("/__admin/reaper_stats")
+def admin_reaper_stats(request: Request):
+    if not _admin_authorized(request):
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
+    return {"ok": True, "reaper": REAPER.stats()}
 
-# --- CSV-data ---
-CITY_FILES = {
-    "stockholm": DATA_DIR / "places_stockholm.csv",
-    "goteborg":  DATA_DIR / "places_goteborg.csv",
-    "malmo":     DATA_DIR / "places_malmo.csv",
-}
-CITY_PLACES: dict[str, list[dict]] = {}
+@app.post("/__admin/reaper_run")
+def admin_reaper_run(request: Request):
+    if not _admin_authorized(request):
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
+    return {"ok": True, "reaper": REAPER.run_once()}
 
-def _to_float(s: str | None):
-    try:
-        return float(str(s).replace(",", "."))
-    except Exception:
-        return None
+# --- Profilering på begäran (INIT_TOKEN) ---
+# POST /__admin/profile/start lindar in valda routers endpoints; utan aktiv profilering
+# finns ingen inlindning alls, dvs. noll overhead. mode=cprofile ger pstats (och
+# approximativa collapsed stacks), mode=sample samplar trådens stack var PROFILE_SAMPLE_MS
+# och ger exakta collapsed stacks (flamegraph.pl / speedscope).
+# cProfile går på processens sys.monitoring (3.12+): bara en profiler kan vara aktiv åt
+# gången och den ser alla trådar, så samtidiga requests hamnar i samma profil. Därför
+# profileras högst en request åt gången; övriga körs oprofilerade. Vid samtidig trafik
+# ger mode=sample renare resultat (bara den egna trådens stack).
+PROFILE_ROUTES    = ("/api/match/round_result", "/api/leaderboard")
+PROFILE_KEEP      = int(os.getenv("PROFILE_KEEP", "20"))             # antal långsammaste som sparas
+PROFILE_MAX_SEC   = float(os.getenv("PROFILE_MAX_SEC", "600"))       # stängs av automatiskt efter
+PROFILE_SAMPLE_MS = float(os.getenv("PROFILE_SAMPLE_MS", "5"))
 
-def load_places():
-    for city, path in CITY_FILES.items():
-        rows: list[dict] = []
-        if path.exists():
-            with path.open("r", encoding="utf-8-sig", newline="") as f:
-                for r in csv.DictReader(f):
-                    lat = _to_float(r.get("lat")); lon = _to_float(r.get("lon"))
-                    if lat is None or lon is None:
-                        continue
-                    street = (r.get("street") or "").strip()
-                    postnr = (r.get("postnummer") or "").strip()
-                    ort    = (r.get("ort") or "").strip()
-                    address_full = ", ".join(p for p in [street, postnr, ort] if p)
-                    rows.append({
-                        "id": (r.get("id") or "").strip(),
-                        "display_name": (r.get("display_name") or "").strip(),
-                        "alt_names": (r.get("alt_names") or "").strip(),
-                        "street": street, "postnummer": postnr, "ort": ort,
-                        "kommun": (r.get("kommun") or "").strip(),
-                        "lan": (r.get("lan") or "").strip(),
-                        "lat": lat, "lon": lon,
-                        "svardighet": (r.get("svardighet") or "").strip(),
-                        "address_full": address_full,
-                    })
-        CITY_PLACES[city] = rows
+_cprofile_busy = threading.Lock()   # en aktiv cProfile i processen, se ovan
 
-load_places()
+def _frame_label(code) -> str:
+    return f"{Path(code.co_filename).name}:{code.co_name}:{code.co_firstlineno}"
 
-# --- Root (servera /static/index.html) ---
-@app.get("/", response_class=HTMLResponse)
-def root(_req: Request):
-    index_file = STATIC_DIR / "index.html"
-    if index_file.exists():
-        return HTMLResponse(index_file.read_text(encoding="utf-8"))
-    return HTMLResponse("<h1>Index.html saknas i /static</h1>")
+class _StackSampler:
+    """Bakgrundstråd som samplar stacken för de trådar som just nu kör en profilerad
+    request (ident -> räknare); async-anrop registreras bara medan korutinen kör."""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._active: dict[int, dict[str, int]] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
 
-# --- Skapa bas-tabeller om de saknas (feedback/leaderboard) ---
-if USE_PG:
-    _exec("""
-    CREATE TABLE IF NOT EXISTS feedback (
-      id          BIGSERIAL PRIMARY KEY,
-      created_at  TIMESTAMPTZ NOT NULL,
-      name        TEXT,
-      email       TEXT,
-      category    TEXT,
-      message     TEXT NOT NULL
-    )""")
-    _exec("""
-    CREATE TABLE IF NOT EXISTS leaderboard (
-      id          BIGSERIAL PRIMARY KEY,
-      created_at  TIMESTAMPTZ NOT NULL,
-      name        TEXT NOT NULL,
-      score       INTEGER NOT NULL,
-      rounds      INTEGER NOT NULL,
-      city        TEXT
-    )""")
-else:
-    _exec("""
-    CREATE TABLE IF NOT EXISTS feedback (
-      id          INTEGER PRIMARY KEY AUTOINCREMENT,
-      created_at  TEXT NOT NULL,
-      name        TEXT,
-      email       TEXT,
-      category    TEXT,
-      message     TEXT NOT NULL
-    )""")
-    _exec("""
-    CREATE TABLE IF NOT EXISTS leaderboard (
-      id          INTEGER PRIMARY KEY AUTOINCREMENT,
-      created_at  TEXT NOT NULL,
-      name        TEXT NOT NULL,
-      score       INTEGER NOT NULL,
-      rounds      INTEGER NOT NULL,
-      city        TEXT
-    )""")
+    def attach(self, counts: dict[str, int]):
+        self._active[threading.get_ident()] = counts
 
-# --- Feedback API ---
-class Feedback(BaseModel):
-    name: str | None = ""
-    email: str | None = ""
-    category: str = "Feedback"
-    message: str
+    def detach(self):
+        self._active.pop(threading.get_ident(), None)
 
-@app.post("/api/feedback")
-def save_feedback(fb: Feedback):
-    msg = (fb.message or "").strip()
-    if not msg:
-        raise HTTPException(status_code=400, detail="Tomt meddelande")
-    ts = datetime.datetime.utcnow().isoformat(timespec="seconds")
-    sql_sqlite = "INSERT INTO feedback (created_at, name, email, category, message) VALUES (?, ?, ?, ?, ?)"
-    sql_pg     = "INSERT INTO feedback (created_at, name, email, category, message) VALUES (%s, %s, %s, %s, %s)"
-    _exec(sql_pg if USE_PG else sql_sqlite,
-          (ts, (fb.name or "").strip(), (fb.email or "").strip(), (fb.category or 'Feedback').strip(), msg))
-    return {"ok": True}
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if not self._active:
+                continue
+            frames = sys._current_frames()
+            for ident, counts in list(self._active.items()):
+                f = frames.get(ident)
+                stack = []
+                while f is not None:
+                    stack.append(_frame_label(f.f_code))
+                    f = f.f_back
+                if stack:
+                    key = ";".join(reversed(stack))
+                    counts[key] = counts.get(key, 0) + 1
 
-@app.get("/api/feedbacks")
-def list_feedbacks():
-    rows = _exec("SELECT id, created_at, name, email, category, message FROM feedback ORDER BY id DESC")
-    if USE_PG:
-        items = [{"id": r[0], "created_at": r[1], "name": r[2], "email": r[3], "category": r[4], "message": r[5]} for r in rows]
-    else:
-        items = [dict(r) for r in rows]
-    return {"feedbacks": items}
+    def close(self):
+        self._stop.set()
 
-# --- Leaderboard API ---
-class ScoreIn(BaseModel):
-    name: str | None = ""
-    score: conint(ge=0)
-    rounds: conint(ge=1, le=50)
-    city: str | None = ""
+@types.coroutine
+def _stepped(coro, enter, leave):
+    """Kör korutinen steg för steg med enter()/leave() runt varje steg, så att andra
+    tasks på eventloopen inte hamnar i profilen."""
+    value, exc = None, None
+    while True:
+        enter()
+        try:
+            fut = coro.throw(exc) if exc is not None else coro.send(value)
+        except StopIteration as e:
+            return e.value
+        finally:
+            leave()
+        try:
+            value, exc = (yield fut), None
+        except BaseException as e:  # noqa: BLE001 - skickas vidare in i korutinen
+            value, exc = None, e
 
-@app.post("/api/leaderboard")
-def save_score(s: ScoreIn):
-    ts = datetime.datetime.utcnow().isoformat(timespec="seconds")
-    name = (s.name or "").strip() or "Anon"
-    city = (s.city or "").strip()
-    sql_sqlite = "INSERT INTO leaderboard (created_at, name, score, rounds, city) VALUES (?, ?, ?, ?, ?)"
-    sql_pg     = "INSERT INTO leaderboard (created_at, name, score, rounds, city) VALUES (%s, %s, %s, %s, %s)"
-    _exec(sql_pg if USE_PG else sql_sqlite, (ts, name, int(s.score), int(s.rounds), city))
-    return {"ok": True}
+def _collapsed_from_pstats(stats: dict, max_depth: int = 64) -> dict[str, float]:
+    """Approximativa collapsed stacks ur cProfiles anropsgraf: varje funktions tid
+    fördelas ned i anropsträdet i proportion till kanternas kumulativa tid."""
+    callees: dict[tuple, list[tuple[tuple, float]]] = {}
+    for func, (_cc, _nc, _tt, _ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    label = lambda fn: f"{Path(fn[0]).name}:{fn[2]}:{fn[1]}"
+    out: dict[str, float] = {}
 
-@app.get("/api/leaderboard")
-def get_leaderboard(limit: int = 50, order: str = "best", city: str | None = None):
-    limit = max(1, min(limit, 200))
-    order_sql = "created_at DESC" if order == "latest" else "score ASC"
-    params, where_sql = [], ""
-    if city:
-        key = city.lower().strip()
-        if key not in ("stockholm", "malmo", "goteborg"):
-            raise HTTPException(status_code=400, detail=f"Ogiltig stad: {city}")
-        where_sql = f"WHERE city = {'%s' if USE_PG else '?'}"
-        params.append(key)
-    limit_ph = "%s" if USE_PG else "?"
-    sql = f"SELECT id, created_at, name, score, rounds, city FROM leaderboard {where_sql} ORDER BY {order_sql} LIMIT {limit_ph}"
-    params.append(limit)
-    rows = _exec(sql, tuple(params))
-    city_map = {"stockholm": "Stockholm", "malmo": "Malmö", "goteborg": "Göteborg"}
-    if USE_PG:
-        items = [{"id": r[0], "created_at": r[1], "name": r[2], "score": r[3], "rounds": r[4],
-                  "city": city_map.get((r[5] or "").lower(), r[5])} for r in rows]
-    else:
-        items = []
-        for r in rows:
-            d = dict(r)
-            d["city"] = city_map.get((d.get("city") or "").lower(), d.get("city"))
-            items.append(d)
-    return {"items": items}
+    def walk(func, path: list[str], seen: set, incl: float):
+        tt, ct = stats[func][2], stats[func][3]
+        path = path + [label(func)]
+        if ct > 0:
+            key = ";".join(path)
+            out[key] = out.get(key, 0.0) + incl * tt / ct
+        if len(path) >= max_depth:
+            return
+        for callee, edge_ct in callees.get(func, ()):
+            share = incl * edge_ct / ct if ct > 0 else 0.0
+            if callee not in seen and share > 1e-6:
+                walk(callee, path, seen | {callee}, share)
 
-# --- Singleplayer (CSV-källor) ---
-CITY_CENTERS = {
-    "stockholm": (59.334, 18.063),
-    "goteborg":  (57.707, 11.967),
-    "malmo":     (55.605, 13.003),
-}
-PLACES: dict[str, dict] = {}
+    for func, st in stats.items():
+        if not st[4]:   # rötter: ingen anropare inom profilen
+            walk(func, [], {func}, st[3])
+    return out
 
-def haversine_km(lat1, lon1, lat2, lon2):
-    R = 6371.0
-    dlat = radians(lat2 - lat1); dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1))*cos(radians(lat2))*sin(dlon/2)**2
-    return 2 * R * asin(sqrt(a))
+class RequestProfiler:
+    """Profilerar en andel av anropen till valda routes och sparar de PROFILE_KEEP
+    långsammaste (min-heap på väggtid)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wrapped: list[tuple[APIRoute, object]] = []
+        self._heap: list[tuple[float, int, dict]] = []
+        self._seq = count(1)
+        self._sampler: _StackSampler | None = None
+        self._timer: threading.Timer | None = None
+        self.config: dict | None = None
+        self.profiled = 0
+        self.busy = 0   # utvalda men oprofilerade: en annan request höll cProfile
 
-def build_clue(row: dict) -> str:
-    # Ledtråd = display_name, inget annat
-    return (row.get("display_name") or "").strip() or "Okänd plats"
+    @property
+    def active(self) -> bool:
+        return self.config is not None
 
-@app.get("/api/cities")
-def api_cities():
-    items = []
-    for key, rows in CITY_PLACES.items():
-        if rows:
-            c = CITY_CENTERS.get(key, (62.0, 15.0))
-            items.append({"key": key, "center": {"lat": c[0], "lon": c[1]}})
-    return {"cities": items}
+    def start(self, routes: list[str], rate: float, mode: str, keep: int, seconds: float) -> dict:
+        targets = [r for r in app.router.routes if isinstance(r, APIRoute) and r.path in routes]
+        missing = set(routes) - {r.path for r in targets}
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Okända routes: {sorted(missing)}")
+        self.stop()
+        with self._lock:
+            self.config = {"routes": sorted(set(routes)), "rate": rate, "mode": mode, "keep": keep,
+                           "seconds": seconds, "started": time.time()}
+            self._heap, self.profiled, self.busy = [], 0, 0
+            if mode == "sample":
+                self._sampler = _StackSampler(PROFILE_SAMPLE_MS / 1000)
+            for r in targets:
+                orig = r.dependant.call
+                r.dependant.call = self._wrap(orig, r.path, ",".join(sorted(r.methods)), rate, mode)
+                self._wrapped.append((r, orig))
+            self._timer = threading.Timer(seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+        return self.stats()
 
-@app.get("/api/round")
-def api_round(city: str):
-    key = (city or "").lower().strip()
-    rows = CITY_PLACES.get(key) or []
-    if not rows:
-        raise HTTPException(status_code=400, detail=f"Ingen data för staden: {city!r}")
-    row = random.choice(rows)
-    lat = float(row["lat"]); lon = float(row["lon"])
-    pid = uuid.uuid4().hex
-    clue = build_clue(row)
-    display = (row.get("display_name") or "").strip() or clue
-    street  = (row.get("street") or "").strip()
-    address = row.get("address_full") or street or display
-    PLACES[pid] = {
-        "lat": lat, "lon": lon, "display_name": display, "clue": clue,
-        "street": street, "address": address, "city": key, "row": row
-    }
-    return {"place": {"id": pid, "lat": lat, "lon": lon, "display_name": display, "clue": clue, "street": street, "address": address}}
+    def stop(self) -> dict:
+        with self._lock:
+            for r, orig in self._wrapped:
+                r.dependant.call = orig
+            self._wrapped = []
+            if self._sampler is not None:
+                self._sampler.close()
+                self._sampler = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self.config = None
+        return self.stats()
 
-class MapGuess(BaseModel):
-    place_id: str
-    lat: float
-    lon: float
+    def _wrap(self, fn, route: str, method: str, rate: float, mode: str):
+        sampler = self._sampler
 
-@app.post("/api/guess/map")
-def api_guess_map(guess: MapGuess):
-    p = PLACES.get(guess.place_id)
-    if not p:
-        raise HTTPException(status_code=404, detail="Place not found")
-    dist_km = haversine_km(guess.lat, guess.lon, p["lat"], p["lon"])
-    score = int(dist_km * 1000 // 1)
-    return {
-        "distance_km": dist_km,
-        "score": score,
-        "solution": {"lat": p["lat"], "lon": p["lon"]},
-        "place": {
-            "id": guess.place_id,
-            "display_name": p["display_name"],
-            "clue": p["clue"],
-            "street": p.get("street",""),
-            "address": p.get("address", p.get("street",""))
-        }
+        def session():
+            """(data, enter, leave, done) eller None om en annan request redan profileras."""
+            if mode == "sample":
+                counts: dict[str, int] = {}
+                return counts, (lambda: sampler.attach(counts)), sampler.detach, lambda: None
+            if not _cprofile_busy.acquire(blocking=False):
+                self.busy += 1
+                return None
+            prof = cProfile.Profile()
+            return prof, prof.enable, prof.disable, _cprofile_busy.release
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def profiled(**kw):
+                sess = session() if random.random() < rate else None
+                if sess is None:
+                    return await fn(**kw)
+                data, enter, leave, done = sess
+                t0 = time.perf_counter()
+                try:
+                    return await _stepped(fn(**kw), enter, leave)
+                finally:
+                    done()
+                    self._record(route, method, time.perf_counter() - t0, mode, data)
+        else:
+            @functools.wraps(fn)
+            def profiled(**kw):
+                sess = session() if random.random() < rate else None
+                if sess is None:
+                    return fn(**kw)
+                data, enter, leave, done = sess
+                t0 = time.perf_counter()
+                enter()
+                try:
+                    return fn(**kw)
+                finally:
+                    leave()
+                    done()
+                    self._record(route, method, time.perf_counter() - t0, mode, data)
+        return profiled
+
+    def _record(self, route: str, method: str, elapsed: float, mode: str, data):
+        if mode == "cprofile":
+            data.create_stats()
+            data = data.stats
+        entry = {"id": next(self._seq), "route": route, "method": method, "ms": round(elapsed * 1e3, 3),
+                 "at": datetime.datetime.utcnow().isoformat(timespec="seconds"), "mode": mode, "data": data}
+        with self._lock:
+            self.profiled += 1
+            keep = self.config["keep"] if self.config else PROFILE_KEEP
+            item = (elapsed, entry["id"], entry)
+            if len(self._heap) < keep:
+                heapq.heappush(self._heap, item)
+            elif elapsed > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def profiles(self) -> list[dict]:
+        with self._lock:
+            items = sorted(self._heap, reverse=True)
+        return [{k: v for k, v in e.items() if k != "data"} for _, _, e in items]
+
+    def get(self, pid: int) -> dict | None:
+        with self._lock:
+            return next((e for _, _, e in self._heap if e["id"] == pid), None)
+
+    def stats(self) -> dict:
+        return {"active": self.active, "config": self.config, "profiled": self.profiled,
+                "skipped_busy": self.busy, "kept": len(self._heap)}
+
+PROFILER = RequestProfiler()
+
+@_on_shutdown
+def _stop_profiler():
+    PROFILER.stop()
+
+@app.post("/__admin/profile/start")
+def admin_profile_start(request: Request, routes: str = ",".join(PROFILE_ROUTES), rate: float = 0.1,
+                        mode: str = "cprofile", keep: int = PROFILE_KEEP, seconds: float = PROFILE_MAX_SEC):
+    if not _admin_authorized(request):
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
+    if mode not in ("cprofile", "sample"):
+        raise HTTPException(status_code=400, detail="mode måste vara cprofile eller sample")
+    if not 0 < rate <= 1 or not 1 <= keep <= 1000 or not 0 < seconds <= 24 * 3600:
+        raise HTTPException(status_code=400, detail="Ogiltig rate/keep/seconds")
+    paths = [p.strip() for p in routes.split(",") if p.strip()]
+    return {"ok": True, "profiler": PROFILER.start(paths, rate, mode, keep, seconds)}
+
+@app.post("/__admin/profile/stop")
+def admin_profile_stop(request: Request):
+    if not _admin_authorized(request):
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
+    return {"ok": True, "profiler": PROFILER.stop()}
+
+@app.get("/__admin/profile")
+def admin_profile_list(request: Request):
+    if not _admin_authorized(request):
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
+    return {"ok": True, "profiler": PROFILER.stats(), "profiles": PROFILER.profiles()}
+
+@app.get("/__admin/profile/{pid}")
+def admin_profile_download(request: Request, pid: int, format: str = "collapsed"):
+    """format=pstats: marshal-fil för pstats/snakeviz (bara mode=cprofile).
+    format=collapsed: "ram;ram;ram värde" per rad (µs för cprofile, antal sampel för sample)."""
+    if not _admin_authorized(request):
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
+    e = PROFILER.get(pid)
+    if e is None:
+        raise HTTPException(status_code=404, detail="Profilen finns inte (längre)")
+    name = f"profile-{pid}-{e['route'].strip('/').replace('/', '_')}"
+    if format == "pstats":
+        if e["mode"] != "cprofile":
+            raise HTTPException(status_code=400, detail="pstats finns bara för mode=cprofile")
+        return Response(marshal.dumps(e["data"]), media_type="application/octet-stream",
+                        headers={"Content-Disposition": f'attachment; filename="{name}.pstats"'})
+    if format != "collapsed":
+        raise HTTPException(status_code=400, detail="format måste vara pstats eller collapsed")
+    if e["mode"] == "cprofile":
+        lines = [f"{k} {round(v * 1e6)}" for k, v in _collapsed_from_pstats(e["data"]).items() if v >= 5e-7]
+    else:
+        lines = [f"{k} {n}" for k, n in e["data"].items()]
+    return Response("\n".join(sorted(lines)) + "\n", media_type="text/plain; charset=utf-8",
+                    headers={"Content-Disposition": f'attachment; filename="{name}.collapsed"'})
+
+# --- Pool-statistik (för övervakning) ---
+@app.get("/__admin/pool_stats")
+def admin_pool_stats(request: Request):
+    if not _admin_authorized(request):
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
+    return {"ok": True, "pool": pool_stats()}
+
+@app.get("/__admin/cache_stats")
+def admin_cache_stats(request: Request):
+    if not _admin_authorized(request):
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
+    return {"ok": True, "rounds": PLACES.stats(), "games": GAME_CACHE.stats(), "leaderboard": LB_CACHE.stats(),
+            "write_behind": WRITE_QUEUE.stats(), "results": RESULTS.stats(),
+            "codes": CODES.stats(), "places": CITIES.stats()}
+
+@_on_shutdown
+async def _shutdown_pool():
+    await run_in_threadpool(close_pool)
+    await aclose_pool()
+
+# --- Skapa mappar och mounta statiskt ---
+STATIC_DIR.mkdir(exist_ok=True)
+IMG_DIR.mkdir(parents=True, exist_ok=True)
+TEMPLATES_DIR.mkdir(parents=True, exist_ok=True)
+
+# --- Statiska filer: förkomprimerade, fingerprintade, långcachade ---
+# `python app.py build-assets` (se bin/post_compile) skriver varje fil under static/ och img/
+# till ASSETS_BUILD_DIR/<mount>/ som namn.<hash>.ext plus .gz/.br-varianter och en
+# manifest.json. Fingerprintade URL:er är oföränderliga (immutable, ett år); de vanliga
+# URL:erna fungerar som förut men med ETag + no-cache. Utan bygge serveras källfilerna.
+ASSETS_BUILD_DIR = Path(os.getenv("ASSETS_BUILD_DIR", str(APP_DIR / "static_build")))
+ASSET_HASH_LEN   = 10
+_COMPRESSIBLE    = {".html", ".js", ".css", ".svg", ".json", ".txt", ".map", ".xml"}
+_IMMUTABLE       = "public, max-age=31536000, immutable"
+_REVALIDATE      = "no-cache"
+_ENCODINGS       = (("br", ".br"), ("gzip", ".gz"))   # serverns preferensordning
+
+def _compress(data: bytes, enc: str) -> bytes:
+    if enc == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def _accepted(request: Request) -> set[str]:
+    """Kodningar klienten accepterar (q=0 betyder nej)."""
+    out = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, q = part.strip().partition(";")
+        if name and q.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            out.add(name.strip().lower())
+    return out
+
+def _media_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+class AssetServer:
+    """Serverar en katalog (static/ eller img/) med content negotiation och ETag.
+
+    manifest: logisk sökväg -> {hash, file, mtime_ns, size, encodings}. En fingerprintad
+    fil hämtas alltid ur bygget; en vanlig sökväg använder byggets varianter bara om
+    källfilen är oförändrad (mtime + storlek), annars källfilen direkt."""
+    def __init__(self, root: Path, mount: str):
+        self.root = root.resolve()
+        self.mount = mount
+        self.dist = ASSETS_BUILD_DIR / mount
+        self.manifest: dict[str, dict] = {}
+        self.by_file: dict[str, str] = {}
+        self.version = 0
+        self.reload()
+
+    def reload(self):
+        path = self.dist / "manifest.json"
+        try:
+            manifest = json.loads(path.read_text(encoding="utf-8"))["assets"]
+        except (OSError, ValueError, KeyError):
+            manifest = {}
+        self.manifest = manifest
+        self.by_file = {m["file"]: name for name, m in manifest.items()}
+        self.version += 1
+
+    def build(self) -> dict:
+        """Skriv fingerprintade filer + komprimerade varianter och manifest.json."""
+        self.dist.mkdir(parents=True, exist_ok=True)
+        assets = {}
+        for src in sorted(self.root.rglob("*")):
+            rel = src.relative_to(self.root).as_posix()
+            if not src.is_file() or any(p.startswith(".") for p in rel.split("/")):
+                continue
+            data = src.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()[:ASSET_HASH_LEN]
+            stem, dot, ext = rel.rpartition(".")
+            hashed = f"{stem}.{digest}.{ext}" if dot and "/" not in ext else f"{rel}.{digest}"
+            out = self.dist / hashed
+            out.parent.mkdir(parents=True, exist_ok=True)
+            encodings = []
+            if not out.exists():
+                _write_atomic(out, data)
+            if src.suffix.lower() in _COMPRESSIBLE:
+                for enc, suffix in _ENCODINGS:
+                    if enc == "br" and brotli is None:
+                        continue
+                    packed = _compress(data, enc)
+                    if len(packed) < len(data) * 0.9:
+                        if not out.with_name(out.name + suffix).exists():
+                            _write_atomic(out.with_name(out.name + suffix), packed)
+                        encodings.append(enc)
+            st = src.stat()
+            assets[rel] = {"hash": digest, "file": hashed, "mtime_ns": st.st_mtime_ns,
+                           "size": st.st_size, "encodings": encodings}
+        _write_atomic(self.dist / "manifest.json",
+                      json.dumps({"assets": assets}, indent=1, sort_keys=True).encode("utf-8"))
+        self.reload()
+        return assets
+
+    def fresh(self, name: str) -> dict | None:
+        """Manifestposten om källfilen är oförändrad sedan bygget."""
+        m = self.manifest.get(name)
+        if m is None:
+            return None
+        try:
+            st = (self.root / name).stat()
+        except OSError:
+            return None
+        return m if (st.st_mtime_ns, st.st_size) == (m["mtime_ns"], m["size"]) else None
+
+    def url(self, name: str) -> str | None:
+        m = self.fresh(name)
+        return f"/{self.mount}/{m['file']}" if m else None
+
+    def _source(self, path: str) -> Path | None:
+        src = (self.root / path).resolve()
+        if not src.is_relative_to(self.root) or not src.is_file():
+            return None
+        return src
+
+    def response(self, request: Request, path: str) -> Response:
+        name = self.by_file.get(path)
+        if name is not None:
+            m, cache = self.manifest[name], _IMMUTABLE
+        else:
+            name, m, cache = path, self.fresh(path), _REVALIDATE
+        if m is None:
+            src = self._source(path)
+            if src is None:
+                raise HTTPException(status_code=404, detail="Filen finns inte")
+            st = src.stat()
+            etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+            if _etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache})
+            return FileResponse(src, headers={"ETag": etag, "Cache-Control": cache})
+        accepted = _accepted(request)
+        enc = next((e for e, _ in _ENCODINGS if e in m["encodings"] and e in accepted), None)
+        suffix = dict(_ENCODINGS).get(enc, "")
+        etag = f'"{m["hash"]}{"-" + enc if enc else ""}"'
+        headers = {"ETag": etag, "Cache-Control": cache}
+        if m["encodings"]:
+            headers["Vary"] = "Accept-Encoding"
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        if enc:
+            headers["Content-Encoding"] = enc
+        return FileResponse(self.dist / (m["file"] + suffix), media_type=_media_type(name), headers=headers)
+
+def _write_atomic(path: Path, data: bytes):
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+STATIC_ASSETS = AssetServer(STATIC_DIR, "static")
+IMG_ASSETS    = AssetServer(IMG_DIR, "img")
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+def static_file(request: Request, path: str):
+    return STATIC_ASSETS.response(request, path)
+
+@app.api_route("/img/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+def img_file(request: Request, path: str):
+    return IMG_ASSETS.response(request, path)
+
+def build_assets() -> dict:
+    return {srv.mount: srv.build() for srv in (STATIC_ASSETS, IMG_ASSETS)}
+
+templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+
+# --- CSV-data ---
+# Städerna upptäcks i data/ (places_<stad>.csv) och data/cities.json, se CityRegistry.
+CITY_FILES: dict[str, Path] = {}   # stad -> CSV, fylls av CITIES.reset()
+# Kolumnlagrad platsdata: lat/lon i sammanhängande float-arrayer (NumPy om det finns),
+# strängkolumner med delade (deduplicerade) strängar. Rader läses via lätta PlaceRow-vyer.
+_STR_COLS = ("id", "display_name", "alt_names", "street", "postnummer", "ort", "kommun", "lan", "svardighet")
+_MISSING = object()
+
+class PlaceRow:
+    """Dict-lik vy av en rad i PlaceColumns (row.get("street"), row["lat"] ...)."""
+    __slots__ = ("_cols", "_i")
+
+    def __init__(self, cols: "PlaceColumns", i: int):
+        self._cols = cols
+        self._i = i
+
+    def get(self, key: str, default=None):
+        c, i = self._cols, self._i
+        if key == "lat":
+            return float(c.lat[i])
+        if key == "lon":
+            return float(c.lon[i])
+        if key == "address_full":
+            return c.address_full(i)
+        col = c.str_cols.get(key)
+        return col[i] if col is not None else default
+
+    def __getitem__(self, key: str):
+        v = self.get(key, _MISSING)
+        if v is _MISSING:
+            raise KeyError(key)
+        return v
+
+    def keys(self):
+        return (*_STR_COLS, "lat", "lon", "address_full")
+
+    def as_dict(self) -> dict:
+        return {k: self.get(k) for k in self.keys()}
+
+    def __eq__(self, other):
+        return isinstance(other, PlaceRow) and other._cols is self._cols and other._i == self._i
+
+    def __hash__(self):
+        return hash((id(self._cols), self._i))
+
+class PlaceColumns(Sequence):
+    """Kolumnlager för en stads platser. Beter sig som en sekvens av PlaceRow."""
+
+    def __init__(self, str_cols: dict[str, list[str]], lat: list[float], lon: list[float]):
+        self.str_cols = str_cols
+        self.lat = np.asarray(lat, dtype=np.float64) if np is not None else array("d", lat)
+        self.lon = np.asarray(lon, dtype=np.float64) if np is not None else array("d", lon)
+
+    @classmethod
+    def from_columns(cls, str_cols: dict, lat, lon) -> "PlaceColumns":
+        """Färdiga kolumner (t.ex. ur snapshot): lat/lon används som de är, utan kopiering."""
+        self = cls.__new__(cls)
+        self.str_cols, self.lat, self.lon = str_cols, lat, lon
+        return self
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[dict]) -> "PlaceColumns":
+        cols: dict[str, list[str]] = {k: [] for k in _STR_COLS}
+        pools: dict[str, dict[str, str]] = {k: {} for k in _STR_COLS}
+        lat: list[float] = []; lon: list[float] = []
+        for r in rows:
+            for k in _STR_COLS:
+                v = r.get(k) or ""
+                cols[k].append(pools[k].setdefault(v, v))
+            lat.append(r["lat"]); lon.append(r["lon"])
+        return cls(cols, lat, lon)
+
+    def __len__(self):
+        return len(self.lat)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [PlaceRow(self, j) for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError(i)
+        return PlaceRow(self, i)
+
+    def address_full(self, i: int) -> str:
+        c = self.str_cols
+        return ", ".join(p for p in (c["street"][i], c["postnummer"][i], c["ort"][i]) if p)
+
+    def distances_km(self, lat: float, lon: float):
+        """Avstånd (km) från en punkt till alla platser, i ett batchanrop."""
+        return haversine_km_many(lat, lon, self.lat, self.lon)
+
+class PlaceGrid:
+    """Rutnätsindex (ungefär cell_km x cell_km) över en stads platser.
+
+    Stödjer k-närmaste och inom-radie; kandidaterna ur närliggande celler
+    avståndsberäknas i ett batchanrop med haversine_km_many.
+    """
+    KM_PER_DEG = 111.32
+
+    def __init__(self, places: PlaceColumns, cell_km: float = 1.0):
+        self.places = places
+        self.cell_km = cell_km
+        self.dlat = cell_km / self.KM_PER_DEG
+        lats = list(places.lat)
+        mid = (min(lats) + max(lats)) / 2 if lats else 0.0
+        self.dlon = cell_km / (self.KM_PER_DEG * max(0.01, cos(radians(mid))))
+        # smalaste cellen i km (längst från ekvatorn) -> garanterad täckning per ring
+        far = max((abs(x) for x in lats), default=0.0)
+        self._min_cell_km = min(cell_km, self.dlon * self.KM_PER_DEG * max(0.01, cos(radians(far))))
+        self.cells: dict[tuple[int, int], list[int]] = {}
+        for i, (la, lo) in enumerate(zip(lats, places.lon)):
+            self.cells.setdefault(self._cell(la, lo), []).append(i)
+        keys = list(self.cells) or [(0, 0)]
+        self._span = max(max(k[0] for k in keys) - min(k[0] for k in keys),
+                         max(k[1] for k in keys) - min(k[1] for k in keys)) + 1
+
+    def _cell(self, lat: float, lon: float) -> tuple[int, int]:
+        return (int(lat // self.dlat), int(lon // self.dlon))
+
+    def _dists(self, lat: float, lon: float, idx: list[int]):
+        if np is not None:
+            ia = np.asarray(idx, dtype=np.intp)
+            return haversine_km_many(lat, lon, self.places.lat[ia], self.places.lon[ia])
+        return haversine_km_many(lat, lon, [self.places.lat[i] for i in idx], [self.places.lon[i] for i in idx])
+
+    def _ring(self, c: tuple[int, int], r: int) -> Iterable[int]:
+        cy, cx = c
+        if r == 0:
+            yield from self.cells.get(c, ())
+            return
+        for dy in range(-r, r + 1):
+            step = 1 if abs(dy) == r else 2 * r  # hela raden på kanten, annars bara ändarna
+            for dx in range(-r, r + 1, step):
+                yield from self.cells.get((cy + dy, cx + dx), ())
+
+    def within(self, lat: float, lon: float, radius_km: float) -> list[tuple[int, float]]:
+        """(radindex, km) för alla platser inom radius_km, sorterat på avstånd."""
+        rings = int(radius_km / self._min_cell_km) + 1
+        c = self._cell(lat, lon)
+        idx = [i for r in range(min(rings, self._span) + 1) for i in self._ring(c, r)]
+        if rings > self._span:
+            idx = range(len(self.places))
+        if not idx:
+            return []
+        idx = list(idx)
+        out = [(i, float(d)) for i, d in zip(idx, self._dists(lat, lon, idx)) if d <= radius_km]
+        out.sort(key=lambda t: t[1])
+        return out
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> list[tuple[int, float]]:
+        """De k närmaste platserna som (radindex, km), närmast först."""
+        k = min(k, len(self.places))
+        if k <= 0:
+            return []
+        c = self._cell(lat, lon)
+        # hoppa direkt till ringen där punkten hamnar inom rutnätet (klick utanför staden)
+        start = 0
+        if c not in self.cells and self.cells:
+            start = max(0, min(max(abs(c[0] - ky), abs(c[1] - kx)) for ky, kx in self.cells) - 1)
+        idx = [i for r in range(start + 1) for i in self._ring(c, r)]
+        r = start
+        while True:
+            if len(idx) >= k:
+                d = self._dists(lat, lon, idx)
+                best = sorted(zip(idx, (float(x) for x in d)), key=lambda t: t[1])[:k]
+                # allt inom r*min_cell_km är garanterat sett -> klart om k:te ligger innanför
+                if best[-1][1] <= r * self._min_cell_km or r > self._span + start:
+                    return best
+            r += 1
+            idx.extend(self._ring(c, r))
+
+CITY_PLACES: dict[str, PlaceColumns] = {}
+CITY_GRIDS: dict[str, PlaceGrid] = {}
+PLACE_GRID_CELL_KM = float(os.getenv("PLACE_GRID_CELL_KM", "1.0"))
+CITY_PLACE_INDEX: dict[str, dict[str, int]] = {}   # city -> id -> radindex
+PLACE_INDEX: dict[tuple[str, str], int] = {}        # (city, id) -> radindex (alla städer)
+
+def _to_float(s: str | None):
+    try:
+        return float(str(s).replace(",", "."))
+    except Exception:
+        return None
+
+def _read_city_csv(path: Path) -> Iterable[dict]:
+    with path.open("r", encoding="utf-8-sig", newline="") as f:
+        for r in csv.DictReader(f):
+            lat = _to_float(r.get("lat")); lon = _to_float(r.get("lon"))
+            if lat is None or lon is None:
+                continue
+            row = {k: (r.get(k) or "").strip() for k in _STR_COLS}
+            row["lat"] = lat; row["lon"] = lon
+            yield row
+
+# --- Binär snapshot av platsdatan (snabb kallstart) ---
+# Byggs med `python app.py build-snapshot` (se bin/post_compile). Layout: SNAPSHOT_MAGIC,
+# u32 version, u32 headerlängd, JSON-header, sedan 8-bytesjusterade sektioner per stad:
+# lat/lon (float64), per strängkolumn en pool ("\0"-separerad UTF-8) + uint32-index per rad.
+# Filen mmap:as; en stad vars CSV ändrats (mtime/storlek och sha256) läses från CSV i stället.
+PLACES_SNAPSHOT  = os.getenv("PLACES_SNAPSHOT", str(DATA_DIR / "places.snapshot"))  # "0" = av
+SNAPSHOT_MAGIC   = b"GGPLACES"
+SNAPSHOT_VERSION = 1
+_snapshot_mm = None      # mmap hålls öppen så länge kolumnerna pekar in i den
+_places_source: dict[str, str] = {}   # city -> "snapshot" | "csv"
+
+class _PooledColumn(Sequence):
+    """Strängkolumn ur snapshot: uint32-index in i en delad pool av strängar."""
+    __slots__ = ("pool", "idx")
+
+    def __init__(self, pool: list[str], idx):
+        self.pool = pool
+        self.idx = idx
+
+    def __len__(self):
+        return len(self.idx)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.pool[j] for j in self.idx[i]]
+        return self.pool[self.idx[i]]
+
+    def __iter__(self):
+        return map(self.pool.__getitem__, self.idx)
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _snapshot_path() -> Path | None:
+    return Path(PLACES_SNAPSHOT) if PLACES_SNAPSHOT not in ("", "0") else None
+
+def build_places_snapshot(path: Path | None = None) -> dict:
+    """Kompilera CITY_FILES till en snapshot (skrivs atomiskt). Returnerar headern."""
+    path = path or _snapshot_path()
+    if path is None:
+        raise RuntimeError("PLACES_SNAPSHOT är avstängt")
+    blobs: list[bytes] = []
+    pos = 0
+
+    def section(data: bytes) -> int:
+        nonlocal pos
+        off = pos
+        blobs.append(data + b"\0" * (-len(data) % 8))
+        pos += len(blobs[-1])
+        return off
+
+    cities = {}
+    for city, src in CITY_FILES.items():
+        if not src.exists():
+            continue
+        cols = PlaceColumns.from_rows(_read_city_csv(src))
+        st = src.stat()
+        meta = {"source": src.name, "mtime_ns": st.st_mtime_ns, "size": st.st_size,
+                "sha256": _file_sha256(src), "n": len(cols), "center": _center(cols.lat, cols.lon),
+                "lat": section(array("d", cols.lat).tobytes()),
+                "lon": section(array("d", cols.lon).tobytes()), "strings": {}}
+        for k in _STR_COLS:
+            pool: dict[str, int] = {}
+            idx = array("I", (pool.setdefault(v, len(pool)) for v in cols.str_cols[k]))
+            blob = "\0".join(pool).encode("utf-8")
+            meta["strings"][k] = [section(blob), len(blob), section(idx.tobytes())]
+        cities[city] = meta
+
+    header = json.dumps({"version": SNAPSHOT_VERSION, "byteorder": "little", "cols": list(_STR_COLS),
+                         "cities": cities}).encode("utf-8")
+    prefix = SNAPSHOT_MAGIC + SNAPSHOT_VERSION.to_bytes(4, "little") + len(header).to_bytes(4, "little") + header
+    prefix += b"\0" * (-len(prefix) % 8)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(prefix)
+        for b in blobs:
+            f.write(b)
+    os.replace(tmp, path)
+    return json.loads(header)
+
+def _snapshot_fresh(meta: dict, src: Path) -> bool:
+    """Samma CSV som snapshoten byggdes från? mtime+storlek räcker, annars sha256
+    (en ny checkout ändrar mtime men inte innehållet)."""
+    if not src.exists() or src.name != meta.get("source"):
+        return False
+    st = src.stat()
+    if st.st_size != meta["size"]:
+        return False
+    return st.st_mtime_ns == meta["mtime_ns"] or _file_sha256(src) == meta["sha256"]
+
+def _open_snapshot() -> tuple[memoryview, dict] | None:
+    global _snapshot_mm
+    path = _snapshot_path()
+    if path is None or not path.exists() or sys.byteorder != "little":
+        return None
+    try:
+        with path.open("rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:8] != SNAPSHOT_MAGIC or int.from_bytes(mm[8:12], "little") != SNAPSHOT_VERSION:
+            raise ValueError("fel format/version")
+        n = int.from_bytes(mm[12:16], "little")
+        header = json.loads(mm[16:16 + n])
+        if header.get("cols") != list(_STR_COLS):
+            raise ValueError("andra kolumner")
+    except (OSError, ValueError) as e:
+        log.warning("Snapshot %s används inte (%s), läser CSV", path, e)
+        return None
+    _snapshot_mm = mm
+    base = 16 + n + (-(16 + n) % 8)
+    return memoryview(mm)[base:], header
+
+def _snapshot_columns(buf: memoryview, meta: dict) -> PlaceColumns:
+    n = meta["n"]
+
+    def floats(off: int):
+        if np is not None:
+            return np.frombuffer(buf, dtype="<f8", count=n, offset=off)
+        return buf[off:off + 8 * n].cast("d")
+
+    str_cols = {}
+    for k, (pool_off, pool_len, idx_off) in meta["strings"].items():
+        pool = str(buf[pool_off:pool_off + pool_len], "utf-8").split("\0")
+        str_cols[k] = _PooledColumn(pool, buf[idx_off:idx_off + 4 * n].cast("I"))
+    return PlaceColumns.from_columns(str_cols, floats(meta["lat"]), floats(meta["lon"]))
+
+# --- Stadsregister: metadata för alla städer, platserna laddas vid första användning ---
+CITY_MANIFEST   = Path(os.getenv("CITY_MANIFEST", str(DATA_DIR / "cities.json")))
+PLACES_CACHE_MB = float(os.getenv("PLACES_CACHE_MB", "256"))   # minnesbudget för laddade städer
+DEFAULT_CENTER  = (62.0, 15.0)
+
+@dataclass
+class CityInfo:
+    key: str
+    path: Path
+    name: str
+    center: tuple[float, float] | None = None   # manifest vinner, annars median ur datan
+    n: int | None = None                        # antal platser, None = inte räknat än
+
+def _center(lats, lons) -> list[float] | None:
+    """Stadens centrum som median av lat/lon (tål enstaka platser långt utanför)."""
+    if not len(lats):
+        return None
+    mid = len(lats) // 2
+    return [round(sorted(lats)[mid], 5), round(sorted(lons)[mid], 5)]
+
+def _scan_city(path: Path) -> tuple[int, list[float] | None]:
+    """(antal, centrum) ur en CSV utan att bygga kolumnerna: bara lat/lon läses."""
+    lats: list[float] = []; lons: list[float] = []
+    if path.exists():
+        with path.open("r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            head = next(reader, [])
+            if "lat" in head and "lon" in head:
+                ia, io = head.index("lat"), head.index("lon")
+                for r in reader:
+                    lat = _to_float(r[ia]) if len(r) > ia else None
+                    lon = _to_float(r[io]) if len(r) > io else None
+                    if lat is not None and lon is not None:
+                        lats.append(lat); lons.append(lon)
+    return len(lats), _center(lats, lons)
+
+def _discover_cities() -> dict[str, CityInfo]:
+    """Alla data/places_<stad>.csv, kompletterade med data/cities.json om den finns:
+    {"<stad>": {"name": "...", "file": "...", "center": [lat, lon]}} (alla fält valfria)."""
+    found = {p.stem[len("places_"):].lower(): CityInfo(p.stem[len("places_"):].lower(), p, "")
+             for p in sorted(DATA_DIR.glob("places_*.csv"))}
+    if CITY_MANIFEST.exists():
+        manifest = json.loads(CITY_MANIFEST.read_text(encoding="utf-8"))
+        for key, m in manifest.get("cities", manifest).items():
+            key = key.lower().strip()
+            ci = found.setdefault(key, CityInfo(key, DATA_DIR / f"places_{key}.csv", ""))
+            if m.get("file"):
+                ci.path = DATA_DIR / m["file"]
+            ci.name = m.get("name") or ci.name
+            if m.get("center"):
+                ci.center = (float(m["center"][0]), float(m["center"][1]))
+    for ci in found.values():
+        ci.name = ci.name or ci.key.capitalize()
+    return found
+
+def _places_nbytes(cols: PlaceColumns) -> int:
+    """Ungefärligt minne för en laddad stad: kolumner + strängar + id-index/rutnät (~120 B/rad)."""
+    n = len(cols)
+    size = 16 * n + 120 * n
+    for col in cols.str_cols.values():
+        if isinstance(col, _PooledColumn):
+            size += 4 * n + sum(map(sys.getsizeof, col.pool))
+        else:
+            size += 8 * n + sum(map(sys.getsizeof, set(col)))
+    return size
+
+class CityRegistry:
+    """Vilka städer som finns (metadata i minnet) och vilka som är laddade.
+
+    /api/cities svarar ur metadatan (antal + centrum från snapshot-headern, manifestet
+    eller en lat/lon-scanning av CSV:n) utan att ladda några rader. Platserna för en
+    stad läses (snapshot eller CSV) när någon först behöver dem och hålls i en LRU;
+    minst använda städer släpps när PLACES_CACHE_MB överskrids.
+    """
+    def __init__(self, budget_bytes: int):
+        self.budget = budget_bytes
+        self._info: dict[str, CityInfo] = {}
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()   # laddade städer, äldst först
+        self._snapshot: tuple[memoryview, dict] | None = None
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def reset(self):
+        """Upptäck städerna på nytt och släpp allt som är laddat."""
+        info = _discover_cities()
+        snap = _open_snapshot()
+        with self._lock:
+            for key in list(CITY_PLACES):
+                self._drop(key)
+            self._info, self._snapshot = info, snap
+            CITY_FILES.clear()
+            CITY_FILES.update((k, ci.path) for k, ci in info.items())
+
+    def __contains__(self, key) -> bool:
+        return key in self._info
+
+    def keys(self) -> list[str]:
+        return list(self._info)
+
+    def name(self, key: str) -> str | None:
+        ci = self._info.get(key)
+        return ci.name if ci else None
+
+    def _snap_meta(self, key: str) -> dict | None:
+        meta = self._snapshot[1]["cities"].get(key) if self._snapshot else None
+        return meta if meta is not None and _snapshot_fresh(meta, self._info[key].path) else None
+
+    def info(self, key: str) -> CityInfo | None:
+        """Metadata med antal och centrum; räknas fram en gång, utan att ladda staden."""
+        ci = self._info.get(key)
+        if ci is None or ci.n is not None:
+            return ci
+        with self._lock:
+            if ci.n is None:
+                meta = self._snap_meta(key)
+                if meta is not None and "center" in meta:
+                    n, center = meta["n"], meta["center"]
+                elif key in CITY_PLACES:
+                    cols = CITY_PLACES[key]
+                    n, center = len(cols), _center(cols.lat, cols.lon)
+                else:
+                    n, center = _scan_city(ci.path)
+                ci.center = ci.center or (tuple(center) if center else None)
+                ci.n = n
+        return ci
+
+    def center(self, key: str) -> tuple[float, float]:
+        ci = self.info(key)
+        return ci.center if ci and ci.center else DEFAULT_CENTER
+
+    def places(self, key: str) -> PlaceColumns | None:
+        """Stadens platser (laddas vid behov), None för okänd stad."""
+        cols = CITY_PLACES.get(key)
+        if cols is None and key not in self._info:
+            return None
+        with self._lock:
+            cols = CITY_PLACES.get(key)
+            if cols is None:
+                return self._load(key)
+            if key in self._sizes:
+                self._sizes.move_to_end(key)
+            self.hits += 1
+            return cols
+
+    def _load(self, key: str) -> PlaceColumns:
+        path = self._info[key].path
+        meta = self._snap_meta(key)
+        if meta is not None:
+            cols, _places_source[key] = _snapshot_columns(self._snapshot[0], meta), "snapshot"
+        else:
+            if self._snapshot and key in self._snapshot[1]["cities"]:
+                log.warning("%s har ändrats sedan snapshoten byggdes, läser CSV", path.name)
+            cols = PlaceColumns.from_rows(_read_city_csv(path) if path.exists() else ())
+            _places_source[key] = "csv"
+        CITY_PLACES[key] = cols
+        _index_places(key, cols)
+        CITY_GRIDS.pop(key, None)  # byggs vid första användning, se _city_grid
+        self._sizes[key] = _places_nbytes(cols)
+        self.loads += 1
+        while sum(self._sizes.values()) > self.budget and len(self._sizes) > 1:
+            self._drop(next(iter(self._sizes)))
+            self.evictions += 1
+        return cols
+
+    def _drop(self, key: str):
+        CITY_PLACES.pop(key, None)
+        CITY_GRIDS.pop(key, None)
+        for pid in CITY_PLACE_INDEX.pop(key, {}):
+            PLACE_INDEX.pop((key, pid), None)
+        self._sizes.pop(key, None)
+        _places_source.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cities": len(self._info), "loaded": len(self._sizes),
+                    "loaded_mb": round(sum(self._sizes.values()) / 1e6, 2),
+                    "budget_mb": round(self.budget / 1e6, 2), "hits": self.hits, "loads": self.loads,
+                    "evictions": self.evictions, "source": dict(_places_source)}
+
+CITIES = CityRegistry(int(PLACES_CACHE_MB * 1024 * 1024))
+
+def load_places():
+    """Läs om stadsregistret; städernas platser laddas först när de används."""
+    CITIES.reset()
+
+_grid_lock = threading.Lock()
+
+def _city_grid(key: str) -> PlaceGrid | None:
+    """Stadens rutnätsindex; byggs lat vid första anropet så att starten slipper det."""
+    grid = CITY_GRIDS.get(key)
+    if grid is None:
+        places = CITIES.places(key)
+        if places is None:
+            return None
+        with _grid_lock:
+            grid = CITY_GRIDS.get(key)
+            if grid is None or grid.places is not places:
+                grid = PlaceGrid(places, PLACE_GRID_CELL_KM)
+                if CITY_PLACES.get(key) is places:
+                    CITY_GRIDS[key] = grid
+    return grid
+
+def _index_places(city: str, places: PlaceColumns):
+    """Bygg id->radindex för staden (första raden vinner vid dubbletter, som den gamla scanningen)."""
+    for pid in CITY_PLACE_INDEX.get(city, {}):
+        PLACE_INDEX.pop((city, pid), None)
+    idx: dict[str, int] = {}
+    for i, pid in enumerate(places.str_cols["id"]):
+        idx.setdefault(pid, i)
+    CITY_PLACE_INDEX[city] = idx
+    PLACE_INDEX.update(((city, pid), i) for pid, i in idx.items())
+
+load_places()
+
+# --- Root (servera /static/index.html) ---
+_STATIC_REF = re.compile(r"/static/([\w./-]+)")
+
+class IndexPage:
+    """static/index.html i minnet, med fingerprintade asset-URL:er och färdiga
+    gzip/br-varianter. Läses om bara när filens mtime (eller asset-bygget) ändras."""
+    def __init__(self, path: Path):
+        self.path = path
+        self._key = None
+        self._bodies: dict[str | None, bytes] = {}
+        self._etag = ""
+        self._lock = threading.Lock()
+
+    def _load(self, key):
+        html = self.path.read_text(encoding="utf-8")
+        html = _STATIC_REF.sub(lambda m: STATIC_ASSETS.url(m.group(1)) or m.group(0), html)
+        body = html.encode("utf-8")
+        bodies: dict[str | None, bytes] = {None: body}
+        for enc, _ in _ENCODINGS:
+            if enc != "br" or brotli is not None:
+                bodies[enc] = _compress(body, enc)
+        self._bodies, self._etag = bodies, '"' + hashlib.sha256(body).hexdigest()[:16]
+        self._key = key
+
+    def response(self, request: Request) -> Response:
+        try:
+            st = self.path.stat()
+        except OSError:
+            return HTMLResponse("<h1>Index.html saknas i /static</h1>")
+        key = (st.st_mtime_ns, st.st_size, STATIC_ASSETS.version)
+        if key != self._key:
+            with self._lock:
+                if key != self._key:
+                    self._load(key)
+        bodies, accepted = self._bodies, _accepted(request)
+        enc = next((e for e, _ in _ENCODINGS if e in bodies and e in accepted), None)
+        etag = self._etag + (f"-{enc}" if enc else "") + '"'
+        headers = {"ETag": etag, "Cache-Control": _REVALIDATE, "Vary": "Accept-Encoding"}
+        if _etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+        if enc:
+            headers["Content-Encoding"] = enc
+        return Response(bodies[enc], media_type="text/html; charset=utf-8", headers=headers)
+
+INDEX_PAGE = IndexPage(STATIC_DIR / "index.html")
+
+@app.get("/", response_class=HTMLResponse)
+def root(request: Request):
+    return INDEX_PAGE.response(request)
+
+# --- Skapa bas-tabeller om de saknas (feedback/leaderboard) ---
+@_on_startup
+def _ensure_base_tables():
+    """Körs vid start (lifespan), inte vid import: import av app rör inte databasen."""
+    if USE_PG:
+        _exec("""
+        CREATE TABLE IF NOT EXISTS feedback (
+          id          BIGSERIAL PRIMARY KEY,
+          created_at  TIMESTAMPTZ NOT NULL,
+          name        TEXT,
+          email       TEXT,
+          category    TEXT,
+          message     TEXT NOT NULL
+        )""")
+        _exec("""
+        CREATE TABLE IF NOT EXISTS leaderboard (
+          id          BIGSERIAL PRIMARY KEY,
+          created_at  TIMESTAMPTZ NOT NULL,
+          name        TEXT NOT NULL,
+          score       INTEGER NOT NULL,
+          rounds      INTEGER NOT NULL,
+          city        TEXT
+        )""")
+    else:
+        _exec("""
+        CREATE TABLE IF NOT EXISTS feedback (
+          id          INTEGER PRIMARY KEY AUTOINCREMENT,
+          created_at  TEXT NOT NULL,
+          name        TEXT,
+          email       TEXT,
+          category    TEXT,
+          message     TEXT NOT NULL
+        )""")
+        _exec("""
+        CREATE TABLE IF NOT EXISTS leaderboard (
+          id          INTEGER PRIMARY KEY AUTOINCREMENT,
+          created_at  TEXT NOT NULL,
+          name        TEXT NOT NULL,
+          score       INTEGER NOT NULL,
+          rounds      INTEGER NOT NULL,
+          city        TEXT
+        )""")
+
+    # Index för topplistan: bästa per stad/globalt och senaste
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_city_score   ON leaderboard(city, score, id)",
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_score        ON leaderboard(score, id)",
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_created      ON leaderboard(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_leaderboard_city_created ON leaderboard(city, created_at)",
+    ):
+        _exec(ddl)
+
+# --- Write-behind: batchade INSERTs för feedback/leaderboard (valfritt) ---
+WRITE_BEHIND       = os.getenv("WRITE_BEHIND", "0") == "1"
+WB_BATCH_SIZE      = int(os.getenv("WB_BATCH_SIZE", "200"))
+WB_FLUSH_SEC       = float(os.getenv("WB_FLUSH_MS", "250")) / 1000
+WB_QUEUE_MAX       = int(os.getenv("WB_QUEUE_MAX", "10000"))
+WB_PUT_TIMEOUT_SEC = float(os.getenv("WB_PUT_TIMEOUT_SEC", "2"))   # backpressure innan 503
+WB_RETRIES         = int(os.getenv("WB_RETRIES", "3"))              # nya försök för en misslyckad batch
+WB_RETRY_SEC       = float(os.getenv("WB_RETRY_MS", "200")) / 1000  # backoff, dubblas per försök
+
+class WriteBehindQueue:
+    """Samlar INSERTs i en begränsad kö och skriver dem i batchar (executemany, en transaktion).
+
+    Flushar när WB_BATCH_SIZE rader väntar eller WB_FLUSH_SEC har gått. Är kön full
+    blockerar submit() upp till WB_PUT_TIMEOUT_SEC och svarar sedan 503. En batch som
+    misslyckas försöks igen WB_RETRIES gånger med backoff (skrivartråden väntar, så kön
+    ger backpressure); därefter skrivs raderna en och en så att bara trasiga rader tappas.
+    """
+    def __init__(self):
+        self._q: queue.Queue = queue.Queue(maxsize=WB_QUEUE_MAX)
+        self._tables: dict[str, tuple[str, str, object]] = {}   # namn -> (sql_pg, sql_sqlite, after_commit)
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.submitted = self.written = self.batches = self.rejected = self.errors = self.dropped = 0
+
+    def register(self, name: str, sql_pg: str, sql_sqlite: str, after_commit=None):
+        """after_commit(rows, ids, created) anropas efter commit med de nya id:na."""
+        self._tables[name] = (sql_pg, sql_sqlite, after_commit)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._start_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                    self._thread.start()
+
+    def submit(self, name: str, params: tuple):
+        self._ensure_thread()
+        try:
+            self._q.put((name, params), timeout=WB_PUT_TIMEOUT_SEC)
+        except queue.Full:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Servern är överbelastad, försök igen")
+        self.submitted += 1
+
+    def _drain(self, first=None) -> list:
+        items = [first] if first is not None else []
+        while len(items) < WB_BATCH_SIZE:
+            try:
+                items.append(self._q.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._q.get(timeout=WB_FLUSH_SEC)
+            except queue.Empty:
+                continue
+            # vänta in fler rader upp till flush-intervallet, om batchen inte redan är full
+            items = [first]
+            deadline = time.monotonic() + WB_FLUSH_SEC
+            while len(items) < WB_BATCH_SIZE and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(items)
+
+    def _write(self, items: list):
+        if not items:
+            return
+        for attempt in range(WB_RETRIES + 1):
+            try:
+                self._write_batch(items)
+                return
+            except Exception as e:
+                self.errors += 1
+                if attempt == WB_RETRIES:
+                    log.error("write-behind: batch på %d rader misslyckades efter %d försök: %s",
+                              len(items), attempt + 1, e)
+                    break
+                delay = WB_RETRY_SEC * 2 ** attempt
+                log.warning("write-behind: batch på %d rader misslyckades (%s), nytt försök om %.2f s",
+                            len(items), e, delay)
+                time.sleep(delay)
+        if len(items) == 1:
+            self.dropped += 1
+            log.error("write-behind: rad till %s tappad: %r", items[0][0], items[0][1])
+            return
+        # rad för rad, ett försök var: en trasig rad ska inte ta med sig resten av batchen
+        for item in items:
+            try:
+                self._write_batch([item])
+            except Exception as e:
+                self.errors += 1
+                self.dropped += 1
+                log.error("write-behind: rad till %s tappad (%s): %r", item[0], e, item[1])
+
+    def _write_batch(self, items: list):
+        by_table: dict[str, list[tuple]] = {}
+        for name, params in items:
+            by_table.setdefault(name, []).append(params)
+        with self._flush_lock:
+            done = []
+            with _db(write=True) as cur, (cur.connection.transaction() if USE_PG else nullcontext()):
+                # PG-poolen kör autocommit: utan transaktion committas varje rad för sig
+                for name, rows in by_table.items():
+                    sql_pg, sql_sqlite, after = self._tables[name]
+                    if USE_PG:
+                        cur.executemany(sql_pg, rows, returning=True)
+                        ret = []
+                        while True:
+                            ret.append(cur.fetchone())
+                            if not cur.nextset():
+                                break
+                        ids, created = [r[0] for r in ret], [r[1] for r in ret]
+                    else:
+                        cur.executemany(sql_sqlite, rows)
+                        cur.execute("SELECT last_insert_rowid()")
+                        last = cur.fetchone()[0]
+                        # en transaktion = ensam skrivare -> AUTOINCREMENT-id:n är sammanhängande
+                        ids, created = list(range(last - len(rows) + 1, last + 1)), [r[0] for r in rows]
+                    done.append((after, rows, ids, created))
+            self.written += len(items)
+            self.batches += 1
+        # efter commit: ett fel här får inte leda till att batchen skrivs en gång till
+        for after, rows, ids, created in done:
+            if after is not None:
+                try:
+                    after(rows, ids, created)
+                except Exception:
+                    log.exception("write-behind: after_commit misslyckades")
+
+    def flush(self):
+        """Skriv allt som ligger i kön (synkront)."""
+        while True:
+            items = self._drain()
+            if not items:
+                return
+            self._write(items)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> dict:
+        return {"enabled": WRITE_BEHIND, "queued": self._q.qsize(), "submitted": self.submitted,
+                "written": self.written, "batches": self.batches, "rejected": self.rejected, "errors": self.errors,
+                "dropped": self.dropped}
+
+WRITE_QUEUE = WriteBehindQueue()
+
+@_on_shutdown
+def _flush_write_queue():
+    WRITE_QUEUE.close()
+
+# --- Feedback API ---
+class Feedback(BaseModel):
+    name: str | None = ""
+    email: str | None = ""
+    category: str = "Feedback"
+    message: str
+
+@app.post("/api/feedback")
+def save_feedback(fb: Feedback):
+    msg = (fb.message or "").strip()
+    if not msg:
+        raise HTTPException(status_code=400, detail="Tomt meddelande")
+    ts = datetime.datetime.utcnow().isoformat(timespec="seconds")
+    params = (ts, (fb.name or "").strip(), (fb.email or "").strip(), (fb.category or 'Feedback').strip(), msg)
+    if WRITE_BEHIND:
+        WRITE_QUEUE.submit("feedback", params)
+        return {"ok": True, "queued": True}
+    sql_sqlite = "INSERT INTO feedback (created_at, name, email, category, message) VALUES (?, ?, ?, ?, ?)"
+    sql_pg     = "INSERT INTO feedback (created_at, name, email, category, message) VALUES (%s, %s, %s, %s, %s)"
+    _exec(sql_pg if USE_PG else sql_sqlite, params, write=True)
+    return {"ok": True}
+
+WRITE_QUEUE.register(
+    "feedback",
+    "INSERT INTO feedback (created_at, name, email, category, message) VALUES (%s, %s, %s, %s, %s) RETURNING id, created_at",
+    "INSERT INTO feedback (created_at, name, email, category, message) VALUES (?, ?, ?, ?, ?)",
+)
+
+FEEDBACK_PAGE_MAX     = int(os.getenv("FEEDBACK_PAGE_MAX", "500"))
+FEEDBACK_EXPORT_BATCH = int(os.getenv("FEEDBACK_EXPORT_BATCH", "1000"))
+_FEEDBACK_COLS = ("id", "created_at", "name", "email", "category", "message")
+
+def _feedback_page_sql(keyset: bool) -> str:
+    where = f"WHERE id < {_PH} " if keyset else ""
+    return f"SELECT {', '.join(_FEEDBACK_COLS)} FROM feedback {where}ORDER BY id DESC LIMIT {_PH}"
+
+def _feedback_item(r) -> dict:
+    return dict(zip(_FEEDBACK_COLS, r)) if USE_PG else dict(r)
+
+@app.get("/api/feedbacks")
+def list_feedbacks(before_id: int | None = None, limit: int = 100):
+    """Nyaste först, en sida i taget (keyset på id): nästa sida hämtas med
+    before_id=next_before_id tills den är null."""
+    limit = max(1, min(limit, FEEDBACK_PAGE_MAX))
+    params = (before_id, limit) if before_id is not None else (limit,)
+    items = [_feedback_item(r) for r in _exec(_feedback_page_sql(before_id is not None), params)]
+    return {"feedbacks": items, "next_before_id": items[-1]["id"] if len(items) == limit else None}
+
+def _feedback_rows():
+    """Alla feedbackrader, nyaste först, utan att hela tabellen hamnar i minnet.
+    PG: namngiven (server-side) cursor som hämtar FEEDBACK_EXPORT_BATCH rader åt gången.
+    SQLite: keyset-batchar, så att ingen läs-transaktion hålls öppen under hela
+    nedladdningen (den skulle hindra WAL-checkpoints) och varje batch kan köras
+    på vilken threadpool-tråd som helst."""
+    if USE_PG:
+        with _connection() as conn, conn.transaction():
+            with conn.cursor(name="feedback_export") as cur:
+                cur.itersize = FEEDBACK_EXPORT_BATCH
+                cur.execute(f"SELECT {', '.join(_FEEDBACK_COLS)} FROM feedback ORDER BY id DESC")
+                for r in cur:
+                    yield dict(zip(_FEEDBACK_COLS, r))
+        return
+    before_id = None
+    while True:
+        params = (before_id, FEEDBACK_EXPORT_BATCH) if before_id is not None else (FEEDBACK_EXPORT_BATCH,)
+        rows = _exec(_feedback_page_sql(before_id is not None), params)
+        for r in rows:
+            yield dict(r)
+        if len(rows) < FEEDBACK_EXPORT_BATCH:
+            return
+        before_id = rows[-1]["id"]
+
+def _feedback_ndjson(rows):
+    for item in rows:
+        yield json.dumps(item, ensure_ascii=False, default=str) + "\n"
+
+def _feedback_csv(rows):
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(_FEEDBACK_COLS)
+    for item in rows:
+        w.writerow([item[k] for k in _FEEDBACK_COLS])
+        if buf.tell() > 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+@app.get("/__admin/feedback_export")
+def admin_feedback_export(request: Request, format: str = "ndjson"):
+    """Hela feedbacktabellen som NDJSON eller CSV, strömmad i konstant minne
+    (ersätter de manuella data/feedback.csv-dumparna)."""
+    if not _admin_authorized(request):
+        return JSONResponse({"ok": False, "error": "Unauthorized"}, status_code=401)
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format måste vara ndjson eller csv")
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    if format == "csv":
+        body, media = _feedback_csv(_feedback_rows()), "text/csv; charset=utf-8"
+    else:
+        body, media = _feedback_ndjson(_feedback_rows()), "application/x-ndjson"
+    return StreamingResponse(body, media_type=media, headers={
+        "Content-Disposition": f'attachment; filename="feedback-{stamp}.{format}"'})
+
+# --- Leaderboard API ---
+class ScoreIn(BaseModel):
+    name: str | None = ""
+    score: conint(ge=0)
+    rounds: conint(ge=1, le=50)
+    city: str | None = ""
+
+LB_CACHE_N       = 200                                        # = max limit i get_leaderboard
+LB_CACHE_ENABLED = os.getenv("LEADERBOARD_CACHE", "1") != "0"
+LB_CACHE_TTL_SEC = float(os.getenv("LEADERBOARD_CACHE_TTL_SEC", "60"))  # begränsar staleness mellan workers
+_LB_COLS         = ("id", "created_at", "name", "score", "rounds", "city")
+
+def _lb_sort_key(item: dict):
+    return (item["score"], item["id"])
+
+class LeaderboardCache:
+    """Top-N per (stad|None, order) i minnet. save_score uppdaterar inkrementellt,
+    så läsvägen aldrig sorterar; listan laddas om från DB när den blivit för gammal."""
+    def __init__(self, n: int, ttl: float):
+        self.n = n
+        self.ttl = ttl
+        self._lists: dict[tuple, tuple[float, list[dict]]] = {}
+        self._lock = threading.Lock()
+        self.hits = self.loads = 0
+
+    def peek(self, city: str | None, order: str) -> list[dict] | None:
+        with self._lock:
+            cached = self._lists.get((city, order))
+            if cached and time.monotonic() - cached[0] < self.ttl:
+                self.hits += 1
+                return cached[1]
+        return None
+
+    def store(self, city: str | None, order: str, items: list[dict]):
+        with self._lock:
+            self.loads += 1
+            if LB_CACHE_ENABLED:
+                self._lists[(city, order)] = (time.monotonic(), items)
+
+    def top(self, city: str | None, order: str) -> list[dict]:
+        items = self.peek(city, order)
+        if items is None:
+            items = _lb_query(city, order, self.n)
+            self.store(city, order, items)
+        return items
+
+    def add(self, item: dict):
+        """Lägg in en ny poäng i de cachade listor den hör till (om den kvalificerar)."""
+        with self._lock:
+            for (city, order), (loaded, items) in list(self._lists.items()):
+                if city is not None and city != item["city"]:
+                    continue
+                if order == "latest":
+                    new = [item] + items
+                else:
+                    k = _lb_sort_key(item)
+                    if len(items) >= self.n and k >= _lb_sort_key(items[-1]):
+                        continue
+                    pos = bisect.bisect_right([_lb_sort_key(it) for it in items], k)
+                    new = items[:pos] + [item] + items[pos:]
+                self._lists[(city, order)] = (loaded, new[:self.n])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"enabled": LB_CACHE_ENABLED, "lists": len(self._lists), "hits": self.hits, "loads": self.loads}
+
+def _lb_sql(city: str | None, order: str, limit: int) -> tuple[str, tuple]:
+    order_sql = "created_at DESC, id DESC" if order == "latest" else "score ASC, id ASC"
+    params, where_sql = [], ""
+    if city:
+        where_sql = f"WHERE city = {'%s' if USE_PG else '?'}"
+        params.append(city)
+    limit_ph = "%s" if USE_PG else "?"
+    sql = f"SELECT id, created_at, name, score, rounds, city FROM leaderboard {where_sql} ORDER BY {order_sql} LIMIT {limit_ph}"
+    params.append(limit)
+    return sql, tuple(params)
+
+def _lb_query(city: str | None, order: str, limit: int) -> list[dict]:
+    return [dict(zip(_LB_COLS, r)) for r in _exec(*_lb_sql(city, order, limit))]
+
+LB_CACHE = LeaderboardCache(LB_CACHE_N, LB_CACHE_TTL_SEC)
+
+# --- Rank/percentil: Fenwick-träd över poäng-hinkar (global + per stad) ---
+RANK_BUCKET_M    = int(os.getenv("RANK_BUCKET_M", "10"))          # hinkbredd i meter (ties inom hinken delar rank)
+RANK_MAX_SCORE   = int(os.getenv("RANK_MAX_SCORE", "2000000"))    # allt över hamnar i sista hinken
+RANK_REBUILD_SEC = float(os.getenv("RANK_REBUILD_SEC", "600"))    # synka om från DB (andra workers inserts)
+
+class Fenwick:
+    """Binärt indexerat träd: punktuppdatering och prefixsumma i O(log n)."""
+    def __init__(self, counts: list[int]):
+        self.n = n = len(counts)
+        # t[i] = summan av hinkarna (i - lowbit(i), i] = pre[i] - pre[i - lowbit(i)]
+        pre = array("q", [0]) + array("q", accumulate(counts))
+        if np is not None:
+            p = np.frombuffer(pre, dtype=np.int64)
+            idx = np.arange(1, n + 1)
+            self.t = array("q", [0]) + array("q", (p[idx] - p[idx - (idx & -idx)]).tobytes())
+        else:
+            self.t = array("q", [0]) + array("q", (pre[i] - pre[i - (i & -i)] for i in range(1, n + 1)))
+        self.total = pre[n]
+
+    def add(self, i: int, delta: int = 1):
+        self.total += delta
+        i += 1
+        while i <= self.n:
+            self.t[i] += delta
+            i += i & -i
+
+    def prefix(self, i: int) -> int:
+        """Summan av hinkarna 0..i (inklusive)."""
+        s, i = 0, min(i, self.n - 1) + 1
+        while i > 0:
+            s += self.t[i]
+            i -= i & -i
+        return s
+
+class RankIndex:
+    """Order-statistik för topplistan (lägre poäng = bättre). Byggs från DB vid start."""
+    def __init__(self):
+        self.buckets = RANK_MAX_SCORE // RANK_BUCKET_M + 1
+        self._trees: dict[str | None, Fenwick] = {}
+        self._built_at: float | None = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._max_id = 0  # högsta leaderboard-id som träden redan räknar med
+        self._replay: list[tuple[int, str | None, int]] | None = None  # add() under pågående ombyggnad
+
+    def _bucket(self, score: int) -> int:
+        return min(max(0, int(score)) // RANK_BUCKET_M, self.buckets - 1)
+
+    def _add_locked(self, trees: dict, city: str | None, b: int):
+        trees[None].add(b)
+        if city in CITIES:
+            if city not in trees:
+                trees[city] = Fenwick([0] * self.buckets)
+            trees[city].add(b)
+
+    def rebuild(self):
+        with self._lock:
+            self._replay = []
+        # träd bara för städer som har poäng (hundratals städer x alla hinkar blir för stort)
+        counts: dict[str | None, list[int]] = {None: [0] * self.buckets}
+        max_id = 0
+        # MAX(id) i samma sats som antalen => samma snapshot
+        for city, score, n, top in _exec("SELECT city, score, COUNT(*), MAX(id) FROM leaderboard GROUP BY city, score"):
+            max_id = max(max_id, top)
+            b = self._bucket(score)
+            counts[None][b] += n
+            if city in CITIES:
+                counts.setdefault(city, [0] * self.buckets)[b] += n
+        trees = {k: Fenwick(c) for k, c in counts.items()}
+        with self._lock:
+            # poäng som registrerades medan vi läste men inte kom med i snapshoten
+            for lb_id, city, b in self._replay:
+                if lb_id > max_id:
+                    self._add_locked(trees, city, b)
+                    max_id = max(max_id, lb_id)
+            self._replay = None
+            self._trees = trees
+            self._max_id = max_id
+            self._built_at = time.monotonic()
+
+    def stale(self) -> bool:
+        return self._built_at is None or time.monotonic() - self._built_at > RANK_REBUILD_SEC
+
+    def _rebuild_bg(self):
+        try:
+            self.rebuild()
+        except Exception:
+            log.exception("Ombyggnad av rankindex misslyckades")
+            with self._lock:
+                self._replay = None
+                self._built_at = time.monotonic()  # försök igen om RANK_REBUILD_SEC
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def _ensure(self):
+        """Läs om från DB i bakgrunden när indexet blivit gammalt; under tiden svarar det gamla.
+        Aldrig byggt (före startup) => en gång synkront."""
+        if self._built_at is None:
+            self.rebuild()
+        elif self.stale():
+            with self._lock:
+                if self._rebuilding:
+                    return
+                self._rebuilding = True
+            threading.Thread(target=self._rebuild_bg, name="rank-rebuild", daemon=True).start()
+
+    def add(self, city: str | None, score: int, lb_id: int):
+        """Registrera en redan inskriven poäng; id:n som snapshoten redan räknat hoppas över."""
+        self._ensure()
+        b = self._bucket(score)
+        with self._lock:
+            if lb_id > self._max_id:
+                self._add_locked(self._trees, city, b)
+            if self._replay is not None:
+                self._replay.append((lb_id, city, b))
+
+    def rank(self, score: int, city: str | None = None, pending: bool = False) -> dict | None:
+        """pending=True: poängen är inte inskriven än (write-behind) men räknas med i totalen."""
+        self._ensure()
+        b = self._bucket(score)
+        with self._lock:
+            tree = self._trees.get(city)
+            if tree is None:
+                if city not in CITIES:
+                    return None
+                if not pending:
+                    return {"rank": 1, "total": 0, "percentile": 100.0}  # känd stad utan poäng
+                better = worse = total = 0
+            else:
+                better = tree.prefix(b - 1) if b > 0 else 0
+                worse = tree.total - tree.prefix(b)
+                total = tree.total
+        total += pending
+        return {"rank": better + 1, "total": total,
+                "percentile": round(100.0 * worse / total, 1) if total else 100.0}
+
+RANKS = RankIndex()
+
+@_on_startup
+def _build_ranks():
+    RANKS.rebuild()
+
+_SQL_INSERT_SCORE = ("INSERT INTO leaderboard (created_at, name, score, rounds, city) VALUES (%s, %s, %s, %s, %s) RETURNING id, created_at"
+                     if USE_PG else "INSERT INTO leaderboard (created_at, name, score, rounds, city) VALUES (?, ?, ?, ?, ?)")
+
+def _score_args(s: ScoreIn) -> tuple:
+    ts = datetime.datetime.utcnow().isoformat(timespec="seconds")
+    name = (s.name or "").strip() or "Anon"
+    city = (s.city or "").strip()
+    return (ts, name, int(s.score), int(s.rounds), city)
+
+def _score_queued(args: tuple) -> dict:
+    # id:t finns först efter flush; rank räknas som om poängen redan låg i listan
+    return {"ok": True, "id": None, "queued": True, "rank": _rank_payload(args[2], args[4], pending=True)}
+
+def _score_saved(args: tuple, lb_id: int, created_at) -> dict:
+    _ts, name, score, rounds, city = args
+    LB_CACHE.add({"id": lb_id, "created_at": created_at, "name": name, "score": score,
+                  "rounds": rounds, "city": city})
+    RANKS.add(city, score, lb_id)
+    return {"ok": True, "id": lb_id, "rank": _rank_payload(score, city)}
+
+@app.post("/api/leaderboard")
+def save_score(s: ScoreIn):
+    args = _score_args(s)
+    if WRITE_BEHIND:
+        WRITE_QUEUE.submit("leaderboard", args)
+        return _score_queued(args)
+    with _db(write=True) as cur:
+        cur.execute(_SQL_INSERT_SCORE, args)
+        if USE_PG:
+            lb_id, created_at = cur.fetchone()
+        else:
+            lb_id, created_at = cur.lastrowid, args[0]
+    return _score_saved(args, lb_id, created_at)
+
+def _after_score_batch(rows: list[tuple], ids: list[int], created: list):
+    for (_ts, name, score, rounds, city), lb_id, created_at in zip(rows, ids, created):
+        LB_CACHE.add({"id": lb_id, "created_at": created_at, "name": name, "score": score,
+                      "rounds": rounds, "city": city})
+        RANKS.add(city, score, lb_id)
+
+WRITE_QUEUE.register(
+    "leaderboard",
+    "INSERT INTO leaderboard (created_at, name, score, rounds, city) VALUES (%s, %s, %s, %s, %s) RETURNING id, created_at",
+    "INSERT INTO leaderboard (created_at, name, score, rounds, city) VALUES (?, ?, ?, ?, ?)",
+    _after_score_batch,
+)
+
+def _rank_payload(score: int, city: str | None, pending: bool = False) -> dict:
+    key = (city or "").lower().strip()
+    return {"global": RANKS.rank(score, None, pending),
+            "city": RANKS.rank(score, key, pending) if key in CITIES else None}
+
+def _rank_city(city: str | None) -> str:
+    key = (city or "").lower().strip()
+    if key and key not in CITIES:
+        raise HTTPException(status_code=400, detail=f"Ogiltig stad: {city}")
+    return key
+
+@app.get("/api/leaderboard/rank")
+def get_rank(score: int, city: str | None = None):
+    """Vilken placering (och percentil) en poäng skulle få, globalt och i staden."""
+    key = _rank_city(city)
+    return {"score": score, **_rank_payload(score, key)}
+
+def _lb_key(order: str, city: str | None) -> tuple[str | None, str]:
+    order = "latest" if order == "latest" else "best"
+    key = None
+    if city:
+        key = city.lower().strip()
+        if key not in CITIES:
+            raise HTTPException(status_code=400, detail=f"Ogiltig stad: {city}")
+    return key, order
+
+def _lb_items(rows: list[dict], limit: int) -> dict:
+    limit = max(1, min(limit, LB_CACHE_N))
+    items = []
+    for r in rows[:limit]:
+        d = dict(r)
+        d["city"] = CITIES.name((d.get("city") or "").lower()) or d.get("city")
+        items.append(d)
+    return {"items": items}
+
+@app.get("/api/leaderboard")
+def get_leaderboard(limit: int = 50, order: str = "best", city: str | None = None):
+    key, order = _lb_key(order, city)
+    return _lb_items(LB_CACHE.top(key, order), limit)
+
+# --- Singleplayer (CSV-källor) ---
+# --- Rundlager för singleplayer (TTL + LRU, begränsat minne) ---
+ROUND_TTL_SEC      = float(os.getenv("ROUND_TTL_SEC", "3600"))
+ROUND_STORE_MAX    = int(os.getenv("ROUND_STORE_MAX", "100000"))
+ROUND_STORE_MAX_MB = float(os.getenv("ROUND_STORE_MAX_MB", "64"))
+
+class RoundStore:
+    """Begränsat lager för utdelade rundor: äldsta/minst använda kastas först.
+
+    Utgångna/evictade id:n minns en stund (tombstones) så att en sen gissning
+    kan få ett tydligt "gått ut"-svar i stället för 404.
+    """
+    _ENTRY_OVERHEAD = 400  # ungefärlig kostnad för dict + nyckel + OrderedDict-nod
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int, tombstones: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self._items: "OrderedDict[str, tuple[float, int, dict]]" = OrderedDict()  # id -> (deadline, bytes, entry)
+        self._gone: "OrderedDict[str, None]" = OrderedDict()
+        self._max_gone = tombstones
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.expired = self.evictions = 0
+
+    @classmethod
+    def _size(cls, entry: dict) -> int:
+        return cls._ENTRY_OVERHEAD + sum(len(v) for v in entry.values() if isinstance(v, str))
+
+    def __len__(self):
+        return len(self._items)
+
+    def _forget(self, key: str):
+        _deadline, size, _entry = self._items.pop(key)
+        self._bytes -= size
+        self._gone[key] = None
+        if len(self._gone) > self._max_gone:
+            self._gone.popitem(last=False)
+
+    def put(self, key: str, entry: dict):
+        now = time.monotonic()
+        size = self._size(entry)
+        with self._lock:
+            self._items[key] = (now + self.ttl, size, entry)
+            self._bytes += size
+            # utgångna i LRU-änden först, sedan storleksgränserna
+            while self._items:
+                k, (deadline, _s, _e) = next(iter(self._items.items()))
+                if deadline > now:
+                    break
+                self._forget(k); self.expired += 1
+            while len(self._items) > self.max_entries or (self._bytes > self.max_bytes and len(self._items) > 1):
+                self._forget(next(iter(self._items))); self.evictions += 1
+
+    def get(self, key: str) -> tuple[dict | None, bool]:
+        """Returnera (entry, gått_ut). gått_ut=True om id:t fanns men har löpt ut/evictats."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None, key in self._gone
+            if item[0] <= time.monotonic():
+                self._forget(key); self.expired += 1; self.misses += 1
+                return None, True
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[2], False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._items), "bytes": self._bytes, "max_entries": self.max_entries,
+                    "max_bytes": self.max_bytes, "ttl_sec": self.ttl, "hits": self.hits, "misses": self.misses,
+                    "expired": self.expired, "evictions": self.evictions}
+
+PLACES = RoundStore(ROUND_TTL_SEC, ROUND_STORE_MAX, int(ROUND_STORE_MAX_MB * 1024 * 1024))
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    R = 6371.0
+    dlat = radians(lat2 - lat1); dlon = radians(lon2 - lon1)
+    a = sin(dlat/2)**2 + cos(radians(lat1))*cos(radians(lat2))*sin(dlon/2)**2
+    return 2 * R * asin(sqrt(a))
+
+def haversine_km_many(lat1, lon1, lat2, lon2):
+    """Batchad haversine: varje argument är en skalär eller en sekvens (samma längd).
+
+    Med NumPy räknas allt vektoriserat och en ndarray returneras, annars en lista.
+    """
+    if np is not None:
+        p1, l1, p2, l2 = (np.radians(np.asarray(x, dtype=np.float64)) for x in (lat1, lon1, lat2, lon2))
+        a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin((l2 - l1) / 2) ** 2
+        return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+    args = [x if isinstance(x, (Sequence, array)) else None for x in (lat1, lon1, lat2, lon2)]
+    n = max((len(x) for x in args if x is not None), default=1)
+    cols = [x if x is not None else [v] * n for x, v in zip(args, (lat1, lon1, lat2, lon2))]
+    return [haversine_km(a, b, c, d) for a, b, c, d in zip(*cols)]
+
+def build_clue(row: dict) -> str:
+    # Ledtråd = display_name, inget annat
+    return (row.get("display_name") or "").strip() or "Okänd plats"
+
+@app.get("/api/cities")
+def api_cities():
+    """Städer med platser, ur registrets metadata (inga rader laddas)."""
+    items = []
+    for key in CITIES.keys():
+        ci = CITIES.info(key)
+        if ci.n:
+            c = ci.center or DEFAULT_CENTER
+            items.append({"key": key, "name": ci.name, "places": ci.n, "center": {"lat": c[0], "lon": c[1]}})
+    return {"cities": items}
+
+def _place_item(row: "PlaceRow", dist_km: float) -> dict:
+    display = (row.get("display_name") or "").strip()
+    street  = (row.get("street") or "").strip()
+    return {"id": row["id"], "display_name": display, "address": row.get("address_full") or street or display,
+            "lat": row["lat"], "lon": row["lon"], "distance_km": round(dist_km, 4)}
+
+@app.get("/api/places/nearby")
+def api_places_nearby(city: str, lat: float | None = None, lon: float | None = None,
+                      k: int = 5, radius_km: float | None = None):
+    """Närmaste platser till en punkt (default: stadens centrum).
+
+    Med radius_km returneras alla inom radien (max 500), annars de k närmaste (max 50).
+    """
+    key = (city or "").lower().strip()
+    grid = _city_grid(key)
+    if grid is None or not len(grid.places):
+        raise HTTPException(status_code=400, detail=f"Ingen data för staden: {city!r}")
+    if lat is None or lon is None:
+        lat, lon = CITIES.center(key)
+    if radius_km is not None:
+        hits = grid.within(lat, lon, max(0.0, min(radius_km, 100.0)))[:500]
+    else:
+        hits = grid.nearest(lat, lon, max(1, min(k, 50)))
+    places = grid.places
+    return {"city": key, "center": {"lat": lat, "lon": lon},
+            "places": [_place_item(places[i], d) for i, d in hits]}
+
+# --- Signerade rundtoken (stateless singleplayer, funkar över flera workers) ---
+# Sätts ROUND_TOKEN_SECRET (samma värde i alla workers) blir rund-id:t en HMAC-signerad
+# token med stad, plats-id, facit och utgångstid – då behövs inget delat PLACES-lager.
+ROUND_TOKEN_SECRET = os.getenv("ROUND_TOKEN_SECRET", "").encode()
+USE_ROUND_TOKENS   = bool(ROUND_TOKEN_SECRET)
+
+def _b64e(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode()
+
+def _b64d(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+def _sign(payload: bytes) -> str:
+    return _b64e(hmac.new(ROUND_TOKEN_SECRET, payload, hashlib.sha256).digest()[:16])
+
+def make_round_token(city: str, place_id: str, lat: float, lon: float) -> str:
+    exp = int(time.time() + ROUND_TTL_SEC)
+    payload = f"{city}|{place_id}|{lat:.7f}|{lon:.7f}|{exp}".encode()
+    return f"{_b64e(payload)}.{_sign(payload)}"
+
+def read_round_token(token: str) -> tuple[str, str, float, float, int] | None:
+    """Verifiera och avkoda en rundtoken -> (city, place_id, lat, lon, exp), None om ogiltig."""
+    try:
+        body, sig = token.split(".", 1)
+        payload = _b64d(body)
+    except (ValueError, binascii.Error):
+        return None
+    if not hmac.compare_digest(sig, _sign(payload)):
+        return None
+    try:
+        city, pid, lat, lon, exp = payload.decode().split("|")
+        return city, pid, float(lat), float(lon), int(exp)
+    except ValueError:
+        return None
+
+def _round_entry(row: dict, key: str, lat: float, lon: float) -> dict:
+    clue = build_clue(row)
+    display = (row.get("display_name") or "").strip() or clue
+    street  = (row.get("street") or "").strip()
+    address = row.get("address_full") or street or display
+    return {"lat": lat, "lon": lon, "display_name": display, "clue": clue,
+            "street": street, "address": address, "city": key}
+
+@app.get("/api/round")
+def api_round(city: str):
+    key = (city or "").lower().strip()
+    rows = CITIES.places(key) or []
+    if not rows:
+        raise HTTPException(status_code=400, detail=f"Ingen data för staden: {city!r}")
+    row = random.choice(rows)
+    lat = float(row["lat"]); lon = float(row["lon"])
+    entry = _round_entry(row, key, lat, lon)
+    if USE_ROUND_TOKENS:
+        pid = make_round_token(key, row["id"], lat, lon)
+    else:
+        pid = uuid.uuid4().hex
+        PLACES.put(pid, entry)
+    return {"place": {"id": pid, "lat": lat, "lon": lon, "display_name": entry["display_name"],
+                      "clue": entry["clue"], "street": entry["street"], "address": entry["address"]}}
+
+class MapGuess(BaseModel):
+    place_id: str
+    lat: float
+    lon: float
+
+@app.post("/api/guess/map")
+def api_guess_map(guess: MapGuess):
+    if USE_ROUND_TOKENS and "." in guess.place_id:
+        tok = read_round_token(guess.place_id)
+        if tok is None:
+            raise HTTPException(status_code=400, detail="Ogiltig rundtoken")
+        city, row_id, lat, lon, exp = tok
+        p, expired = _round_entry(_find_row_by_id(city, row_id) or {}, city, lat, lon), exp < time.time()
+    else:
+        p, expired = PLACES.get(guess.place_id)
+    if expired:
+        raise HTTPException(status_code=410, detail="Rundan har gått ut – hämta en ny runda")
+    if not p:
+        raise HTTPException(status_code=404, detail="Place not found")
+    dist_km = haversine_km(guess.lat, guess.lon, p["lat"], p["lon"])
+    score = int(dist_km * 1000 // 1)
+    return {
+        "distance_km": dist_km,
+        "score": score,
+        "solution": {"lat": p["lat"], "lon": p["lon"]},
+        "place": {
+            "id": guess.place_id,
+            "display_name": p["display_name"],
+            "clue": p["clue"],
+            "street": p.get("street",""),
+            "address": p.get("address", p.get("street",""))
+        }
     }
 
-# =========================
-# ===== MULTIPLAYER =======
-# =========================
+# =========================
+# ===== MULTIPLAYER =======
+# =========================
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    R = 6371.0
+    dlat = radians(lat2 - lat1); dlon = radians(lon2 - lon1)
+    a = sin(dlat/2)**2 + cos(radians(lat1))*cos(radians(lat2))*sin(dlon/2)**2
+    return 2 * R * asin(sqrt(a))
+
+# --- Matchkoder ---
+MATCH_CODE_LEN          = max(3, min(int(os.getenv("MATCH_CODE_LEN", "3")), 8))  # siffror; schemat tillåter 3..8
+MATCH_CODE_COOLDOWN_SEC = int(os.getenv("MATCH_CODE_COOLDOWN_SEC", os.getenv("RESULT_MAX_AGE_SEC", "3600")))
+MATCH_LOBBY_IDLE_SEC    = int(os.getenv("MATCH_LOBBY_IDLE_SEC", str(2 * 3600)))   # lobby utan nya spelare -> cancelled
+MATCH_ACTIVE_IDLE_SEC   = int(os.getenv("MATCH_ACTIVE_IDLE_SEC", str(6 * 3600)))  # aktiv match utan gissningar -> cancelled
+MATCH_CODE_FREELIST_MAX = int(os.getenv("MATCH_CODE_FREELIST_MAX", str(10 ** 6)))
+
+class CodeAllocator:
+    """Lediga matchkoder i minnet, så att create inte behöver fråga DB per försök.
+
+    Små kodrymder (<= MATCH_CODE_FREELIST_MAX) hålls som en free-list (array) där take()
+    byter ut ett slumpat index mot det sista och poppar: O(1) även nära full beläggning.
+    Större rymder slumpas mot en mängd upptagna koder (få öppna matcher -> få försök).
+    Koder från avslutade matcher vilar MATCH_CODE_COOLDOWN_SEC innan de lämnas ut igen
+    (klienter kan ha frysta resultat för koden i sin cache). Listan fylls från DB
+    första gången och när den tar slut; det unika indexet på öppna matcher skyddar
+    mot krockar med andra processer.
+    """
+    def __init__(self, length: int, cooldown: float, freelist_max: int):
+        self.length = length
+        self.space = 10 ** length
+        self.cooldown = cooldown
+        self._dense = self.space <= freelist_max
+        self._free = array("I")                  # dense: lediga koder
+        self._taken: set[int] = set()            # gles: öppna + vilande koder
+        self._cooling: "deque[tuple[float, int]]" = deque()  # (släppt, kod), äldst först
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.released = 0
+        self.reloads = 0
+        self.forced = 0
+
+    def _parse(self, code: str) -> int | None:
+        code = str(code).strip()
+        return int(code) if len(code) == self.length and code.isdigit() else None
+
+    def _mature(self, now: float):
+        while self._cooling and now - self._cooling[0][0] >= self.cooldown:
+            i = self._cooling.popleft()[1]
+            if self._dense:
+                self._free.append(i)
+            else:
+                self._taken.discard(i)
+
+    def _pick(self) -> int | None:
+        if self._dense:
+            n = len(self._free)
+            if not n:
+                return None
+            j = random.randrange(n)
+            self._free[j], self._free[-1] = self._free[-1], self._free[j]
+            return self._free.pop()
+        for _ in range(64):
+            i = random.randrange(self.space)
+            if i not in self._taken:
+                self._taken.add(i)
+                return i
+        return None
+
+    def take(self, force: bool = False) -> str | None:
+        """En ledig kod, eller None (ej laddad/slut). force=True tar vilande kod som sista utväg."""
+        with self._lock:
+            if not self._loaded:
+                return None
+            self._mature(time.monotonic())
+            i = self._pick()
+            if i is None and force and self._cooling:
+                i = self._cooling.popleft()[1]
+                self.forced += 1
+            if i is None:
+                return None
+            self.allocated += 1
+            return str(i).zfill(self.length)
+
+    def release(self, code: str):
+        i = self._parse(code)
+        if i is None:
+            return
+        with self._lock:
+            self._cooling.append((time.monotonic(), i))
+            self.released += 1
+
+    def load(self, rows: Iterable[tuple]):
+        """Bygg om från DB: rader (kod, öppen). Stängda koder i raderna vilar från nu,
+        om de inte redan vilar sedan tidigare release()."""
+        with self._lock:
+            now = time.monotonic()
+            released = {i: t for t, i in self._cooling}
+            used, cooling = set(), {}
+            for code, is_open in rows:
+                i = self._parse(code)
+                if i is None:
+                    continue
+                if is_open:
+                    used.add(i)
+                else:
+                    cooling[i] = released.get(i, now)
+            for i in used:
+                cooling.pop(i, None)
+            self._cooling = deque(sorted((t, i) for i, t in cooling.items()))
+            if self._dense:
+                mask = bytearray(b"\x01") * self.space
+                for i in used | cooling.keys():
+                    mask[i] = 0
+                self._free = array("I", compress(range(self.space), mask))
+            else:
+                self._taken = used | cooling.keys()
+            self._loaded = True
+            self.reloads += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            free = len(self._free) if self._dense else self.space - len(self._taken)
+            return {"length": self.length, "loaded": self._loaded, "free": free, "cooling": len(self._cooling),
+                    "allocated": self.allocated, "released": self.released, "reloads": self.reloads,
+                    "forced": self.forced}
+
+CODES = CodeAllocator(MATCH_CODE_LEN, MATCH_CODE_COOLDOWN_SEC, MATCH_CODE_FREELIST_MAX)
+
+_PH = "%s" if USE_PG else "?"
+_OPEN_STATUSES = "('lobby', 'active')"
+_SQL_AGO = "LOCALTIMESTAMP - make_interval(secs => %s)" if USE_PG else "datetime('now', ?)"
+# Övergivna matcher: ingen har joinat (lobby) eller gissat (active) inom tidsgränsen
+_SQL_STALE_GAMES = f"""
+    SELECT g.id FROM games g
+    WHERE (g.status = 'lobby' AND g.created_at < {_SQL_AGO}
+           AND NOT EXISTS (SELECT 1 FROM game_players p WHERE p.game_id = g.id AND p.joined_at >= {_SQL_AGO}))
+       OR (g.status = 'active' AND g.created_at < {_SQL_AGO}
+           AND NOT EXISTS (SELECT 1 FROM guesses gu WHERE gu.game_id = g.id AND gu.created_at >= {_SQL_AGO}))
+"""
+# karantänen räknas från avslut: /final för koden kan ligga fryst i klienters cache så länge
+_SQL_HELD_CODES = (f"SELECT code, status IN {_OPEN_STATUSES} FROM games "
+                   f"WHERE status IN {_OPEN_STATUSES} OR COALESCE(finished_at, created_at) >= {_SQL_AGO}")
+
+def _ago(sec: float):
+    return float(sec) if USE_PG else f"-{int(sec)} seconds"
+
+def _stale_params() -> tuple:
+    lobby, active = _ago(MATCH_LOBBY_IDLE_SEC), _ago(MATCH_ACTIVE_IDLE_SEC)
+    return lobby, lobby, active, active
+
+def _in_list(n: int) -> str:
+    return f"({', '.join([_PH] * n)})"
+
+def _expire_sql(limit: int | None = None) -> str:
+    """Avbryt övergivna matcher i en sats; RETURNING ger bara de rader som faktiskt ändrades."""
+    stale = _SQL_STALE_GAMES if limit is None else f"{_SQL_STALE_GAMES} LIMIT {int(limit)}"
+    return (f"UPDATE games SET status='cancelled' WHERE status IN {_OPEN_STATUSES} "
+            f"AND id IN ({stale}) RETURNING id, code")
+
+def _expired(rows: list):
+    """Efter commit: avbrutna matcher ut ur cachen."""
+    for r in rows:
+        GAME_CACHE.evict(r[1])
+
+def _reload_codes(cur):
+    """Avbryt övergivna matcher och läs om vilka koder som är upptagna.
+    Körs med skrivcursor i create när allokatorn är tom."""
+    cur.execute(_expire_sql(), _stale_params())
+    expired = cur.fetchall()
+    cur.execute(_SQL_HELD_CODES, (_ago(MATCH_CODE_COOLDOWN_SEC),))
+    CODES.load(cur.fetchall())
+    _expired(expired)
+
+async def _areload_codes(cur):
+    await cur.execute(_expire_sql(), _stale_params())
+    expired = await cur.fetchall()
+    await cur.execute(_SQL_HELD_CODES, (_ago(MATCH_CODE_COOLDOWN_SEC),))
+    CODES.load(await cur.fetchall())
+    _expired(expired)
+
+def _no_codes():
+    raise HTTPException(status_code=503, detail="Inga lediga matchkoder just nu, försök igen")
+
+# --- Städning: övergivna matcher avbryts, gamla avslutade arkiveras ---
+REAPER_INTERVAL_SEC     = float(os.getenv("REAPER_INTERVAL_SEC", "300"))        # 0 = av
+REAPER_BATCH            = int(os.getenv("REAPER_BATCH", "200"))                 # matcher per transaktion
+REAPER_MAX_BATCHES      = int(os.getenv("REAPER_MAX_BATCHES", "50"))            # per körning och steg
+REAPER_PAUSE_MS         = float(os.getenv("REAPER_PAUSE_MS", "50"))             # mellan batcher, släpper skrivaren
+MATCH_ARCHIVE_AFTER_SEC = int(os.getenv("MATCH_ARCHIVE_AFTER_SEC", str(24 * 3600)))
+
+_CLOSED_STATUSES = "('finished', 'cancelled')"
+_SQL_ARCHIVABLE = (f"SELECT id, code, host_name, city, rounds, status, created_at FROM games "
+                   f"WHERE status IN {_CLOSED_STATUSES} AND COALESCE(finished_at, created_at) < {_SQL_AGO} "
+                   f"ORDER BY id LIMIT {_PH}")
+_SQL_INSERT_ARCHIVE = f"""
+    INSERT INTO games_archive (id, code, host_name, city, rounds, status, created_at, players, guesses, data)
+    VALUES ({', '.join([_PH] * 10)}) ON CONFLICT (id) DO NOTHING
+"""
+
+def _archive_rows(games: list, players: list, rounds: list, guesses: list) -> list[tuple]:
+    """En kompakt arkivrad per match: spelare, rundor och gissningar som JSON."""
+    nicks: dict[int, str] = {}
+    by_game = {g[0]: {"players": [], "rounds": {}} for g in games}
+    for gid, pid, nick in players:
+        nicks[pid] = nick
+        by_game[gid]["players"].append(nick)
+    round_of: dict[int, dict] = {}
+    for gid, rid, rno, place_id, lat, lon in rounds:
+        r = {"round_no": int(rno), "place_id": place_id, "lat": float(lat), "lon": float(lon), "guesses": {}}
+        by_game[gid]["rounds"][int(rno)] = round_of[rid] = r
+    n_guesses = dict.fromkeys(by_game, 0)
+    for gid, rid, pid, lat, lon, dist in guesses:
+        round_of[rid]["guesses"][nicks.get(pid, str(pid))] = [round(float(dist)), round(float(lat), 5), round(float(lon), 5)]
+        n_guesses[gid] += 1
+    out = []
+    for gid, code, host, city, n_rounds, status, created_at in games:
+        d = by_game[gid]
+        data = {"players": d["players"], "rounds": [d["rounds"][k] for k in sorted(d["rounds"])]}
+        out.append((gid, code, host, city, n_rounds, status, created_at, len(d["players"]), n_guesses[gid],
+                    json.dumps(data, ensure_ascii=False, separators=(",", ":"))))
+    return out
+
+class GameReaper:
+    """Bakgrundstråd för matchtabellerna (games, game_players, game_rounds, guesses).
+
+    Varje körning: övergivna lobbyer/matcher sätts till cancelled (koden frigörs), och
+    avslutade/avbrutna matcher äldre än MATCH_ARCHIVE_AFTER_SEC flyttas till games_archive
+    och raderas (ON DELETE CASCADE tar resten). Allt sker i batcher om REAPER_BATCH matcher;
+    data läses utanför skrivtransaktionen så att skrivaren bara hålls för INSERT/DELETE.
+    """
+    def __init__(self):
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._ready = False
+        self.runs = 0
+        self.batches = 0
+        self.expired = 0
+        self.archived = 0
+        self.deleted = {"games": 0, "game_players": 0, "game_rounds": 0, "guesses": 0}
+        self.errors = 0
+        self.last_error: str | None = None
+        self.last_run_at: str | None = None
+        self.last_duration_ms = 0.0
+        self.total_duration_ms = 0.0
+
+    def start(self):
+        if REAPER_INTERVAL_SEC <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="game-reaper", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.wait(REAPER_INTERVAL_SEC):
+            self.run_once()
+
+    def _ensure_tables(self) -> bool:
+        if not self._ready:
+            with _db() as cur:
+                if not _table_exists(cur, "games"):
+                    return False
+            sql_path = APP_DIR / "db" / ("create_archive.sql" if USE_PG else "create_archive.sqlite.sql")
+            _run_sql_script(sql_path.read_text(encoding="utf-8"))
+            self._ready = True
+        return True
+
+    def _pause(self) -> bool:
+        """Vila mellan batcher; False om tråden ska stoppas."""
+        return not self._stop.wait(REAPER_PAUSE_MS / 1000)
 
-def _haversine_km(lat1, lon1, lat2, lon2):
-    R = 6371.0
-    dlat = radians(lat2 - lat1); dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1))*cos(radians(lat2))*sin(dlon/2)**2
-    return 2 * R * asin(sqrt(a))
+    def _expire_batch(self) -> int:
+        rows = _exec(_expire_sql(REAPER_BATCH), _stale_params(), write=True)
+        if rows:
+            _expired(rows)
+            for r in rows:
+                CODES.release(r[1])
+            self.expired += len(rows)
+        return len(rows)
 
-def _gen_code(n=3) -> str:
-    return "".join(random.choice("0123456789") for _ in range(n))
+    def _archive_batch(self) -> int:
+        with _db() as cur:
+            cur.execute(_SQL_ARCHIVABLE, (_ago(MATCH_ARCHIVE_AFTER_SEC), REAPER_BATCH))
+            games = cur.fetchall()
+            if not games:
+                return 0
+            ids = tuple(g[0] for g in games)
+            where = f"WHERE game_id IN {_in_list(len(ids))}"
+            cur.execute(f"SELECT game_id, id, nickname FROM game_players {where}", ids)
+            players = cur.fetchall()
+            cur.execute(f"SELECT game_id, id, round_no, place_id, lat, lon FROM game_rounds {where}", ids)
+            rounds = cur.fetchall()
+            cur.execute(f"SELECT game_id, round_id, player_id, guess_lat, guess_lon, distance_m FROM guesses {where}", ids)
+            guesses = cur.fetchall()
+        rows = _archive_rows(games, players, rounds, guesses)
+        with _db(write=True) as cur:
+            cur.executemany(_SQL_INSERT_ARCHIVE, rows)
+            cur.execute(f"DELETE FROM games WHERE id IN {_in_list(len(ids))} AND status IN {_CLOSED_STATUSES}", ids)
+        for code in {g[1] for g in games}:
+            GAME_CACHE.evict(code)
+        self.archived += len(games)
+        for k, n in (("games", len(games)), ("game_players", len(players)),
+                     ("game_rounds", len(rounds)), ("guesses", len(guesses))):
+            self.deleted[k] += n
+        return len(games)
 
-def _unique_code(cur, n=3) -> str:
-    while True:
-        c = _gen_code(n)
-        if USE_PG:
-            cur.execute("SELECT 1 FROM games WHERE code=%s LIMIT 1", (c,))
-        else:
-            cur.execute("SELECT 1 FROM games WHERE code=? LIMIT 1", (c,))
-        if not cur.fetchone():
-            return c
+    def run_once(self) -> dict:
+        with self._lock:
+            t0 = time.perf_counter()
+            try:
+                if self._ensure_tables():
+                    for step in (self._expire_batch, self._archive_batch):
+                        for _ in range(REAPER_MAX_BATCHES):
+                            n = step()
+                            self.batches += bool(n)
+                            if n < REAPER_BATCH or not self._pause():
+                                break
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                log.exception("Reaper-körningen misslyckades")
+            finally:
+                ms = (time.perf_counter() - t0) * 1e3
+                self.runs += 1
+                self.last_duration_ms = round(ms, 2)
+                self.total_duration_ms = round(self.total_duration_ms + ms, 2)
+                self.last_run_at = datetime.datetime.utcnow().isoformat(timespec="seconds")
+        return self.stats()
+
+    def stats(self) -> dict:
+        return {"enabled": REAPER_INTERVAL_SEC > 0, "interval_sec": REAPER_INTERVAL_SEC, "runs": self.runs,
+                "batches": self.batches, "expired": self.expired, "archived": self.archived,
+                "rows_deleted": dict(self.deleted), "errors": self.errors, "last_error": self.last_error,
+                "last_run_at": self.last_run_at, "last_duration_ms": self.last_duration_ms,
+                "total_duration_ms": self.total_duration_ms}
+
+REAPER = GameReaper()
+
+@_on_startup
+def _start_reaper():
+    REAPER.start()
+
+@_on_shutdown
+def _stop_reaper():
+    REAPER.stop()
 
-def pick_random_places(city: str, n: int) -> List[Tuple[str, float, float]]:
+MATCH_ROUND_SPREAD_KM = float(os.getenv("MATCH_ROUND_SPREAD_KM", "0"))  # min avstånd mellan rundornas platser
+
+def _spread_sample(key: str, n: int, min_km: float) -> list:
+    """Slumpa platser men hoppa över dem som ligger inom min_km från en redan vald."""
+    rows, grid = CITIES.places(key), _city_grid(key)
+    chosen, taken = [], set()
+    for i in random.sample(range(len(rows)), k=len(rows)):
+        if i in taken:
+            continue
+        chosen.append(rows[i])
+        if len(chosen) >= n:
+            break
+        taken.update(j for j, _d in grid.within(float(rows.lat[i]), float(rows.lon[i]), min_km))
+    return chosen
+
+def pick_random_places(city: str, n: int, min_spread_km: float | None = None) -> List[Tuple[str, float, float]]:
     """Returnera n slumpade (place_id,lat,lon) från CSV-datan för given stad."""
     key = (city or "").lower().strip()
-    rows = CITY_PLACES.get(key) or []
+    rows = CITIES.places(key) or []
     if not rows:
         raise HTTPException(status_code=400, detail=f"Ingen data för staden: {city!r}")
-    chosen = random.sample(rows, k=min(n, len(rows)))
+    spread = MATCH_ROUND_SPREAD_KM if min_spread_km is None else min_spread_km
+    if spread > 0:
+        chosen = _spread_sample(key, n, spread)
+    else:
+        chosen = random.sample(rows, k=min(n, len(rows)))
     out = []
     for r in chosen:
         try:
@@ -428,6 +3155,305 @@ def pick_random_places(city: str, n: int) -> List[Tuple[str, float, float]]:
             out.append(out[len(out) % max(1, len(out))])
     return out[:n]
 
+# --- Server-push (SSE) per matchkod ---
+SSE_KEEPALIVE_SEC = float(os.getenv("SSE_KEEPALIVE_SEC", "15"))
+SSE_QUEUE_MAX     = int(os.getenv("SSE_QUEUE_MAX", "100"))
+
+class MatchEventHub:
+    """Håller prenumeranter per matchkod och skickar händelser till deras asyncio-köer.
+
+    publish() anropas från vanliga (tråd-)handlers, så köerna matas via respektive
+    eventloop med call_soon_threadsafe. Processlokalt – polling är fallback.
+    """
+    def __init__(self):
+        self._subs: dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, code: str) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_MAX)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subs.setdefault(code, set()).add((q, loop))
+        return q
+
+    def unsubscribe(self, code: str, q: asyncio.Queue):
+        with self._lock:
+            subs = self._subs.get(code)
+            if not subs:
+                return
+            subs.difference_update({s for s in subs if s[0] is q})
+            if not subs:
+                del self._subs[code]
+
+    def subscriber_count(self, code: str | None = None) -> int:
+        with self._lock:
+            if code is not None:
+                return len(self._subs.get(code, ()))
+            return sum(len(s) for s in self._subs.values())
+
+    def publish(self, code: str, event: str, data: dict):
+        with self._lock:
+            subs = list(self._subs.get(code, ()))
+        if not subs:
+            return
+        msg = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        for q, loop in subs:
+            try:
+                loop.call_soon_threadsafe(_offer_event, q, msg)
+            except RuntimeError:
+                pass  # loopen är stängd – prenumeranten städas när streamen dör
+
+def _offer_event(q: asyncio.Queue, msg: str):
+    try:
+        q.put_nowait(msg)
+    except asyncio.QueueFull:
+        pass  # långsam klient: den tappar händelser men har polling som fallback
+
+MATCH_EVENTS = MatchEventHub()
+
+# --- Game-state cache (write-through, per matchkod) ---
+GAME_CACHE_ENABLED      = os.getenv("GAME_CACHE", "1") != "0"   # stäng av vid flera workers
+GAME_CACHE_IDLE_SEC     = float(os.getenv("GAME_CACHE_IDLE_SEC", "1800"))
+GAME_CACHE_FINISHED_SEC = float(os.getenv("GAME_CACHE_FINISHED_SEC", "120"))
+GAME_CACHE_MAX          = int(os.getenv("GAME_CACHE_MAX", "5000"))
+
+# Versioner delas av alla matcher och bara ökar: en omladdad match får aldrig en gammal ETag
+_GAME_VERSIONS = count(1)
+_BOOT_ID = uuid.uuid4().hex[:8]
+
+@dataclass
+class GameState:
+    id: int
+    code: str
+    city: str
+    rounds: int
+    status: str
+    players: list = field(default_factory=list)        # nicknames i join-ordning
+    player_ids: dict = field(default_factory=dict)     # nickname -> game_players.id
+    round_rows: dict = field(default_factory=dict)     # round_no -> (round_id, place_id, lat, lon)
+    guesses: dict = field(default_factory=dict)        # round_no -> {nickname: distance_m}
+    touched: float = 0.0
+    finished_at: float | None = None
+    version: int = field(default_factory=lambda: next(_GAME_VERSIONS))  # ny vid varje ändring
+
+    def round_closed(self, round_no: int) -> bool:
+        """Alla har gissat (eller matchen är slut) -> resultatet ändras inte längre."""
+        if self.status == "finished":
+            return True
+        return bool(self.players) and len(self.guesses.get(round_no, {})) >= len(self.players)
+
+    def current_round(self) -> int:
+        """Första rundan där inte alla spelare gissat (sista rundan om alla är klara)."""
+        n = len(self.players)
+        for rno in sorted(self.round_rows):
+            if len(self.guesses.get(rno, {})) < n:
+                return rno
+        return max(self.round_rows, default=1)
+
+    def round_board(self, round_no: int) -> list[dict]:
+        g = self.guesses.get(round_no, {})
+        return [{"nickname": n, "distance_m": d} for n, d in sorted(g.items(), key=lambda kv: kv[1])]
+
+    def final_board(self) -> list[dict]:
+        totals = {n: [0.0, 0] for n in self.players}
+        for g in self.guesses.values():
+            for n, d in g.items():
+                t = totals.setdefault(n, [0.0, 0])
+                t[0] += d; t[1] += 1
+        board = [{"nickname": n, "total_m": int(t[0]), "guesses": t[1]} for n, t in totals.items()]
+        board.sort(key=lambda r: r["total_m"])
+        return board
+
+_GAME_STATE_SQL = (
+    f"SELECT id, city, rounds, status FROM games WHERE code={_PH} ORDER BY id DESC LIMIT 1",
+    f"SELECT id, nickname FROM game_players WHERE game_id={_PH} ORDER BY joined_at, id",
+    f"SELECT id, round_no, place_id, lat, lon FROM game_rounds WHERE game_id={_PH} ORDER BY round_no",
+    f"""
+        SELECT r.round_no, gp.nickname, gu.distance_m
+        FROM guesses gu
+        JOIN game_rounds r ON r.id = gu.round_id
+        JOIN game_players gp ON gp.id = gu.player_id
+        WHERE gu.game_id={_PH}
+    """,
+)
+
+def _game_state_from_rows(code: str, g, players, rounds, guesses) -> GameState:
+    st = GameState(id=g[0], code=code, city=g[1], rounds=g[2], status=g[3])
+    for pid, nick in players:
+        st.players.append(nick)
+        st.player_ids[nick] = pid
+    for rid, rno, place_id, lat, lon in rounds:
+        st.round_rows[int(rno)] = (rid, place_id, float(lat), float(lon))
+    for rno, nick, dist in guesses:
+        st.guesses.setdefault(int(rno), {})[nick] = dist
+    return st
+
+def _load_game_state(cur, code: str) -> GameState | None:
+    """Läs in hela matchen (game, spelare, rundor, gissningar) med given cursor."""
+    cur.execute(_GAME_STATE_SQL[0], (code,))
+    g = cur.fetchone()
+    if not g:
+        return None
+    rows = []
+    for sql in _GAME_STATE_SQL[1:]:
+        cur.execute(sql, (g[0],))
+        rows.append(cur.fetchall())
+    return _game_state_from_rows(code, g, *rows)
+
+async def _aload_game_state(cur, code: str) -> GameState | None:
+    await cur.execute(_GAME_STATE_SQL[0], (code,))
+    g = await cur.fetchone()
+    if not g:
+        return None
+    rows = []
+    for sql in _GAME_STATE_SQL[1:]:
+        await cur.execute(sql, (g[0],))
+        rows.append(await cur.fetchall())
+    return _game_state_from_rows(code, g, *rows)
+
+class GameCache:
+    """Processlokal cache av GameState per kod. Skrivningar går alltid till DB först
+    (write-through); avslutade eller inaktiva matcher evictas."""
+    def __init__(self):
+        self._games: dict[str, GameState] = {}
+        self._evicted: dict[str, tuple[int, float]] = {}   # kod -> (version, tid) vid evict
+        self._lock = threading.RLock()
+        self._last_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def cached(self, code: str) -> GameState | None:
+        """Bara cacheträff (ingen DB); räknar hit/miss."""
+        with self._lock:
+            st = self._games.get(code)
+            if st is not None:
+                st.touched = time.monotonic()
+                self.hits += 1
+                return st
+            self.misses += 1
+            return None
+
+    def get(self, code: str, cur=None) -> GameState | None:
+        st = self.cached(code)
+        if st is not None:
+            return st
+        since = next(_GAME_VERSIONS)
+        if cur is None:
+            with _db() as c:
+                st = _load_game_state(c, code)
+        else:
+            st = _load_game_state(cur, code)
+        if st is not None:
+            st = self.put(st, since)
+        return st
+
+    def put(self, st: GameState, since: int | None = None) -> GameState:
+        """Lägg in st och returnera den gällande staten. since = version tagen innan st
+        lästes ur DB: en write-through eller evict efter det är nyare än st, så då vinner
+        den cachade staten (eller st cachas inte alls)."""
+        if since is not None:
+            st.version = since
+        if not GAME_CACHE_ENABLED:
+            return st
+        now = time.monotonic()
+        with self._lock:
+            cur = self._games.get(st.code)
+            if cur is not None and cur.version > st.version:
+                cur.touched = now
+                return cur
+            mark = self._evicted.get(st.code)
+            if mark is not None and mark[0] > st.version:
+                return st
+            st.touched = now
+            self._games[st.code] = st
+            if now - self._last_sweep > 30 or len(self._games) > GAME_CACHE_MAX:
+                self._sweep(now)
+        return st
+
+    def start(self, st: GameState, round_rows: dict[int, tuple] | None):
+        """Write-through efter start: nya rundor (om de skapades) + status active."""
+        with self._lock:
+            if round_rows is not None:
+                st.round_rows = round_rows
+            st.status = "active"
+            st.version = next(_GAME_VERSIONS)
+
+    def evict(self, code: str):
+        with self._lock:
+            self._evicted[code] = (next(_GAME_VERSIONS), time.monotonic())
+            if self._games.pop(code, None) is not None:
+                self.evictions += 1
+
+    def _sweep(self, now: float):
+        self._last_sweep = now
+        # evict-märkena behövs bara så länge en samtidig DB-läsning kan vara på väg
+        for code, (_v, t) in list(self._evicted.items()):
+            if now - t > 60:
+                del self._evicted[code]
+        for code, st in list(self._games.items()):
+            idle = now - st.touched > GAME_CACHE_IDLE_SEC
+            done = st.finished_at is not None and now - st.finished_at > GAME_CACHE_FINISHED_SEC
+            if idle or done:
+                del self._games[code]
+                self.evictions += 1
+        if len(self._games) > GAME_CACHE_MAX:
+            for code, _ in sorted(self._games.items(), key=lambda kv: kv[1].touched)[:len(self._games) - GAME_CACHE_MAX]:
+                del self._games[code]
+                self.evictions += 1
+
+    def add_player(self, st: GameState, nick: str, player_id: int):
+        with self._lock:
+            if nick not in st.player_ids:
+                st.players.append(nick)
+                st.player_ids[nick] = player_id
+                st.version = next(_GAME_VERSIONS)
+
+    def record_guess(self, st: GameState, round_no: int, nick: str, dist_m: float) -> int:
+        with self._lock:
+            g = st.guesses.setdefault(round_no, {})
+            g[nick] = dist_m
+            st.version = next(_GAME_VERSIONS)
+            return len(g)
+
+    def set_status(self, st: GameState, status: str) -> bool:
+        """True om statusen ändrades (bara en av flera samtidiga anropare får True)."""
+        with self._lock:
+            changed = st.status != status
+            if changed:
+                st.status = status
+                st.version = next(_GAME_VERSIONS)
+            if status == "finished" and st.finished_at is None:
+                st.finished_at = time.monotonic()
+            return changed
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"enabled": GAME_CACHE_ENABLED, "games": len(self._games), "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+GAME_CACHE = GameCache()
+
+def _get_game(code: str, cur=None) -> GameState:
+    st = GAME_CACHE.get(code, cur)
+    if st is None:
+        raise HTTPException(status_code=404, detail="Spel hittas inte")
+    return st
+
+async def _aget_game(code: str, cur=None) -> GameState:
+    st = GAME_CACHE.cached(code)
+    if st is None:
+        since = next(_GAME_VERSIONS)
+        if cur is None:
+            async with _adb() as c:
+                st = await _aload_game_state(c, code)
+        else:
+            st = await _aload_game_state(cur, code)
+        if st is None:
+            raise HTTPException(status_code=404, detail="Spel hittas inte")
+        st = GAME_CACHE.put(st, since)
+    return st
+
 # --- request models ---
 class CreateMatchIn(BaseModel):
     host_name: str
@@ -445,165 +3471,142 @@ class GuessIn(BaseModel):
     lon: float
 
 # --- endpoints ---
+# SQL och in-/utdata delas mellan de synkrona handlers nedan och async-läget (DB_ASYNC).
+# Krock på idx_games_code_open (koden togs av en annan process) -> ingen rad, ny kod provas
+_SQL_INSERT_GAME = ("INSERT INTO games (code, host_name, city, rounds, status) VALUES (%s,%s,%s,%s,'lobby') "
+                    "ON CONFLICT DO NOTHING RETURNING id"
+                    if USE_PG else "INSERT INTO games (code, host_name, city, rounds, status) VALUES (?,?,?,?, 'lobby') "
+                    "ON CONFLICT DO NOTHING")
+_SQL_GAME_ID = "SELECT last_insert_rowid() WHERE changes() > 0"
+_CODE_ATTEMPTS = 8
+_SQL_INSERT_PLAYER = ("INSERT INTO game_players (game_id,nickname) VALUES (%s,%s) ON CONFLICT DO NOTHING"
+                      if USE_PG else "INSERT OR IGNORE INTO game_players (game_id,nickname) VALUES (?,?)")
+_SQL_PLAYER_ID = f"SELECT id FROM game_players WHERE game_id={_PH} AND nickname={_PH}"
+# bara en pågående match kan avslutas; en avbruten (reaper) får inte bli 'finished' igen
+_SQL_FINISH_GAME = (f"UPDATE games SET status='finished', finished_at=CURRENT_TIMESTAMP "
+                    f"WHERE id={_PH} AND status='active' RETURNING id")
+# lobby -> active; redan active är en no-op (dubbelklick/omförsök). En avslutad/avbruten
+# match får inte öppnas igen (koden kan ha gått vidare)
+_SQL_START_GAME = (f"UPDATE games SET status='active' WHERE id={_PH} AND status IN ('lobby', 'active') "
+                   f"RETURNING id")
 
-@app.post("/api/match/create")
-def api_match_create(payload: CreateMatchIn):
+def _not_startable():
+    raise HTTPException(status_code=409, detail="Matchen är redan avslutad")
+_ROUND_COLS = 5  # game_id, round_no, place_id, lat, lon
+
+def _sql_insert_rounds(n: int) -> str:
+    """En INSERT med n rader (PG: RETURNING; SQLite: id:n via last_insert_rowid)."""
+    now = "CURRENT_TIMESTAMP" if USE_PG else "datetime('now')"
+    row = "(" + ",".join([_PH] * _ROUND_COLS) + f", {now})"
+    sql = f"INSERT INTO game_rounds (game_id, round_no, place_id, lat, lon, started_at) VALUES {', '.join([row] * n)}"
+    return sql + " RETURNING round_no, id" if USE_PG else sql
+
+# Nativ upsert (PG och SQLite >= 3.24): en gissning per spelare och runda
+_SQL_UPSERT_GUESS = f"""
+    INSERT INTO guesses (game_id, round_id, player_id, guess_lat, guess_lon, distance_m)
+    VALUES ({_PH},{_PH},{_PH},{_PH},{_PH},{_PH})
+    ON CONFLICT (round_id, player_id) DO UPDATE SET
+      guess_lat=excluded.guess_lat,
+      guess_lon=excluded.guess_lon,
+      distance_m=excluded.distance_m,
+      created_at=CURRENT_TIMESTAMP
+"""
+
+# Cachemiss: game, runda, spelare och räknare för SSE i en enda fråga
+_SQL_GUESS_TARGET = f"""
+    SELECT g.id, g.rounds, g.status, r.id, r.lat, r.lon, p.id,
+           (SELECT COUNT(*) FROM game_players WHERE game_id = g.id),
+           (SELECT COUNT(*) FROM guesses WHERE round_id = r.id AND player_id <> p.id),
+           (SELECT COUNT(*) FROM guesses WHERE round_id = r.id AND player_id = p.id)
+    FROM games g
+    LEFT JOIN game_rounds r ON r.game_id = g.id AND r.round_no = {_PH}
+    LEFT JOIN game_players p ON p.game_id = g.id AND p.nickname = {_PH}
+    WHERE g.id = (SELECT MAX(id) FROM games WHERE code = {_PH})
+"""
+
+def _create_args(payload: CreateMatchIn) -> tuple[str, int, str]:
     city = (payload.city or "").lower().strip()
-    if city not in CITY_PLACES or not CITY_PLACES[city]:
+    if not CITIES.places(city):
         raise HTTPException(status_code=400, detail="Ogiltig stad eller ingen CSV-data")
     rounds = max(1, min(int(payload.rounds), 20))
     host = (payload.host_name or "Host").strip()[:40]
+    return city, rounds, host
 
-    with _db() as cur:
-        code = _unique_code(cur, 3)
-        if USE_PG:
-            cur.execute(
-                "INSERT INTO games (code, host_name, city, rounds, status) VALUES (%s,%s,%s,%s,'lobby') RETURNING id",
-                (code, host, city, rounds),
-            )
-            game_id = cur.fetchone()[0]
-        else:
-            cur.execute(
-                "INSERT INTO games (code, host_name, city, rounds, status) VALUES (?,?,?,?, 'lobby')",
-                (code, host, city, rounds),
-            )
-            cur.execute("SELECT last_insert_rowid()")
-            game_id = cur.fetchone()[0]
+def _insert_game(cur, city: str, rounds: int, host: str) -> tuple[str, int]:
+    """Ny games-rad med en kod från CODES; (kod, game_id)."""
+    for _ in range(_CODE_ATTEMPTS):
+        code = CODES.take()
+        if code is None:
+            _reload_codes(cur)
+            code = CODES.take(force=True) or _no_codes()
+        cur.execute(_SQL_INSERT_GAME, (code, host, city, rounds))
+        if not USE_PG:
+            cur.execute(_SQL_GAME_ID)
+        row = cur.fetchone()
+        if row:
+            return code, row[0]
+    _no_codes()
 
-        # hosten auto-joinas
-        if USE_PG:
-            cur.execute(
-                "INSERT INTO game_players (game_id,nickname) VALUES (%s,%s) ON CONFLICT DO NOTHING",
-                (game_id, host),
-            )
-        else:
-            cur.execute(
-                "INSERT OR IGNORE INTO game_players (game_id,nickname) VALUES (?,?)",
-                (game_id, host),
-            )
+async def _ainsert_game(cur, city: str, rounds: int, host: str) -> tuple[str, int]:
+    for _ in range(_CODE_ATTEMPTS):
+        code = CODES.take()
+        if code is None:
+            await _areload_codes(cur)
+            code = CODES.take(force=True) or _no_codes()
+        await cur.execute(_SQL_INSERT_GAME, (code, host, city, rounds))
+        if not USE_PG:
+            await cur.execute(_SQL_GAME_ID)
+        row = await cur.fetchone()
+        if row:
+            return code, row[0]
+    _no_codes()
 
+def _created(code: str, game_id: int, city: str, rounds: int, host: str, host_id: int) -> dict:
+    RESULTS.evict(code)
+    GAME_CACHE.put(GameState(id=game_id, code=code, city=city, rounds=rounds, status="lobby",
+                             players=[host], player_ids={host: host_id}))
     return {"ok": True, "code": code, "game_id": game_id, "city": city, "rounds": rounds, "status": "lobby"}
 
-@app.post("/api/match/join")
-def api_match_join(payload: JoinMatchIn):
-    code = (payload.code or "").strip()
-    nick = (payload.nickname or "").strip()[:40]
-    with _db() as cur:
-        if USE_PG:
-            cur.execute("SELECT id,status FROM games WHERE code=%s", (code,))
-        else:
-            cur.execute("SELECT id,status FROM games WHERE code=?", (code,))
-        row = cur.fetchone()
-        if not row:
-            raise HTTPException(status_code=404, detail="Spel hittas inte")
-        game_id, status = (row[0], row[1])
-        if status != "lobby":
-            raise HTTPException(status_code=400, detail=f"Spelet är {status}")
-
-        # lägg till spelare
-        if USE_PG:
-            cur.execute(
-                "INSERT INTO game_players (game_id,nickname) VALUES (%s,%s) ON CONFLICT DO NOTHING",
-                (game_id, nick),
-            )
-        else:
-            cur.execute(
-                "INSERT OR IGNORE INTO game_players (game_id,nickname) VALUES (?,?)",
-                (game_id, nick),
-            )
-
+def _joined(st: GameState, code: str, nick: str, player_id: int) -> dict:
+    GAME_CACHE.add_player(st, nick, player_id)
+    MATCH_EVENTS.publish(code, "player_joined", {"nickname": nick, "players": list(st.players)})
     return {"ok": True, "code": code, "nickname": nick}
 
-@app.get("/api/match/lobby")
-def api_match_lobby(code: str):
-    code = (code or "").strip()
-    with _db() as cur:
-        if USE_PG:
-            cur.execute("SELECT id, city, rounds, status FROM games WHERE code=%s", (code,))
-        else:
-            cur.execute("SELECT id, city, rounds, status FROM games WHERE code=?", (code,))
-        g = cur.fetchone()
-        if not g:
-            raise HTTPException(status_code=404, detail="Spel hittas inte")
-        game_id, city, rounds, status = g[0], g[1], g[2], g[3]
-
-        if USE_PG:
-            cur.execute("SELECT nickname FROM game_players WHERE game_id=%s ORDER BY joined_at", (game_id,))
-        else:
-            cur.execute("SELECT nickname FROM game_players WHERE game_id=? ORDER BY joined_at", (game_id,))
-        players = [r[0] for r in cur.fetchall()]
-
-    return {"code": code, "city": city, "rounds": rounds, "status": status, "players": players}
-
-@app.post("/api/match/start")
-def api_match_start(code: str):
-    code = (code or "").strip()
-    with _db() as cur:
-        if USE_PG:
-            cur.execute("SELECT id, city, rounds, status FROM games WHERE code=%s", (code,))
-        else:
-            cur.execute("SELECT id, city, rounds, status FROM games WHERE code=?", (code,))
-        g = cur.fetchone()
-        if not g:
-            raise HTTPException(status_code=404, detail="Spel hittas inte")
-        game_id, city, rounds, status = g[0], g[1], g[2], g[3]
+def _check_joinable(st: GameState):
+    if st.status != "lobby":
+        raise HTTPException(status_code=400, detail=f"Spelet är {st.status}")
 
-        # skapa rundor om inte redan finns
-        if USE_PG:
-            cur.execute("SELECT COUNT(*) FROM game_rounds WHERE game_id=%s", (game_id,))
-        else:
-            cur.execute("SELECT COUNT(*) FROM game_rounds WHERE game_id=?", (game_id,))
-        has = (cur.fetchone() or [0])[0]
-
-        if not has:
-            places = pick_random_places(city, rounds)
-            for i, (pid, lat, lon) in enumerate(places, start=1):
-                if USE_PG:
-                    cur.execute(
-                        "INSERT INTO game_rounds (game_id, round_no, place_id, lat, lon, started_at) VALUES (%s,%s,%s,%s,%s, CURRENT_TIMESTAMP)",
-                        (game_id, i, pid, lat, lon),
-                    )
-                else:
-                    cur.execute(
-                        "INSERT INTO game_rounds (game_id, round_no, place_id, lat, lon, started_at) VALUES (?,?,?,?,?, datetime('now'))",
-                        (game_id, i, pid, lat, lon),
-                    )
+def _round_insert(st: GameState) -> tuple[str, tuple, list[tuple]]:
+    """(sql, platta parametrar, rader) för alla rundor i en multi-row INSERT."""
+    places = pick_random_places(st.city, st.rounds)
+    rows = [(st.id, i, pid, lat, lon) for i, (pid, lat, lon) in enumerate(places, start=1)]
+    return _sql_insert_rounds(len(rows)), tuple(v for r in rows for v in r), rows
 
-        # sätt status active
-        if USE_PG:
-            cur.execute("UPDATE games SET status='active' WHERE id=%s", (game_id,))
-        else:
-            cur.execute("UPDATE games SET status='active' WHERE id=?", (game_id,))
+def _round_ids(rows: list[tuple], ret: list, last_id: int | None) -> dict[int, tuple]:
+    """round_no -> (round_id, place_id, lat, lon) efter den batchade INSERTen."""
+    if USE_PG:
+        ids = dict(ret)
+    else:
+        # en sats från ensam skrivare -> AUTOINCREMENT-id:n är sammanhängande
+        ids = {r[1]: rid for r, rid in zip(rows, range(last_id - len(rows) + 1, last_id + 1))}
+    return {rno: (ids[rno], pid, float(lat), float(lon)) for _g, rno, pid, lat, lon in rows}
 
+def _started(st: GameState, code: str, round_rows: dict[int, tuple] | None) -> dict:
+    GAME_CACHE.start(st, round_rows)
+    MATCH_EVENTS.publish(code, "match_started", {"rounds": st.rounds, "round_no": 1})
     return {"ok": True}
 
-@app.get("/api/match/round")
-def api_match_round(code: str, round_no: int):
-    code = (code or "").strip()
-    with _db() as cur:
-        # hämta game + status + city
-        if USE_PG:
-            cur.execute("SELECT id, status, city FROM games WHERE code=%s", (code,))
-        else:
-            cur.execute("SELECT id, status, city FROM games WHERE code=?", (code,))
-        g = cur.fetchone()
-        if not g:
-            raise HTTPException(status_code=404, detail="Spel hittas inte")
-        game_id, status, city = (g[0], g[1], g[2])
+def _lobby_payload(st: GameState, code: str) -> dict:
+    return {"code": code, "city": st.city, "rounds": st.rounds, "status": st.status, "players": list(st.players)}
 
-        # hämta vald runda
-        if USE_PG:
-            cur.execute("SELECT id, place_id, lat, lon FROM game_rounds WHERE game_id=%s AND round_no=%s",
-                        (game_id, int(round_no)))
-        else:
-            cur.execute("SELECT id, place_id, lat, lon FROM game_rounds WHERE game_id=? AND round_no=?",
-                        (game_id, int(round_no)))
-        r = cur.fetchone()
-        if not r:
-            raise HTTPException(status_code=404, detail="Rundan finns inte")
-        round_id, place_id, lat, lon = r
-
-    # bygg ledtråd + address från CSV
+def _round_or_404(st: GameState, round_no: int) -> tuple:
+    r = st.round_rows.get(int(round_no))
+    if not r:
+        raise HTTPException(status_code=404, detail="Rundan finns inte")
+    return r
+
+def _place_texts(city: str, place_id) -> tuple[str, str]:
+    """(ledtråd, adress) för en runda, från CSV-datan."""
     row = _find_row_by_id(city, str(place_id)) or {}
     display_name = (row.get("display_name") or "").strip()
     street       = (row.get("street") or "").strip()
@@ -612,9 +3615,13 @@ def api_match_round(code: str, round_no: int):
     address_full = row.get("address_full") or ", ".join(p for p in [street, postnr, ort] if p)
     clue         = display_name  # <-- krav: display_name är ledtråd
     address      = street or address_full or display_name
+    return clue, address
 
+def _round_payload(st: GameState, round_no: int) -> dict:
+    round_id, place_id, lat, lon = _round_or_404(st, round_no)
+    clue, address = _place_texts(st.city, place_id)
     return {
-        "status": status,
+        "status": st.status,
         "round": {
             "round_no": int(round_no),
             "place_id": place_id,
@@ -625,162 +3632,473 @@ def api_match_round(code: str, round_no: int):
         }
     }
 
+def _guess_params(payload: GuessIn, game_id, round_id, player_id, lat, lon) -> tuple[int, tuple]:
+    dist_m = int(_haversine_km(payload.lat, payload.lon, float(lat), float(lon)) * 1000)
+    return dist_m, (game_id, round_id, player_id, payload.lat, payload.lon, dist_m)
+
+def _check_open(status: str, n_guessed: int, n_players: int):
+    # bara pågående matcher tar emot gissningar; stängda rundor och avslutade/avbrutna
+    # matcher är frysta (resultaten cachas som oföränderliga)
+    if status != "active":
+        raise HTTPException(status_code=409, detail="Matchen är inte igång")
+    if n_players and n_guessed >= n_players:
+        raise HTTPException(status_code=409, detail="Rundan är redan avslutad")
+
+def _guess_args(st: GameState, payload: GuessIn, round_no: int) -> tuple[int, tuple]:
+    """Slå upp spelare + runda i cachen och räkna avståndet -> SQL-parametrar för upserten."""
+    player_id = st.player_ids.get(_guess_nick(payload))
+    if player_id is None:
+        raise HTTPException(status_code=404, detail="Spelare finns inte i detta spel")
+    round_id, _place_id, lat, lon = _round_or_404(st, round_no)
+    _check_open(st.status, len(st.guesses.get(int(round_no), {})), len(st.players))
+    return _guess_params(payload, st.id, round_id, player_id, lat, lon)
+
+def _guess_target(row, payload: GuessIn) -> tuple[int, tuple, int, int, int]:
+    """Som _guess_args men från _SQL_GUESS_TARGET; även (gissningar, spelare, rundor) efter upserten."""
+    if row is None:
+        raise HTTPException(status_code=404, detail="Spel hittas inte")
+    game_id, rounds, status, round_id, lat, lon, player_id, n_players, n_others, n_mine = row
+    if player_id is None:
+        raise HTTPException(status_code=404, detail="Spelare finns inte i detta spel")
+    if round_id is None:
+        raise HTTPException(status_code=404, detail="Rundan finns inte")
+    _check_open(status, n_others + n_mine, n_players)
+    dist_m, params = _guess_params(payload, game_id, round_id, player_id, lat, lon)
+    return dist_m, params, n_others + 1, n_players, rounds
+
+def _guess_nick(payload: GuessIn) -> str:
+    return (payload.nickname or "").strip()
+
+def _finishes(round_no: int, rounds: int, n_guesses: int, n_players: int) -> bool:
+    """Sista rundan stängs -> matchen är slut (sätts i skrivvägen, inte när någon läser /final)."""
+    return n_guesses >= n_players and int(round_no) >= rounds
+
+def _guessed(code: str, round_no: int, nick: str, dist_m: int, n_guesses: int, n_players: int,
+             finished_rounds: int | None = None) -> dict:
+    rno = int(round_no)
+    MATCH_EVENTS.publish(code, "guess", {"round_no": rno, "nickname": nick, "guesses": n_guesses, "players": n_players})
+    if n_guesses >= n_players:
+        MATCH_EVENTS.publish(code, "round_closed", {"round_no": rno})
+    if finished_rounds is not None:
+        CODES.release(code)
+        MATCH_EVENTS.publish(code, "match_finished", {"rounds": finished_rounds})
+    return {"ok": True, "distance_m": dist_m}
+
+def _round_result_payload(st: GameState, round_no: int) -> dict:
+    round_id, place_id, lat, lon = _round_or_404(st, round_no)
+    _clue, address = _place_texts(st.city, place_id)
+    return {
+        "round_no": int(round_no),
+        "solution": {"lat": float(lat), "lon": float(lon), "address": address},
+        "leaderboard": st.round_board(int(round_no))
+    }
+
+# --- Frysta resultat: stängda rundor och avslutade matcher serialiseras en gång ---
+RESULT_CACHE_MAX   = int(os.getenv("RESULT_CACHE_MAX", "2000"))      # antal matcher
+RESULT_MAX_AGE_SEC = int(os.getenv("RESULT_MAX_AGE_SEC", "3600"))    # koder återanvänds -> inte för evigt
+
+class FrozenResults:
+    """Förserialiserade svar per kod: rundnummer -> round_result, "final" -> slutställning.
+
+    Oberoende av GAME_CACHE (innehållet kan inte ändras), rensas när koden tas av en ny match.
+    """
+    def __init__(self, max_games: int):
+        self.max_games = max_games
+        self._games: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stores = 0
+
+    def get(self, code: str, key) -> bytes | None:
+        with self._lock:
+            body = self._games.get(code, {}).get(key)
+            if body is not None:
+                self._games.move_to_end(code)
+                self.hits += 1
+            return body
+
+    def put(self, code: str, key, payload: dict) -> bytes:
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        with self._lock:
+            self._games.setdefault(code, {})[key] = body
+            self._games.move_to_end(code)
+            while len(self._games) > self.max_games:
+                self._games.popitem(last=False)
+            self.stores += 1
+        return body
+
+    def evict(self, code: str):
+        with self._lock:
+            self._games.pop(code, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"games": len(self._games), "hits": self.hits, "stores": self.stores}
+
+RESULTS = FrozenResults(RESULT_CACHE_MAX)
+
+def _frozen_response(body: bytes) -> Response:
+    return Response(body, media_type="application/json",
+                    headers={"Cache-Control": f"public, max-age={RESULT_MAX_AGE_SEC}, immutable"})
+
+def _round_result_response(st: GameState, code: str, round_no: int):
+    payload = _round_result_payload(st, round_no)
+    if not st.round_closed(int(round_no)):
+        return payload
+    return _frozen_response(RESULTS.put(code, int(round_no), payload))
+
+def _final_response(st: GameState, code: str):
+    payload = {"rounds": st.rounds, "final": st.final_board()}
+    if st.status != "finished":
+        return payload  # pågående match: aktuell ställning, inget cachas
+    return _frozen_response(RESULTS.put(code, "final", payload))
+
+@app.post("/api/match/create")
+def api_match_create(payload: CreateMatchIn):
+    city, rounds, host = _create_args(payload)
+
+    with _db(write=True) as cur:
+        code, game_id = _insert_game(cur, city, rounds, host)
+
+        # hosten auto-joinas
+        cur.execute(_SQL_INSERT_PLAYER, (game_id, host))
+        cur.execute(_SQL_PLAYER_ID, (game_id, host))
+        host_id = cur.fetchone()[0]
+
+    return _created(code, game_id, city, rounds, host, host_id)
+
+@app.post("/api/match/join")
+def api_match_join(payload: JoinMatchIn):
+    code = (payload.code or "").strip()
+    nick = (payload.nickname or "").strip()[:40]
+    with _db(write=True) as cur:
+        st = _get_game(code, cur)
+        _check_joinable(st)
+
+        # lägg till spelare
+        player_id = st.player_ids.get(nick)
+        if player_id is None:
+            cur.execute(_SQL_INSERT_PLAYER, (st.id, nick))
+            cur.execute(_SQL_PLAYER_ID, (st.id, nick))
+            player_id = cur.fetchone()[0]
+
+    return _joined(st, code, nick, player_id)
+
+@app.get("/api/match/lobby")
+def api_match_lobby(code: str):
+    code = (code or "").strip()
+    return _lobby_payload(_get_game(code), code)
+
+@app.post("/api/match/start")
+def api_match_start(code: str):
+    code = (code or "").strip()
+    round_rows = None
+    with _db(write=True) as cur:
+        st = _get_game(code, cur)
+
+        # sätt status active (villkorat, först så att inga rundor skapas för en 409)
+        cur.execute(_SQL_START_GAME, (st.id,))
+        if cur.fetchone() is None:
+            _not_startable()
+
+        # skapa alla rundor i en INSERT om de inte redan finns
+        if not st.round_rows:
+            sql, params, rows = _round_insert(st)
+            cur.execute(sql, params)
+            if not USE_PG:
+                cur.execute("SELECT last_insert_rowid()")
+            ret = cur.fetchall()
+            round_rows = _round_ids(rows, ret, None if USE_PG else ret[0][0])
+
+    return _started(st, code, round_rows)
+
+@app.get("/api/match/round")
+def api_match_round(code: str, round_no: int):
+    code = (code or "").strip()
+    return _round_payload(_get_game(code), round_no)
+
 
 @app.post("/api/match/guess")
 def api_match_guess(payload: GuessIn, round_no: int):
     code = (payload.code or "").strip()
-    nick = (payload.nickname or "").strip()
-
-    with _db() as cur:
-        # hämta game + player + round
-        if USE_PG:
-            cur.execute("SELECT id FROM games WHERE code=%s", (code,))
-        else:
-            cur.execute("SELECT id FROM games WHERE code=?", (code,))
-        g = cur.fetchone()
-        if not g:
-            raise HTTPException(status_code=404, detail="Spel hittas inte")
-        game_id = g[0]
 
-        if USE_PG:
-            cur.execute("SELECT id FROM game_players WHERE game_id=%s AND nickname=%s", (game_id, nick))
-        else:
-            cur.execute("SELECT id FROM game_players WHERE game_id=? AND nickname=?", (game_id, nick))
-        p = cur.fetchone()
-        if not p:
-            raise HTTPException(status_code=404, detail="Spelare finns inte i detta spel")
-        player_id = p[0]
+    nick = _guess_nick(payload)
 
-        if USE_PG:
-            cur.execute("SELECT id, lat, lon FROM game_rounds WHERE game_id=%s AND round_no=%s", (game_id, int(round_no)))
-        else:
-            cur.execute("SELECT id, lat, lon FROM game_rounds WHERE game_id=? AND round_no=?", (game_id, int(round_no)))
-        r = cur.fetchone()
-        if not r:
-            raise HTTPException(status_code=404, detail="Rundan finns inte")
-        round_id, lat, lon = r
-        dist_m = int(_haversine_km(payload.lat, payload.lon, float(lat), float(lon)) * 1000)
-
-        # spara gissning (en per spelare/runda)
-        if USE_PG:
-            cur.execute("""
-                INSERT INTO guesses (game_id, round_id, player_id, guess_lat, guess_lon, distance_m)
-                VALUES (%s,%s,%s,%s,%s,%s)
-                ON CONFLICT (round_id, player_id) DO UPDATE SET
-                  guess_lat=EXCLUDED.guess_lat,
-                  guess_lon=EXCLUDED.guess_lon,
-                  distance_m=EXCLUDED.distance_m,
-                  created_at=CURRENT_TIMESTAMP
-            """, (game_id, round_id, player_id, payload.lat, payload.lon, dist_m))
-        else:
-            # SQLite UPSERT via REPLACE: sätt id-kolumnen till befintlig rad om den finns
-            cur.execute("""
-                INSERT OR REPLACE INTO guesses (id, game_id, round_id, player_id, guess_lat, guess_lon, distance_m, created_at)
-                VALUES (
-                  (SELECT id FROM guesses WHERE round_id=? AND player_id=?),
-                  ?,?,?,?,?,?, datetime('now')
-                )
-            """, (round_id, player_id, game_id, round_id, player_id, payload.lat, payload.lon, dist_m))
+    # game + player + round ur cachen -> en enda upsert
+    st = GAME_CACHE.cached(code)
+    if st is not None:
+        dist_m, params = _guess_args(st, payload, round_no)
+        with _db(write=True) as cur:
+            cur.execute(_SQL_UPSERT_GUESS, params)
+        n_guesses = GAME_CACHE.record_guess(st, int(round_no), nick, float(dist_m))
+        finished = None
+        if _finishes(round_no, st.rounds, n_guesses, len(st.players)) and st.status != "finished":
+            if _exec(_SQL_FINISH_GAME, (st.id,), write=True):
+                finished = st.rounds if GAME_CACHE.set_status(st, "finished") else None
+            else:
+                GAME_CACHE.evict(code)  # avbruten under tiden: cachen ljuger om statusen
+        return _guessed(code, round_no, nick, dist_m, n_guesses, len(st.players), finished)
 
-    return {"ok": True, "distance_m": dist_m}
+    # cachemiss: id:n ur en join-fråga i stället för att läsa in hela matchen
+    finished = None
+    with _db(write=True) as cur:
+        cur.execute(_SQL_GUESS_TARGET, (int(round_no), nick, code))
+        dist_m, params, n_guesses, n_players, rounds = _guess_target(cur.fetchone(), payload)
+        cur.execute(_SQL_UPSERT_GUESS, params)
+        if _finishes(round_no, rounds, n_guesses, n_players):
+            cur.execute(_SQL_FINISH_GAME, (params[0],))
+            finished = rounds if cur.fetchone() is not None else None
+    # en annan request kan ha cachat matchen under tiden: den saknar gissningen (och statusen)
+    GAME_CACHE.evict(code)
+    return _guessed(code, round_no, nick, dist_m, n_guesses, n_players, finished)
 
 @app.get("/api/match/round_result")
 def api_match_round_result(code: str, round_no: int):
     code = (code or "").strip()
-    with _db() as cur:
-        if USE_PG:
-            cur.execute("SELECT id, city FROM games WHERE code=%s", (code,))
-        else:
-            cur.execute("SELECT id, city FROM games WHERE code=?", (code,))
-        g = cur.fetchone()
-        if not g:
-            raise HTTPException(status_code=404, detail="Spel hittas inte")
-        game_id, city = g[0], g[1]
+    body = RESULTS.get(code, int(round_no))
+    if body is not None:
+        return _frozen_response(body)
+    return _round_result_response(_get_game(code), code, round_no)
 
-        if USE_PG:
-            cur.execute("SELECT id, place_id, lat, lon FROM game_rounds WHERE game_id=%s AND round_no=%s",
-                        (game_id, int(round_no)))
-        else:
-            cur.execute("SELECT id, place_id, lat, lon FROM game_rounds WHERE game_id=? AND round_no=?",
-                        (game_id, int(round_no)))
-        r = cur.fetchone()
-        if not r:
-            raise HTTPException(status_code=404, detail="Rundan finns inte")
-        round_id, place_id, lat, lon = r
-
-        # leaderboard för rundan
-        if USE_PG:
-            cur.execute("""
-                SELECT gp.nickname, gu.distance_m
-                FROM guesses gu
-                JOIN game_players gp ON gp.id = gu.player_id
-                WHERE gu.round_id=%s
-                ORDER BY gu.distance_m ASC
-            """, (round_id,))
-        else:
-            cur.execute("""
-                SELECT gp.nickname, gu.distance_m
-                FROM guesses gu
-                JOIN game_players gp ON gp.id = gu.player_id
-                WHERE gu.round_id=?
-                ORDER BY gu.distance_m ASC
-            """, (round_id,))
-        board = [{"nickname": row[0], "distance_m": row[1]} for row in cur.fetchall()]
-
-    # address från CSV för “rätt svar”
-    row = _find_row_by_id(city, str(place_id)) or {}
-    display_name = (row.get("display_name") or "").strip()
-    street       = (row.get("street") or "").strip()
-    postnr       = (row.get("postnummer") or "").strip()
-    ort          = (row.get("ort") or "").strip()
-    address_full = row.get("address_full") or ", ".join(p for p in [street, postnr, ort] if p)
-    address      = street or address_full or display_name
 
+@app.get("/api/match/final")
+def api_match_final(code: str):
+    """Slutställning. Matchen markeras som avslutad när sista rundan stängs (i /guess)."""
+    code = (code or "").strip()
+    body = RESULTS.get(code, "final")
+    if body is not None:
+        return _frozen_response(body)
+    return _final_response(_get_game(code), code)
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+    return etag in tags or "*" in tags
+
+def _state_payload(st: GameState, code: str, rno: int) -> dict:
+    has_round = rno in st.round_rows
     return {
-        "round_no": int(round_no),
-        "solution": {"lat": float(lat), "lon": float(lon), "address": address},
-        "leaderboard": board
+        **_lobby_payload(st, code),
+        "round_no": rno,
+        "round": _round_payload(st, rno)["round"] if has_round else None,
+        "round_result": _round_result_payload(st, rno) if has_round else None,
+        "results": {str(r): st.round_board(r) for r in sorted(st.guesses)},
+        "final": st.final_board(),
     }
 
+def _state_response(request: Request, st: GameState, code: str, round_no: int | None) -> Response:
+    rno = int(round_no) if round_no else st.current_round()
+    # versionen läses före payloaden: en samtidig ändring ger i värsta fall ett onödigt fullt svar
+    etag = f'"{_BOOT_ID}-{st.id}-{st.version}-{rno}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if GAME_CACHE_ENABLED and _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    body = json.dumps(_state_payload(st, code, rno), ensure_ascii=False).encode()
+    if not GAME_CACHE_ENABLED:
+        # utan cache finns ingen processlokal version: ETag från innehållet (sparar bara body)
+        headers["ETag"] = f'"{hashlib.sha1(body).hexdigest()[:20]}"'
+        if _etag_matches(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
 
-@app.get("/api/match/final")
-def api_match_final(code: str):
+@app.get("/api/match/state")
+def api_match_state(code: str, request: Request, round_no: int | None = None):
+    """Lobby, runda (round_no eller aktuell), resultat per runda och totalställning i ett svar.
+
+    Svarar 304 utan DB-arbete när If-None-Match matchar matchens version.
+    """
     code = (code or "").strip()
-    with _db() as cur:
-        if USE_PG:
-            cur.execute("SELECT id, rounds FROM games WHERE code=%s", (code,))
-        else:
-            cur.execute("SELECT id, rounds FROM games WHERE code=?", (code,))
-        g = cur.fetchone()
-        if not g:
-            raise HTTPException(status_code=404, detail="Spel hittas inte")
-        game_id, rounds = g[0], g[1]
+    return _state_response(request, _get_game(code), code, round_no)
 
-        # summera distans per spelare
-        if USE_PG:
-            cur.execute("""
-                SELECT gp.nickname, COALESCE(SUM(gu.distance_m), 0) AS total_m, COUNT(gu.id) AS cnt
-                FROM game_players gp
-                LEFT JOIN guesses gu ON gu.player_id = gp.id AND gu.game_id = %s
-                WHERE gp.game_id = %s
-                GROUP BY gp.nickname
-                ORDER BY total_m ASC
-            """, (game_id, game_id))
-        else:
-            cur.execute("""
-                SELECT gp.nickname, IFNULL(SUM(gu.distance_m), 0) AS total_m, COUNT(gu.id) AS cnt
-                FROM game_players gp
-                LEFT JOIN guesses gu ON gu.player_id = gp.id AND gu.game_id = ?
-                WHERE gp.game_id = ?
-                GROUP BY gp.nickname
-                ORDER BY total_m ASC
-            """, (game_id, game_id))
-        board = [{"nickname": r[0], "total_m": int(r[1]), "guesses": int(r[2])} for r in cur.fetchall()]
-
-        # markera spelet som finished
+@app.get("/api/match/events")
+async def api_match_events(code: str, request: Request):
+    """SSE-ström med matchhändelser (player_joined, match_started, guess, round_closed, match_finished).
+
+    Första händelsen är en 'lobby'-snapshot, därefter skickas bara förändringar.
+    """
+    code = (code or "").strip()
+    if DB_ASYNC:
+        lobby = await api_match_lobby_async(code)  # 404 om spelet saknas
+    else:
+        lobby = await run_in_threadpool(api_match_lobby, code)
+    q = MATCH_EVENTS.subscribe(code)
+
+    async def stream():
+        try:
+            yield f"retry: 3000\nevent: lobby\ndata: {json.dumps(lobby, ensure_ascii=False)}\n\n"
+            while True:
+                try:
+                    msg = await asyncio.wait_for(q.get(), timeout=SSE_KEEPALIVE_SEC)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield msg
+        finally:
+            MATCH_EVENTS.unsubscribe(code, q)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# --- Async-handlers (DB_ASYNC=1) ---
+# Samma endpoints som ovan men med await mot _adb(); ersätter de synkrona routerna
+# när DB_ASYNC är satt. All in-/utdata går via de delade hjälparna ovan.
+async def api_match_create_async(payload: CreateMatchIn):
+    city, rounds, host = _create_args(payload)
+    async with _adb(write=True) as cur:
+        code, game_id = await _ainsert_game(cur, city, rounds, host)
+        await cur.execute(_SQL_INSERT_PLAYER, (game_id, host))
+        await cur.execute(_SQL_PLAYER_ID, (game_id, host))
+        host_id = (await cur.fetchone())[0]
+    return _created(code, game_id, city, rounds, host, host_id)
+
+async def api_match_join_async(payload: JoinMatchIn):
+    code = (payload.code or "").strip()
+    nick = (payload.nickname or "").strip()[:40]
+    async with _adb(write=True) as cur:
+        st = await _aget_game(code, cur)
+        _check_joinable(st)
+        player_id = st.player_ids.get(nick)
+        if player_id is None:
+            await cur.execute(_SQL_INSERT_PLAYER, (st.id, nick))
+            await cur.execute(_SQL_PLAYER_ID, (st.id, nick))
+            player_id = (await cur.fetchone())[0]
+    return _joined(st, code, nick, player_id)
+
+async def api_match_lobby_async(code: str):
+    code = (code or "").strip()
+    return _lobby_payload(await _aget_game(code), code)
+
+async def api_match_start_async(code: str):
+    code = (code or "").strip()
+    round_rows = None
+    async with _adb(write=True) as cur:
+        st = await _aget_game(code, cur)
+        await cur.execute(_SQL_START_GAME, (st.id,))
+        if await cur.fetchone() is None:
+            _not_startable()
+        if not st.round_rows:
+            sql, params, rows = _round_insert(st)
+            await cur.execute(sql, params)
+            if not USE_PG:
+                await cur.execute("SELECT last_insert_rowid()")
+            ret = await cur.fetchall()
+            round_rows = _round_ids(rows, ret, None if USE_PG else ret[0][0])
+    return _started(st, code, round_rows)
+
+async def api_match_round_async(code: str, round_no: int):
+    code = (code or "").strip()
+    return _round_payload(await _aget_game(code), round_no)
+
+async def api_match_guess_async(payload: GuessIn, round_no: int):
+    code = (payload.code or "").strip()
+    nick = _guess_nick(payload)
+    st = GAME_CACHE.cached(code)
+    if st is not None:
+        dist_m, params = _guess_args(st, payload, round_no)
+        async with _adb(write=True) as cur:
+            await cur.execute(_SQL_UPSERT_GUESS, params)
+        n_guesses = GAME_CACHE.record_guess(st, int(round_no), nick, float(dist_m))
+        finished = None
+        if _finishes(round_no, st.rounds, n_guesses, len(st.players)) and st.status != "finished":
+            if await _aexec(_SQL_FINISH_GAME, (st.id,), write=True):
+                finished = st.rounds if GAME_CACHE.set_status(st, "finished") else None
+            else:
+                GAME_CACHE.evict(code)
+        return _guessed(code, round_no, nick, dist_m, n_guesses, len(st.players), finished)
+    finished = None
+    async with _adb(write=True) as cur:
+        await cur.execute(_SQL_GUESS_TARGET, (int(round_no), nick, code))
+        dist_m, params, n_guesses, n_players, rounds = _guess_target(await cur.fetchone(), payload)
+        await cur.execute(_SQL_UPSERT_GUESS, params)
+        if _finishes(round_no, rounds, n_guesses, n_players):
+            await cur.execute(_SQL_FINISH_GAME, (params[0],))
+            finished = rounds if await cur.fetchone() is not None else None
+    GAME_CACHE.evict(code)  # se api_match_guess
+    return _guessed(code, round_no, nick, dist_m, n_guesses, n_players, finished)
+
+async def api_match_round_result_async(code: str, round_no: int):
+    code = (code or "").strip()
+    body = RESULTS.get(code, int(round_no))
+    if body is not None:
+        return _frozen_response(body)
+    return _round_result_response(await _aget_game(code), code, round_no)
+
+async def api_match_state_async(code: str, request: Request, round_no: int | None = None):
+    code = (code or "").strip()
+    return _state_response(request, await _aget_game(code), code, round_no)
+
+async def api_match_final_async(code: str):
+    code = (code or "").strip()
+    body = RESULTS.get(code, "final")
+    if body is not None:
+        return _frozen_response(body)
+    return _final_response(await _aget_game(code), code)
+
+async def save_score_async(s: ScoreIn):
+    args = _score_args(s)
+    if WRITE_BEHIND:
+        await run_in_threadpool(WRITE_QUEUE.submit, "leaderboard", args)  # kan vänta på backpressure
+        return _score_queued(args)
+    async with _adb(write=True) as cur:
+        await cur.execute(_SQL_INSERT_SCORE, args)
         if USE_PG:
-            cur.execute("UPDATE games SET status='finished' WHERE id=%s", (game_id,))
+            lb_id, created_at = await cur.fetchone()
         else:
-            cur.execute("UPDATE games SET status='finished' WHERE id=?", (game_id,))
+            lb_id, created_at = cur.lastrowid, args[0]
+    return _score_saved(args, lb_id, created_at)
+
+async def get_rank_async(score: int, city: str | None = None):
+    key = _rank_city(city)
+    return {"score": score, **_rank_payload(score, key)}
 
-    return {"rounds": rounds, "final": board}
+async def get_leaderboard_async(limit: int = 50, order: str = "best", city: str | None = None):
+    key, order = _lb_key(order, city)
+    items = LB_CACHE.peek(key, order)
+    if items is None:
+        items = [dict(zip(_LB_COLS, r)) for r in await _aexec(*_lb_sql(key, order, LB_CACHE.n))]
+        LB_CACHE.store(key, order, items)
+    return _lb_items(items, limit)
+
+def _use_async_routes(routes: list[tuple[str, str, object]]):
+    """Byt ut de synkrona routerna (path, metod) mot async-varianterna."""
+    swap = {(path, method) for path, method, _ in routes}
+    app.router.routes[:] = [
+        r for r in app.router.routes
+        if not (isinstance(r, APIRoute) and any((r.path, m) in swap for m in r.methods))
+    ]
+    for path, method, endpoint in routes:
+        app.add_api_route(path, endpoint, methods=[method])
+
+if DB_ASYNC:
+    _use_async_routes([
+        ("/api/match/create", "POST", api_match_create_async),
+        ("/api/match/join", "POST", api_match_join_async),
+        ("/api/match/lobby", "GET", api_match_lobby_async),
+        ("/api/match/start", "POST", api_match_start_async),
+        ("/api/match/round", "GET", api_match_round_async),
+        ("/api/match/guess", "POST", api_match_guess_async),
+        ("/api/match/round_result", "GET", api_match_round_result_async),
+        ("/api/match/final", "GET", api_match_final_async),
+        ("/api/match/state", "GET", api_match_state_async),
+        ("/api/leaderboard", "POST", save_score_async),
+        ("/api/leaderboard", "GET", get_leaderboard_async),
+        ("/api/leaderboard/rank", "GET", get_rank_async),
+    ])
+
+if __name__ == "__main__":
+    # Byggsteg: python app.py build-snapshot  (kompilerar data/places_*.csv, se PLACES_SNAPSHOT)
+    # Byggsteg: python app.py build-assets    (fingerprint + gzip/br av static/ och img/, se AssetServer)
+    if sys.argv[1:] == ["build-snapshot"]:
+        hdr = build_places_snapshot()
+        print(json.dumps({c: {"rows": m["n"], "source": m["source"]} for c, m in hdr["cities"].items()}))
+    elif sys.argv[1:] == ["build-assets"]:
+        built = build_assets()
+        print(json.dumps({mount: {"files": len(a), "compressed": sum(bool(m["encodings"]) for m in a.values())}
+                          for mount, a in built.items()}))
+    else:
+        sys.exit("Användning: python app.py build-snapshot | build-assets")
@@ -0,0 +1,122 @@
+"""Trådpool (DB_ASYNC=0) mot async DB-läge (DB_ASYNC=1) under samtidig last.
+
+Kör:  python bench/bench_async.py [klienter] [sekunder] [db_fördröjning_ms]
+Varje läge startar en egen uvicorn-process mot en temporär SQLite-fil. Varje
+SQL-sats fördröjs (simulerar en långsam/avlägsen DB) och GAME_CACHE är av så att
+lobby/round går till DB. Samtidigt mäts latensen för /ping, som i trådläget
+köar bakom de blockerade handlers när trådpoolen (~40 trådar) är full.
+Lasten körs från klienttrådar i den här processen; DB_POOL_MAX ärvs av servern
+(t.ex. DB_POOL_MAX=64 så att DB-slottarna inte är flaskhalsen i något av lägena).
+"""
+import os, sys, json, time, socket, tempfile, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def _server(port: int):
+    sys.path.insert(0, str(ROOT))
+    import app
+    import uvicorn
+    app.SQLITE_PATH = Path(os.environ["BENCH_DB"])
+    delay = float(os.environ.get("BENCH_DB_DELAY_MS", "0")) / 1000
+    new_conn = app._new_sqlite_conn
+
+    def slow_conn():
+        conn = new_conn()
+        if delay:
+            conn.set_trace_callback(lambda _sql: time.sleep(delay))
+        return conn
+
+    app._new_sqlite_conn = slow_conn
+    app._sqlite_local.__dict__.clear()
+    app._ensure_multiplayer_tables()
+    app._exec("""CREATE TABLE IF NOT EXISTS leaderboard (
+      id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT NOT NULL, name TEXT NOT NULL,
+      score INTEGER NOT NULL, rounds INTEGER NOT NULL, city TEXT)""")
+    uvicorn.run(app.app, host="127.0.0.1", port=port, log_level="warning")
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(len(xs) * p))] * 1e3, 1) if xs else 0.0
+
+def _load(base: str, clients: int, seconds: float) -> dict:
+    limits = httpx.Limits(max_connections=clients + 5, max_keepalive_connections=clients + 5)
+    with httpx.Client(base_url=base, limits=limits, timeout=60) as c:
+        r = c.post("/api/match/create", json={"host_name": "H", "city": "stockholm", "rounds": 3})
+        code = r.json()["code"]
+        c.post("/api/match/start", params={"code": code})
+        stop = time.perf_counter() + seconds
+
+        def client(i: int):
+            lat, errors = [], 0
+            while time.perf_counter() < stop:
+                t0 = time.perf_counter()
+                if i % 4 == 0:
+                    r = c.get("/api/leaderboard", params={"limit": 10})
+                elif i % 2:
+                    r = c.get("/api/match/lobby", params={"code": code})
+                else:
+                    r = c.get("/api/match/round", params={"code": code, "round_no": 1})
+                errors += r.status_code != 200
+                lat.append(time.perf_counter() - t0)
+            return lat, errors
+
+        def prober(_):
+            ping = []
+            while time.perf_counter() < stop:
+                t0 = time.perf_counter()
+                c.get("/ping")
+                ping.append(time.perf_counter() - t0)
+                time.sleep(0.05)
+            return ping, 0
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(clients + 1) as ex:
+            ping_f = ex.submit(prober, None)
+            results = list(ex.map(client, range(clients)))
+            ping = ping_f.result()[0]
+        elapsed = time.perf_counter() - t0
+    lat = [x for xs, _ in results for x in xs]
+    errors = sum(e for _, e in results)
+    return {"requests": len(lat), "errors": errors, "req_per_s": round(len(lat) / elapsed),
+            "p50_ms": _pct(lat, 0.50), "p99_ms": _pct(lat, 0.99),
+            "ping_p50_ms": _pct(ping, 0.50), "ping_p99_ms": _pct(ping, 0.99)}
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    delay_ms = sys.argv[3] if len(sys.argv) > 3 else "5"
+    for mode in ("0", "1"):
+        with tempfile.TemporaryDirectory() as d:
+            port = _free_port()
+            env = {**os.environ, "DB_ASYNC": mode, "GAME_CACHE": "0", "LEADERBOARD_CACHE": "0",
+                   "BENCH_DB": str(Path(d) / "bench.db"), "BENCH_DB_DELAY_MS": delay_ms}
+            env.pop("DATABASE_URL", None)
+            proc = subprocess.Popen([sys.executable, __file__, "--server", str(port)], env=env)
+            try:
+                base = f"http://127.0.0.1:{port}"
+                for _ in range(100):
+                    try:
+                        httpx.get(base + "/ping", timeout=1)
+                        break
+                    except httpx.HTTPError:
+                        time.sleep(0.1)
+                res = _load(base, clients, seconds)
+            finally:
+                proc.terminate()
+                proc.wait()
+            print(json.dumps({"db_async": mode == "1", "clients": clients, "db_delay_ms": float(delay_ms), **res}))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--server":
+        _server(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,93 @@
+"""Matchkoder nära full beläggning: gamla slumpa-och-SELECT-loopen mot CodeAllocator.
+
+Kör:  python bench/bench_codes.py [kodlängd]
+Varje läge körs i en egen process mot en temporär SQLite-fil och fyller hela
+kodrymden (10**kodlängd öppna matcher) en create i taget. Latens och antal
+SQL-satser för kodvalet redovisas per beläggningsintervall. När rymden är full
+snurrar den gamla loopen för evigt; allokatorn svarar 503 direkt.
+"""
+import os, sys, json, time, random, tempfile, subprocess
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BUCKETS = ((0.0, 0.5), (0.5, 0.9), (0.9, 0.99), (0.99, 1.0))
+
+def _pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(len(xs) * p))] * 1e3, 3) if xs else 0.0
+
+def _worker(mode: str):
+    sys.path.insert(0, str(ROOT))
+    import app
+    from fastapi import HTTPException
+    app.SQLITE_PATH = Path(os.environ["BENCH_DB"])
+    app._sqlite_local.__dict__.clear()
+    app._ensure_multiplayer_tables()
+    n, space = app.MATCH_CODE_LEN, 10 ** app.MATCH_CODE_LEN
+
+    class Counting:
+        """Cursor-proxy som räknar SQL-satser."""
+        def __init__(self, cur):
+            self.cur, self.n = cur, 0
+
+        def execute(self, sql, params=()):
+            self.n += 1
+            return self.cur.execute(sql, params)
+
+        def __getattr__(self, name):
+            return getattr(self.cur, name)
+
+    def legacy(cur):
+        # den gamla _unique_code: slumpa, fråga DB, försök igen
+        while True:
+            c = "".join(random.choice("0123456789") for _ in range(n))
+            cur.execute("SELECT 1 FROM games WHERE code=? LIMIT 1", (c,))
+            if not cur.fetchone():
+                cur.execute(app._SQL_INSERT_GAME, (c, "H", "stockholm", 1))
+                return c
+
+    per_bucket = {b: ([], []) for b in BUCKETS}
+    for k in range(space):
+        occ = k / space
+        bucket = next(b for b in BUCKETS if b[0] <= occ < b[1])
+        with app._db(write=True) as cur:
+            cur = Counting(cur)
+            t0 = time.perf_counter()
+            if mode == "legacy":
+                legacy(cur)
+            else:
+                app._insert_game(cur, "stockholm", 1, "H")
+            per_bucket[bucket][0].append(time.perf_counter() - t0)
+            per_bucket[bucket][1].append(cur.n)
+
+    full = "spins"
+    if mode == "allocator":
+        t0 = time.perf_counter()
+        try:
+            with app._db(write=True) as cur:
+                app._insert_game(cur, "stockholm", 1, "H")
+        except HTTPException as e:
+            full = f"{e.status_code} efter {round((time.perf_counter() - t0) * 1e3, 2)} ms"
+    app.close_pool()
+    for (lo, hi), (lat, st) in per_bucket.items():
+        print(json.dumps({"mode": mode, "code_len": n, "occupancy": f"{lo:.0%}-{hi:.0%}", "creates": len(lat),
+                          "p50_ms": _pct(lat, 0.50), "p99_ms": _pct(lat, 0.99),
+                          "sql_per_create": round(sum(st) / len(st), 1) if st else 0.0}))
+    print(json.dumps({"mode": mode, "code_len": n, "when_full": full}))
+
+def main():
+    code_len = sys.argv[1] if len(sys.argv) > 1 else "3"
+    for mode in ("legacy", "allocator"):
+        with tempfile.TemporaryDirectory() as d:
+            env = {**os.environ, "MATCH_CODE_LEN": code_len, "GAME_CACHE": "0",
+                   "BENCH_DB": str(Path(d) / "bench.db")}
+            env.pop("DATABASE_URL", None)
+            out = subprocess.run([sys.executable, __file__, "--worker", mode],
+                                 env=env, capture_output=True, text=True, check=True)
+            print(out.stdout.strip())
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        _worker(sys.argv[2])
+    else:
+        main()
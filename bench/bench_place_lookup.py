@@ -0,0 +1,39 @@
+"""Micro-benchmark: _find_row_by_id (index) mot den gamla linjära scanningen.
+
+Kör:  python bench/bench_place_lookup.py
+Syntetiska städer i olika storlek visar att index-uppslaget ligger platt
+medan scanningen växer linjärt med antalet rader.
+"""
+import sys, timeit, random
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import app  # noqa: E402
+
+SIZES = (600, 6_000, 60_000)
+LOOKUPS = 2_000
+
+def _linear_find(city: str, place_id: str):
+    for r in app.CITY_PLACES.get(city, []):
+        if (r.get("id") or "").strip() == place_id:
+            return r
+    return None
+
+def _synthetic_rows(n: int) -> list[dict]:
+    return [{"id": str(i), "display_name": f"Plats {i}", "lat": 59.0 + i * 1e-5, "lon": 18.0} for i in range(1, n + 1)]
+
+def main():
+    print(f"{'rader':>8} {'index µs/uppslag':>18} {'scan µs/uppslag':>17}")
+    for n in SIZES:
+        city = f"bench{n}"
+        rows = app.PlaceColumns.from_rows(_synthetic_rows(n))
+        app.CITY_PLACES[city] = rows
+        app._index_places(city, rows)
+        ids = [str(random.randint(1, n)) for _ in range(LOOKUPS)]
+        t_idx = timeit.timeit(lambda: [app._find_row_by_id(city, i) for i in ids], number=5) / (5 * LOOKUPS)
+        scan_ids = ids[:50]
+        t_lin = timeit.timeit(lambda: [_linear_find(city, i) for i in scan_ids], number=1) / len(scan_ids)
+        print(f"{n:>8} {t_idx * 1e6:>18.3f} {t_lin * 1e6:>17.1f}")
+
+if __name__ == "__main__":
+    main()
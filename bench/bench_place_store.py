@@ -0,0 +1,47 @@
+"""Minne och avståndsberäkning: dict-per-rad mot kolumnlagret (PlaceColumns).
+
+Kör:  python bench/bench_place_store.py
+Mäter allokerat minne per stad (tracemalloc) och jämför haversine_km rad för rad
+med den batchade haversine_km_many.
+"""
+import sys, timeit, tracemalloc, random
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import app  # noqa: E402
+
+def _dict_rows(path: Path) -> list[dict]:
+    rows = []
+    for r in app._read_city_csv(path):
+        r["address_full"] = ", ".join(p for p in (r["street"], r["postnummer"], r["ort"]) if p)
+        rows.append(r)
+    return rows
+
+def _measure(fn):
+    tracemalloc.start()
+    obj = fn()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size
+
+def main():
+    print(f"numpy: {'ja' if app.np is not None else 'nej'}")
+    print(f"{'stad':>10} {'rader':>6} {'dict KB':>9} {'kolumn KB':>10}")
+    for city, path in app.CITY_FILES.items():
+        if not path.exists():
+            continue
+        rows, dict_b = _measure(lambda: _dict_rows(path))
+        _cols, col_b = _measure(lambda: app.PlaceColumns.from_rows(app._read_city_csv(path)))
+        print(f"{city:>10} {len(rows):>6} {dict_b / 1024:>9.1f} {col_b / 1024:>10.1f}")
+
+    n = 100_000
+    g_lat = [59.3 + random.random() * 0.1 for _ in range(n)]
+    g_lon = [18.0 + random.random() * 0.1 for _ in range(n)]
+    t_lat = [59.3 + random.random() * 0.1 for _ in range(n)]
+    t_lon = [18.0 + random.random() * 0.1 for _ in range(n)]
+    t_loop = timeit.timeit(lambda: [app.haversine_km(a, b, c, d) for a, b, c, d in zip(g_lat, g_lon, t_lat, t_lon)], number=3) / 3
+    t_batch = timeit.timeit(lambda: app.haversine_km_many(g_lat, g_lon, t_lat, t_lon), number=3) / 3
+    print(f"{n} par: rad för rad {t_loop * 1e3:.1f} ms, batch {t_batch * 1e3:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Belastning: generera singleplayer-rundor i en loop och följ processens RSS.
+
+Kör:  ROUND_STORE_MAX=50000 python bench/bench_round_store.py [antal_rundor]
+Med det begränsade rundlagret ska RSS plana ut när lagret nått sitt tak,
+i stället för att växa med varje utdelad runda.
+"""
+import sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import app  # noqa: E402
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        import resource
+        return pages * resource.getpagesize() / (1024 * 1024)
+    except (OSError, ImportError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    step = max(1, total // 10)
+    city = next(k for k in app.CITIES.keys() if app.CITIES.places(k))
+    t0 = time.perf_counter()
+    print(f"{'rundor':>9} {'lagrade':>9} {'RSS MB':>8}")
+    for i in range(1, total + 1):
+        app.api_round(city)
+        if i % step == 0:
+            print(f"{i:>9} {len(app.PLACES):>9} {rss_mb():>8.1f}")
+    dt = time.perf_counter() - t0
+    print(f"{total / dt:,.0f} rundor/s")
+    print(app.PLACES.stats())
+
+if __name__ == "__main__":
+    main()
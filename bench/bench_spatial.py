@@ -0,0 +1,45 @@
+"""Rutnätsindex (PlaceGrid) mot brute force för k-närmaste och radiesökning.
+
+Kör:  python bench/bench_spatial.py
+Syntetiska platser spridda över ~60x60 km; brute force räknar avstånd till
+alla platser (batchat) och sorterar.
+"""
+import sys, random, timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import app  # noqa: E402
+
+SIZES = (1_000, 10_000, 100_000)
+QUERIES = 200
+
+def _synthetic(n: int) -> app.PlaceColumns:
+    return app.PlaceColumns.from_rows(
+        {"id": str(i), "lat": 59.1 + random.random() * 0.55, "lon": 17.7 + random.random() * 1.05}
+        for i in range(n)
+    )
+
+def _brute_nearest(places, lat, lon, k):
+    d = places.distances_km(lat, lon)
+    return sorted(range(len(places)), key=d.__getitem__)[:k]
+
+def _brute_within(places, lat, lon, r):
+    d = places.distances_km(lat, lon)
+    return [i for i in range(len(places)) if d[i] <= r]
+
+def main():
+    print(f"{'rader':>8} {'knn grid ms':>12} {'knn brute ms':>13} {'radie grid ms':>14} {'radie brute ms':>15}")
+    for n in SIZES:
+        places = _synthetic(n)
+        grid = app.PlaceGrid(places, app.PLACE_GRID_CELL_KM)
+        qs = [(59.1 + random.random() * 0.55, 17.7 + random.random() * 1.05) for _ in range(QUERIES)]
+        nq = min(QUERIES, 20) if n >= 100_000 else QUERIES
+        t = lambda f: timeit.timeit(f, number=1) * 1e3
+        kg = t(lambda: [grid.nearest(a, b, 5) for a, b in qs]) / QUERIES
+        kb = t(lambda: [_brute_nearest(places, a, b, 5) for a, b in qs[:nq]]) / nq
+        rg = t(lambda: [grid.within(a, b, 2.0) for a, b in qs]) / QUERIES
+        rb = t(lambda: [_brute_within(places, a, b, 2.0) for a, b in qs[:nq]]) / nq
+        print(f"{n:>8} {kg:>12.3f} {kb:>13.3f} {rg:>14.3f} {rb:>15.3f}")
+
+if __name__ == "__main__":
+    main()
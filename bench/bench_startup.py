@@ -0,0 +1,106 @@
+"""Kallstart: platsdata från CSV mot binär snapshot (PLACES_SNAPSHOT).
+
+Kör:  python bench/bench_startup.py [upprepningar] [rader_per_stad ...]
+1) Riktiga data: varje upprepning är en ny process som importerar app, med och
+   utan snapshot. Redovisar medianen för hela processen, importen och load_places
+   (registret plus laddning av alla städer, som annars sker vid första användning), samt lifespan-starten (DB-bootstrap) mot en temporär SQLite-fil.
+2) Skalning: syntetiska CSV:er med givet antal rader per stad, load_places från
+   CSV mot snapshot i samma process.
+"""
+import os, sys, csv, json, time, random, asyncio, tempfile, subprocess, statistics
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def _worker():
+    t0 = time.perf_counter()
+    sys.path.insert(0, str(ROOT))
+    import app
+    t_import = time.perf_counter() - t0
+    t1 = time.perf_counter()
+    app.load_places()
+    for c in app.CITIES.keys():
+        app.CITIES.places(c)
+    t_load = time.perf_counter() - t1
+    app.SQLITE_PATH = Path(os.environ["BENCH_DB"])
+    app._sqlite_local.__dict__.clear()
+
+    async def lifespan() -> float:
+        async with app._lifespan(app.app):
+            return time.perf_counter()
+
+    t2 = time.perf_counter()
+    t_started = asyncio.run(lifespan())
+    print(json.dumps({"import_ms": t_import * 1e3, "load_places_ms": t_load * 1e3,
+                      "lifespan_ms": (t_started - t2) * 1e3, "source": sorted(set(app._places_source.values()))}))
+
+def _synthetic_csv(path: Path, n: int):
+    rnd = random.Random(n)
+    cols = ["id", "display_name", "alt_names", "street", "postnummer", "ort", "kommun", "lan", "svardighet", "lat", "lon"]
+    with path.open("w", encoding="utf-8", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(cols)
+        for i in range(n):
+            w.writerow([str(i), f"Plats {i}", "", f"Gatan {rnd.randint(1, 500)}", f"1{rnd.randint(1000, 9999)}",
+                        "Stockholm", "Stockholm", "Stockholms län", rnd.choice(["lätt", "medel", "svår"]),
+                        f"{59.2 + rnd.random() / 4:.7f}".replace(".", ","), f"{17.9 + rnd.random() / 3:.7f}"])
+
+def _scaling(sizes: list[int]) -> list[dict]:
+    sys.path.insert(0, str(ROOT))
+    import app
+    out = []
+    for n in sizes:
+        with tempfile.TemporaryDirectory() as d:
+            d = Path(d)
+            app.DATA_DIR, app.CITY_MANIFEST = d, d / "cities.json"
+            for c in ("stockholm", "goteborg", "malmo"):
+                _synthetic_csv(d / f"places_{c}.csv", n)
+            app.load_places()
+            app.PLACES_SNAPSHOT = str(d / "places.snapshot")
+            t0 = time.perf_counter()
+            app.build_places_snapshot()
+            t_build = time.perf_counter() - t0
+            res = {"rows_per_city": n, "build_ms": round(t_build * 1e3, 1)}
+            for mode, snap in (("csv", "0"), ("snapshot", str(d / "places.snapshot"))):
+                app.PLACES_SNAPSHOT = snap
+                ts = []
+                for _ in range(3):
+                    t0 = time.perf_counter()
+                    app.load_places()
+                    for c in app.CITIES.keys():
+                        app.CITIES.places(c)
+                    ts.append(time.perf_counter() - t0)
+                assert set(app._places_source.values()) == {mode}
+                res[f"{mode}_ms"] = round(min(ts) * 1e3, 1)
+            out.append(res)
+    return out
+
+def main():
+    reps = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    sizes = [int(x) for x in sys.argv[2:]] or [1_000, 10_000, 100_000]
+    snap = ROOT / "data" / "places.snapshot"
+    subprocess.run([sys.executable, str(ROOT / "app.py"), "build-snapshot"], check=True, capture_output=True)
+    for mode, env_snap in (("csv", "0"), ("snapshot", str(snap))):
+        runs, walls = [], []
+        for _ in range(reps):
+            with tempfile.TemporaryDirectory() as d:
+                env = {**os.environ, "PLACES_SNAPSHOT": env_snap, "REAPER_INTERVAL_SEC": "0",
+                       "BENCH_DB": str(Path(d) / "bench.db")}
+                env.pop("DATABASE_URL", None)
+                t0 = time.perf_counter()
+                out = subprocess.run([sys.executable, __file__, "--worker"], env=env,
+                                     capture_output=True, text=True, check=True)
+                walls.append(time.perf_counter() - t0)
+                runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+        med = lambda k: round(statistics.median(r[k] for r in runs), 2)
+        print(json.dumps({"mode": mode, "runs": reps, "source": runs[-1]["source"],
+                          "process_ms": round(statistics.median(walls) * 1e3, 1), "import_ms": med("import_ms"),
+                          "load_places_ms": med("load_places_ms"), "lifespan_ms": med("lifespan_ms")}))
+    for res in _scaling(sizes):
+        print(json.dumps(res))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        _worker()
+    else:
+        main()
@@ -0,0 +1,274 @@
+"""Benchmarksvit för spel-API:t: lastscenarier över HTTP + mikrobenchmarks, sparat som JSON.
+
+Kör:  python bench/bench_suite.py [--seconds 10] [--clients 16] [--players 4] [--db sqlite|postgres]
+                                   [--out fil.json] [--compare tidigare.json] [--only load|micro]
+Lastdelen startar en uvicorn-process (som bench_async) mot en temporär SQLite-fil, eller mot
+DATABASE_URL med --db postgres (lokal, tom testdatabas – tabellerna skapas). Varje scenario
+körs för sig med --clients trådar i --seconds sekunder:
+  singleplayer – GET /api/round + POST /api/guess/map
+  match        – create, --players-1 join, start, per runda: state/round, alla gissar, round_result, final
+  leaderboard  – GET /api/leaderboard (städer/ordningar blandat) och 20 % POST
+  mixed        – alla tre samtidigt (hälften singleplayer, en fjärdedel vardera match/topplista)
+Per scenario: antal, fel, req/s och p50/p95/p99 per endpoint. Mikrodelen kör i egen process:
+load_places (alla städer), _find_row_by_id, haversine_km och pick_random_places.
+Slumpen är seedad per klient så att körningar går att jämföra. --compare skriver skillnaden
+mot en tidigare fil och avslutar med kod 1 om något blivit mer än --threshold % sämre.
+"""
+import os, sys, json, time, random, socket, argparse, platform, tempfile, subprocess, statistics, timeit
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+CITIES = ("stockholm", "goteborg", "malmo")
+
+def _pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(len(xs) * p))] * 1e3, 3) if xs else 0.0
+
+# --- Server ---
+def _server(port: int):
+    sys.path.insert(0, str(ROOT))
+    import app
+    import uvicorn
+    if not app.USE_PG:
+        app.SQLITE_PATH = Path(os.environ["BENCH_DB"])
+        app._sqlite_local.__dict__.clear()
+    app._ensure_multiplayer_tables()
+    uvicorn.run(app.app, host="127.0.0.1", port=port, log_level="warning")
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# --- Scenarier: varje klient kör sin loop tills stop och returnerar {endpoint: [latens]} + fel ---
+class Recorder:
+    def __init__(self, c: httpx.Client):
+        self.c = c
+        self.lat: dict[str, list[float]] = {}
+        self.errors = 0
+
+    def call(self, name: str, method: str, url: str, ok=(200,), **kw) -> httpx.Response:
+        t0 = time.perf_counter()
+        r = self.c.request(method, url, **kw)
+        self.lat.setdefault(name, []).append(time.perf_counter() - t0)
+        self.errors += r.status_code not in ok
+        return r
+
+def singleplayer(rec: Recorder, rnd: random.Random, stop: float, _players: int):
+    while time.perf_counter() < stop:
+        p = rec.call("GET /api/round", "GET", "/api/round", params={"city": rnd.choice(CITIES)}).json()["place"]
+        rec.call("POST /api/guess/map", "POST", "/api/guess/map",
+                 json={"place_id": p["id"], "lat": p["lat"] + rnd.uniform(-0.05, 0.05),
+                       "lon": p["lon"] + rnd.uniform(-0.05, 0.05)})
+
+def match(rec: Recorder, rnd: random.Random, stop: float, players: int):
+    while time.perf_counter() < stop:
+        rounds = rnd.randint(2, 5)
+        nicks = ["host"] + [f"p{i}" for i in range(1, players)]
+        r = rec.call("POST /api/match/create", "POST", "/api/match/create",
+                     json={"host_name": nicks[0], "city": rnd.choice(CITIES), "rounds": rounds})
+        if r.status_code != 200:
+            continue
+        code = r.json()["code"]
+        for n in nicks[1:]:
+            rec.call("POST /api/match/join", "POST", "/api/match/join", json={"code": code, "nickname": n})
+        rec.call("GET /api/match/lobby", "GET", "/api/match/lobby", params={"code": code})
+        rec.call("POST /api/match/start", "POST", "/api/match/start", params={"code": code})
+        etags: dict[str, str] = {}
+        for rno in range(1, rounds + 1):
+            for n in nicks:
+                # varje spelare pollar state med sin ETag (304 när inget hänt) och hämtar rundan
+                hdr = {"If-None-Match": etags[n]} if n in etags else {}
+                s = rec.call("GET /api/match/state", "GET", "/api/match/state", ok=(200, 304),
+                             params={"code": code}, headers=hdr)
+                etags[n] = s.headers.get("etag", "")
+                rec.call("GET /api/match/round", "GET", "/api/match/round", params={"code": code, "round_no": rno})
+            for n in nicks:
+                rec.call("POST /api/match/guess", "POST", "/api/match/guess", params={"round_no": rno},
+                         json={"code": code, "nickname": n, "lat": 59.3 + rnd.random() / 5,
+                               "lon": 18.0 + rnd.random() / 5})
+            for _ in nicks:
+                rec.call("GET /api/match/round_result", "GET", "/api/match/round_result",
+                         params={"code": code, "round_no": rno})
+        rec.call("GET /api/match/final", "GET", "/api/match/final", params={"code": code})
+
+def leaderboard(rec: Recorder, rnd: random.Random, stop: float, _players: int):
+    while time.perf_counter() < stop:
+        if rnd.random() < 0.2:
+            rec.call("POST /api/leaderboard", "POST", "/api/leaderboard",
+                     json={"name": f"b{rnd.randint(1, 999)}", "score": rnd.randint(0, 50_000),
+                           "rounds": 5, "city": rnd.choice(CITIES)})
+        else:
+            rec.call("GET /api/leaderboard", "GET", "/api/leaderboard",
+                     params={"limit": rnd.choice((10, 50)), "order": rnd.choice(("best", "latest")),
+                             **({"city": rnd.choice(CITIES)} if rnd.random() < 0.5 else {})})
+
+SCENARIOS = {"singleplayer": singleplayer, "match": match, "leaderboard": leaderboard}
+
+def _mixed(i: int):
+    return singleplayer if i % 4 < 2 else match if i % 4 == 2 else leaderboard
+
+def _run_scenario(base: str, name: str, clients: int, seconds: float, players: int, seed: int) -> dict:
+    limits = httpx.Limits(max_connections=clients + 5, max_keepalive_connections=clients + 5)
+    with httpx.Client(base_url=base, limits=limits, timeout=60) as c:
+        stop = time.perf_counter() + seconds
+
+        def client(i: int) -> Recorder:
+            rec = Recorder(c)
+            fn = _mixed(i) if name == "mixed" else SCENARIOS[name]
+            fn(rec, random.Random(seed * 1000 + i), stop, players)
+            return rec
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(clients) as ex:
+            recs = list(ex.map(client, range(clients)))
+        elapsed = time.perf_counter() - t0
+    lat: dict[str, list[float]] = {}
+    for rec in recs:
+        for k, xs in rec.lat.items():
+            lat.setdefault(k, []).extend(xs)
+    everything = [x for xs in lat.values() for x in xs]
+    return {"requests": len(everything), "errors": sum(r.errors for r in recs),
+            "req_per_s": round(len(everything) / elapsed, 1),
+            "p50_ms": _pct(everything, 0.50), "p95_ms": _pct(everything, 0.95), "p99_ms": _pct(everything, 0.99),
+            "endpoints": {k: {"n": len(xs), "p50_ms": _pct(xs, 0.50), "p95_ms": _pct(xs, 0.95),
+                              "p99_ms": _pct(xs, 0.99)} for k, xs in sorted(lat.items())}}
+
+def _load(args) -> dict:
+    out = {}
+    with tempfile.TemporaryDirectory() as d:
+        port = _free_port()
+        env = {**os.environ, "BENCH_DB": str(Path(d) / "bench.db"), "REAPER_INTERVAL_SEC": "0"}
+        if args.db == "sqlite":
+            env.pop("DATABASE_URL", None)
+        elif not env.get("DATABASE_URL"):
+            sys.exit("--db postgres kräver DATABASE_URL (lokal testdatabas)")
+        proc = subprocess.Popen([sys.executable, __file__, "--server", str(port)], env=env)
+        try:
+            base = f"http://127.0.0.1:{port}"
+            for _ in range(100):
+                try:
+                    httpx.get(base + "/ping", timeout=1)
+                    break
+                except httpx.HTTPError:
+                    time.sleep(0.1)
+            for name in (*SCENARIOS, "mixed"):
+                out[name] = _run_scenario(base, name, args.clients, args.seconds, args.players, args.seed)
+                print(json.dumps({"scenario": name, **{k: v for k, v in out[name].items() if k != "endpoints"}}))
+        finally:
+            proc.terminate()
+            proc.wait()
+    return out
+
+# --- Mikrobenchmarks (egen process: ren import, ingen server) ---
+def _micro():
+    sys.path.insert(0, str(ROOT))
+    import app
+    rnd = random.Random(1)
+    res = {}
+
+    def bench(name: str, fn, number: int, repeat: int = 5):
+        ts = [t / number for t in timeit.repeat(fn, number=number, repeat=repeat)]
+        res[name] = {"us_per_call_min": round(min(ts) * 1e6, 3), "us_per_call_median": round(statistics.median(ts) * 1e6, 3)}
+
+    def load_all():
+        app.load_places()
+        for c in app.CITIES.keys():
+            app.CITIES.places(c)
+
+    bench("load_places", load_all, number=3)
+    city = max(app.CITIES.keys(), key=lambda c: len(app.CITIES.places(c) or ()))
+    ids = list(app.CITY_PLACE_INDEX[city])
+    sample = [rnd.choice(ids) for _ in range(1000)]
+    bench("_find_row_by_id", lambda: [app._find_row_by_id(city, i) for i in sample], number=20)
+    res["_find_row_by_id"] = {k: round(v / len(sample), 4) for k, v in res["_find_row_by_id"].items()}
+    pts = [(59 + rnd.random(), 18 + rnd.random(), 59 + rnd.random(), 18 + rnd.random()) for _ in range(1000)]
+    bench("haversine_km", lambda: [app.haversine_km(*p) for p in pts], number=20)
+    res["haversine_km"] = {k: round(v / len(pts), 4) for k, v in res["haversine_km"].items()}
+    bench("pick_random_places", lambda: app.pick_random_places(city, 5), number=200)
+    bench("pick_random_places_spread", lambda: app.pick_random_places(city, 5, min_spread_km=0.5), number=200)
+    print(json.dumps({"city": city, "rows": len(ids), "numpy": app.np is not None, **res}))
+
+def _run_micro() -> dict:
+    env = {**os.environ}
+    env.pop("DATABASE_URL", None)
+    out = subprocess.run([sys.executable, __file__, "--micro"], env=env, capture_output=True, text=True, check=True)
+    res = json.loads(out.stdout.strip().splitlines()[-1])
+    print(json.dumps({"micro": res}))
+    return res
+
+# --- Jämförelse ---
+def _compare(old: dict, new: dict, threshold: float) -> list[str]:
+    """Rader med procentuell skillnad; latens/tid upp eller req/s ned över tröskeln = regression."""
+    regressions = []
+
+    def diff(path: str, a, b, higher_is_better: bool):
+        if not a or b is None:
+            return
+        pct = (b - a) / a * 100
+        worse = -pct if higher_is_better else pct
+        flag = "  REGRESSION" if worse > threshold else ""
+        print(f"{path:<60} {a:>12} -> {b:>12}  {pct:+7.1f}%{flag}")
+        if flag:
+            regressions.append(path)
+
+    for name, sc in old.get("load", {}).items():
+        nsc = new.get("load", {}).get(name)
+        if not nsc:
+            continue
+        diff(f"load.{name}.req_per_s", sc["req_per_s"], nsc["req_per_s"], True)
+        for p in ("p50_ms", "p95_ms", "p99_ms"):
+            diff(f"load.{name}.{p}", sc[p], nsc[p], False)
+    for name, m in old.get("micro", {}).items():
+        if isinstance(m, dict) and isinstance(new.get("micro", {}).get(name), dict):
+            diff(f"micro.{name}.us_per_call_min", m["us_per_call_min"], new["micro"][name]["us_per_call_min"], False)
+    return regressions
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "okänd"
+
+def main():
+    ap = argparse.ArgumentParser(description="Last- och mikrobenchmarks för spel-API:t")
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--players", type=int, default=4)
+    ap.add_argument("--db", choices=("sqlite", "postgres"), default="sqlite")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--only", choices=("load", "micro"))
+    ap.add_argument("--out", type=Path)
+    ap.add_argument("--compare", type=Path)
+    ap.add_argument("--threshold", type=float, default=10.0, help="procent försämring som räknas som regression")
+    args = ap.parse_args()
+
+    result = {"meta": {"git": _git_rev(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version(), "platform": platform.platform(),
+                       "cpus": os.cpu_count(), "db": args.db, "seconds": args.seconds, "clients": args.clients,
+                       "players": args.players, "seed": args.seed,
+                       "env": {k: v for k, v in os.environ.items()
+                               if k.startswith(("DB_", "SQLITE_", "GAME_", "LEADERBOARD_", "WRITE_", "ROUND_"))}}}
+    if args.only != "micro":
+        result["load"] = _load(args)
+    if args.only != "load":
+        result["micro"] = _run_micro()
+    out = args.out or ROOT / "bench" / "results" / f"{time.strftime('%Y%m%d-%H%M%S')}-{result['meta']['git']}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, indent=1, ensure_ascii=False), encoding="utf-8")
+    print(f"sparat: {out}")
+    if args.compare:
+        regressions = _compare(json.loads(args.compare.read_text(encoding="utf-8")), result, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--server":
+        _server(int(sys.argv[2]))
+    elif len(sys.argv) > 1 and sys.argv[1] == "--micro":
+        _micro()
+    else:
+        main()
@@ -0,0 +1,57 @@
+"""Genomströmning för save_score: synkron INSERT mot write-behind-kön.
+
+Kör:  python bench/bench_write_behind.py [antal] [trådar]
+Varje läge körs i en egen process (WRITE_BEHIND=0/1) mot en temporär SQLite-fil,
+med lika många trådar som simulerar FastAPI:s trådpool.
+"""
+import os, sys, json, time, tempfile, subprocess, statistics
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def _worker(total: int, threads: int):
+    sys.path.insert(0, str(ROOT))
+    import app
+    app.SQLITE_PATH = Path(os.environ["BENCH_DB"])
+    app._sqlite_local.__dict__.clear()
+    app._exec("""CREATE TABLE IF NOT EXISTS leaderboard (
+      id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT NOT NULL, name TEXT NOT NULL,
+      score INTEGER NOT NULL, rounds INTEGER NOT NULL, city TEXT)""")
+    app.RANKS.rebuild()
+    lat = []
+
+    def one(i):
+        t0 = time.perf_counter()
+        app.save_score(app.ScoreIn(name=f"p{i}", score=i % 50_000, rounds=5, city="stockholm"))
+        lat.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        list(ex.map(one, range(total)))
+    t_req = time.perf_counter() - t0
+    app.WRITE_QUEUE.close()
+    t_all = time.perf_counter() - t0
+    rows = app._exec("SELECT COUNT(*) FROM leaderboard")[0][0]
+    lat.sort()
+    print(json.dumps({"write_behind": app.WRITE_BEHIND, "requests": total, "rows": rows,
+                      "req_per_s": round(total / t_req), "incl_flush_per_s": round(total / t_all),
+                      "p50_ms": round(statistics.median(lat) * 1e3, 3),
+                      "p99_ms": round(lat[int(len(lat) * 0.99) - 1] * 1e3, 3)}))
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    for mode in ("0", "1"):
+        with tempfile.TemporaryDirectory() as d:
+            env = {**os.environ, "WRITE_BEHIND": mode, "BENCH_DB": str(Path(d) / "bench.db")}
+            env.pop("DATABASE_URL", None)
+            out = subprocess.run([sys.executable, __file__, "--worker", str(total), str(threads)],
+                                 env=env, capture_output=True, text=True, check=True)
+            print(out.stdout.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        _worker(int(sys.argv[2]), int(sys.argv[3]))
+    else:
+        main()
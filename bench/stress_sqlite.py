@@ -0,0 +1,113 @@
+"""Stresstest för SQLite-profilen: samtidiga gissningar, poäng och lobby-läsningar.
+
+Kör:  python bench/stress_sqlite.py [trådar] [sekunder]
+Två lägen körs i var sin process mot en temporär SQLite-fil:
+  legacy – rollback-journal, synchronous=FULL, skrivningar från alla trådar
+  wal    – standardprofilen (WAL, synchronous=NORMAL, en skrivartråd)
+Räknar "database is locked"/503 och latens för läsningar. Avslutar med kod 1 om
+wal-läget fick något låsfel.
+"""
+import os, sys, json, time, random, sqlite3, tempfile, subprocess, threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODES = {
+    "legacy": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL", "SQLITE_WRITER": "0"},
+    "wal":    {"SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "NORMAL", "SQLITE_WRITER": "1"},
+}
+
+def _pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(len(xs) * p))] * 1e3, 2) if xs else 0.0
+
+def _worker(threads: int, seconds: float):
+    sys.path.insert(0, str(ROOT))
+    import app
+    from fastapi import HTTPException
+    app.SQLITE_PATH = Path(os.environ["BENCH_DB"])
+    app._sqlite_local.__dict__.clear()
+    app._ensure_multiplayer_tables()
+    for ddl in ("""CREATE TABLE IF NOT EXISTS leaderboard (
+      id INTEGER PRIMARY KEY AUTOINCREMENT, created_at TEXT NOT NULL, name TEXT NOT NULL,
+      score INTEGER NOT NULL, rounds INTEGER NOT NULL, city TEXT)""",
+                "CREATE INDEX IF NOT EXISTS idx_leaderboard_score ON leaderboard(score, id)"):
+        app._exec(ddl)
+    app.RANKS.rebuild()
+
+    code = app.api_match_create(app.CreateMatchIn(host_name="H", city="stockholm", rounds=10))["code"]
+    nicks = ["H"] + [f"p{i}" for i in range(15)]
+    # "lurker" gissar aldrig -> rundorna stängs inte och upserterna fortsätter hela körningen
+    for n in nicks[1:] + ["lurker"]:
+        app.api_match_join(app.JoinMatchIn(code=code, nickname=n))
+    app.api_match_start(code)
+
+    lock = threading.Lock()
+    counts = {"writes": 0, "reads": 0, "locked": 0, "busy_503": 0, "other_errors": 0}
+    read_lat: list[float] = []
+    stop = time.perf_counter() + seconds
+
+    def one(i: int):
+        rnd = random.Random(i)
+        local_lat, c = [], dict.fromkeys(counts, 0)
+        while time.perf_counter() < stop:
+            kind = rnd.random()
+            t0 = time.perf_counter()
+            try:
+                if kind < 0.35:
+                    app.api_match_guess(app.GuessIn(code=code, nickname=rnd.choice(nicks),
+                                                    lat=59.3 + rnd.random() / 10, lon=18.0 + rnd.random() / 10),
+                                        round_no=rnd.randint(1, 10))
+                    c["writes"] += 1
+                elif kind < 0.5:
+                    app.save_score(app.ScoreIn(name=f"s{i}", score=rnd.randint(0, 50_000), rounds=5, city="stockholm"))
+                    c["writes"] += 1
+                else:
+                    # förbi cachen: läs matchen och topplistan direkt ur DB
+                    with app._db() as cur:
+                        app._load_game_state(cur, code)
+                    app._lb_query("stockholm", "best", 50)
+                    local_lat.append(time.perf_counter() - t0)
+                    c["reads"] += 1
+            except sqlite3.OperationalError as e:
+                c["locked" if "locked" in str(e) else "other_errors"] += 1
+            except HTTPException as e:
+                c["busy_503" if e.status_code == 503 else "other_errors"] += 1
+        with lock:
+            for k, v in c.items():
+                counts[k] += v
+            read_lat.extend(local_lat)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as ex:
+        list(ex.map(one, range(threads)))
+    elapsed = time.perf_counter() - t0
+    app.close_pool()
+    print(json.dumps({"mode": os.environ["BENCH_MODE"], "threads": threads, **counts,
+                      "writes_per_s": round(counts["writes"] / elapsed),
+                      "reads_per_s": round(counts["reads"] / elapsed),
+                      "read_p50_ms": _pct(read_lat, 0.50), "read_p99_ms": _pct(read_lat, 0.99)}))
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    failed = False
+    for mode, profile in MODES.items():
+        with tempfile.TemporaryDirectory() as d:
+            env = {**os.environ, **profile, "GAME_CACHE": "0", "LEADERBOARD_CACHE": "0",
+                   "BENCH_MODE": mode, "BENCH_DB": str(Path(d) / "stress.db")}
+            env.pop("DATABASE_URL", None)
+            out = subprocess.run([sys.executable, __file__, "--worker", str(threads), str(seconds)],
+                                 env=env, capture_output=True, text=True, check=True)
+            res = json.loads(out.stdout.strip().splitlines()[-1])
+            print(json.dumps(res))
+            if mode == "wal" and (res["locked"] or res["busy_503"]):
+                failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        _worker(int(sys.argv[2]), float(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,23 @@
+-- db/create_archive.sqlite.sql
+-- Arkiv för matcher som städats bort ur games (se GameReaper i app.py):
+-- en rad per match, spelare/rundor/gissningar som JSON i data.
+
+CREATE TABLE IF NOT EXISTS games_archive (
+  id          INTEGER PRIMARY KEY,          -- samma id som i games
+  code        TEXT NOT NULL,
+  host_name   TEXT NOT NULL,
+  city        TEXT NOT NULL,
+  rounds      INTEGER NOT NULL,
+  status      TEXT NOT NULL,                -- finished | cancelled
+  created_at  TEXT NOT NULL,
+  archived_at TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  players     INTEGER NOT NULL,
+  guesses     INTEGER NOT NULL,
+  data        TEXT NOT NULL                 -- {"players": [...], "rounds": [{round_no, place_id, lat, lon, guesses}]}
+);
+
+CREATE INDEX IF NOT EXISTS idx_games_archive_code    ON games_archive(code, id);
+CREATE INDEX IF NOT EXISTS idx_games_archive_created ON games_archive(created_at);
+-- städningens urval i games
+CREATE INDEX IF NOT EXISTS idx_games_status_created  ON games(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_game_players_joined   ON game_players(game_id, joined_at);
@@ -2,12 +2,13 @@
 
 CREATE TABLE IF NOT EXISTS games (
   id SERIAL PRIMARY KEY,
-  code CHAR(3) UNIQUE NOT NULL,
+  code VARCHAR(8) NOT NULL CHECK (length(code) BETWEEN 3 AND 8), -- unik bland öppna matcher, se index
   host_name TEXT NOT NULL,
   city TEXT NOT NULL,
   rounds INTEGER NOT NULL DEFAULT 5,
   status TEXT NOT NULL DEFAULT 'lobby', -- lobby | active | finished | cancelled
-  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+  created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  finished_at TIMESTAMP -- sätts vid avslut, kodkarantänen räknas härifrån
 );
 
 CREATE TABLE IF NOT EXISTS game_players (
@@ -41,3 +42,7 @@ CREATE TABLE IF NOT EXISTS guesses (
   created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
   UNIQUE (round_id, player_id)
 );
+
+-- Koder återanvänds: unika bara bland öppna matcher, uppslag tar senaste id för koden
+CREATE UNIQUE INDEX IF NOT EXISTS idx_games_code_open ON games(code) WHERE status IN ('lobby', 'active');
+CREATE INDEX IF NOT EXISTS idx_games_code ON games(code, id);
@@ -3,12 +3,13 @@ PRAGMA foreign_keys = ON;
 
 CREATE TABLE IF NOT EXISTS games (
   id         INTEGER PRIMARY KEY AUTOINCREMENT,
-  code       TEXT NOT NULL UNIQUE CHECK (length(code) = 3),
+  code       TEXT NOT NULL CHECK (length(code) BETWEEN 3 AND 8), -- unik bland öppna matcher, se index
   host_name  TEXT NOT NULL,
   city       TEXT NOT NULL,
   rounds     INTEGER NOT NULL DEFAULT 5,
   status     TEXT NOT NULL DEFAULT 'lobby', -- lobby | active | finished | cancelled
-  created_at TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP)
+  created_at TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP),
+  finished_at TEXT -- sätts vid avslut, kodkarantänen räknas härifrån
 );
 
 CREATE TABLE IF NOT EXISTS game_players (
@@ -44,6 +45,9 @@ CREATE TABLE IF NOT EXISTS guesses (
 );
 
 -- Rekommenderade index
+-- Koder återanvänds: unika bara bland öppna matcher, uppslag tar senaste id för koden
+CREATE UNIQUE INDEX IF NOT EXISTS idx_games_code_open ON games(code) WHERE status IN ('lobby', 'active');
+CREATE INDEX IF NOT EXISTS idx_games_code            ON games(code, id);
 CREATE INDEX IF NOT EXISTS idx_game_players_game     ON game_players(game_id);
 CREATE INDEX IF NOT EXISTS idx_rounds_game_roundno   ON game_rounds(game_id, round_no);
 CREATE INDEX IF NOT EXISTS idx_guesses_round         ON guesses(round_id);
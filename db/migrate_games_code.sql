@@ -0,0 +1,7 @@
+-- db/migrate_games_code.sql
+-- Äldre schema: code CHAR(3) UNIQUE. Nu: upp till 8 siffror, unik bara bland öppna matcher.
+
+ALTER TABLE games ALTER COLUMN code TYPE VARCHAR(8);
+ALTER TABLE games DROP CONSTRAINT IF EXISTS games_code_key;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_games_code_open ON games(code) WHERE status IN ('lobby', 'active');
+CREATE INDEX IF NOT EXISTS idx_games_code ON games(code, id);
@@ -0,0 +1,27 @@
+-- db/migrate_games_code.sqlite.sql
+-- Äldre schema: code UNIQUE CHECK (length(code) = 3). SQLite kan inte ändra en
+-- kolumn, så games byggs om (se "Making Other Kinds Of Table Schema Changes" i
+-- SQLite-dokumentationen). foreign_keys måste vara av, annars kaskadraderar DROP.
+PRAGMA foreign_keys = OFF;
+BEGIN;
+
+CREATE TABLE games_new (
+  id         INTEGER PRIMARY KEY AUTOINCREMENT,
+  code       TEXT NOT NULL CHECK (length(code) BETWEEN 3 AND 8),
+  host_name  TEXT NOT NULL,
+  city       TEXT NOT NULL,
+  rounds     INTEGER NOT NULL DEFAULT 5,
+  status     TEXT NOT NULL DEFAULT 'lobby', -- lobby | active | finished | cancelled
+  created_at TEXT NOT NULL DEFAULT (CURRENT_TIMESTAMP)
+);
+INSERT INTO games_new (id, code, host_name, city, rounds, status, created_at)
+  SELECT id, code, host_name, city, rounds, status, created_at FROM games;
+DROP TABLE games;
+ALTER TABLE games_new RENAME TO games;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_games_code_open ON games(code) WHERE status IN ('lobby', 'active');
+CREATE INDEX IF NOT EXISTS idx_games_code            ON games(code, id);
+
+PRAGMA foreign_key_check;
+COMMIT;
+PRAGMA foreign_keys = ON;
@@ -0,0 +1,4 @@
+-- db/migrate_games_finished_at.sql
+-- Kodkarantänen (och arkiveringen) räknas från när matchen avslutades, inte när den skapades.
+
+ALTER TABLE games ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP;
@@ -54,6 +54,54 @@ const S = {
   timeoutPenalty: false,  // om vi fick 50 000 m pga timeout
 };
 
+// ===== Server-push (SSE) – polling finns kvar som fallback =====
+const PUSH_FALLBACK_MS = 15000; // med live push räcker en säkerhetspoll var 15:e sek
+const PUSH_EVENTS = ['lobby','player_joined','match_started','guess','round_closed','match_finished'];
+const Push = { es:null, code:'', live:false, lastPoll:0 };
+
+function openMatchEvents(code){
+  if (!window.EventSource || !code) return;
+  if (Push.es && Push.code === code) return;
+  closeMatchEvents();
+  Push.code = code;
+  Push.es = new EventSource(`/api/match/events?code=${encodeURIComponent(code)}`);
+  Push.es.onopen  = ()=>{ Push.live = true; };
+  Push.es.onerror = ()=>{ Push.live = false; }; // EventSource återansluter själv
+  PUSH_EVENTS.forEach(type=>{
+    Push.es.addEventListener(type, (ev)=>{
+      let data = null;
+      try{ data = JSON.parse(ev.data); }catch{}
+      document.dispatchEvent(new CustomEvent('mp:event', { detail:{ type, data } }));
+    });
+  });
+}
+function closeMatchEvents(){
+  if (Push.es) Push.es.close();
+  Push.es = null; Push.live = false; Push.code = '';
+}
+// true => hoppa över denna poll-tick (push är live och vi pollade nyss)
+function skipPoll(){
+  const now = Date.now();
+  if (Push.live && now - Push.lastPoll < PUSH_FALLBACK_MS) return true;
+  Push.lastPoll = now;
+  return false;
+}
+
+// ===== Matchstatus: lobby + runda + resultat i ett anrop, 304 när inget ändrats =====
+const MatchState = { key:'', etag:'', data:null };
+async function fetchState(roundNo){
+  const key = `${S.code}:${roundNo}`;
+  const headers = {};
+  if (MatchState.key === key && MatchState.etag) headers['If-None-Match'] = MatchState.etag;
+  const res = await fetch(`/api/match/state?code=${encodeURIComponent(S.code)}&round_no=${roundNo}`, { headers });
+  if (res.status === 304 && MatchState.key === key) return MatchState.data;
+  if (!res.ok){ throw new Error((await res.text())||res.statusText); }
+  MatchState.data = await res.json();
+  MatchState.etag = res.headers.get('ETag') || '';
+  MatchState.key  = key;
+  return MatchState.data;
+}
+
 // ===== Lager & städfunktion för rundgrafik =====
 function ensureRoundLayer(){
   if (!window.map) return null;
@@ -222,30 +270,27 @@ async function enterLobby(){
   })();
   msgEl.innerHTML = `<em>Inväntar att värden ska starta spelet…</em>`;
 
-  // Kolla om ronden redan finns publicerad
-  const detectRoundStarted = async () => {
-    try{
-      const rr = await fetchJson(`/api/match/round?code=${encodeURIComponent(S.code)}&round_no=${S.roundNo}`);
-      return !!rr?.round;
-    }catch{ return false; }
+  openMatchEvents(S.code);
+  S.lobbyWaiting = true;
+
+  // status==active ELLER ronden redan publicerad -> gå in i runda
+  const started = async () => {
+    const st = await fetchState(S.roundNo);
+    if (st?.players) S.players = st.players;
+    return st?.status === 'active' || !!st?.round;
   };
 
   // Försök initialt
   try{
-    const r = await fetchJson(`/api/match/lobby?code=${encodeURIComponent(S.code)}`);
-    if (r?.players) S.players = r.players;
-    if (r?.status === 'active' || await detectRoundStarted()){
-      return await enterRound();
-    }
+    if (await started()) return await enterRound();
   }catch{}
 
-  // Polla lobbyn – när status==active ELLER rond hittas -> gå in i runda
+  // Polla lobbyn (304 så länge inget hänt)
   clearInterval(S.pollTimer);
   S.pollTimer = setInterval(async () => {
+    if (skipPoll()) return;
     try{
-      const r = await fetchJson(`/api/match/lobby?code=${encodeURIComponent(S.code)}`);
-      if (r?.players) S.players = r.players;
-      if (r?.status === 'active' || await detectRoundStarted()){
+      if (await started()){
         clearInterval(S.pollTimer);
         await enterRound();
       }
@@ -257,6 +302,8 @@ async function enterLobby(){
 async function enterRound(){
   clearInterval(S.pollTimer);
   clearInterval(S.countdownTimer);
+  S.lobbyWaiting = false;
+  openMatchEvents(S.code);
 
   // Om vi redan passerat sista rundan -> visa final
   if (S.roundNo > S.rounds) {
@@ -296,7 +343,7 @@ async function enterRound(){
   // HÄMTA rundadata & sätt ledtråd (race-tåligt)
   let r = null;
   try{
-    r = await fetchJson(`/api/match/round?code=${encodeURIComponent(S.code)}&round_no=${S.roundNo}`);
+    r = await fetchState(S.roundNo);
   }catch(e){ /* ronden publiceras strax – polling tar över */ }
   S.currentClue = r?.round?.clue || '';
   const clueEl = document.getElementById('clue');
@@ -304,7 +351,7 @@ async function enterRound(){
 
   // starta polling direkt (och kör en första uppdatering)
   clearInterval(S.pollTimer);
-  S.pollTimer = setInterval(refreshRoundBoard, 2000);
+  S.pollTimer = setInterval(()=>{ if (!skipPoll()) refreshRoundBoard(); }, 2000);
   renderSidebar();
   refreshRoundBoard();
 
@@ -366,25 +413,16 @@ async function sendGuess(lat, lon, opt={}){
 
 // ===== Live-board för rundan =====
 async function refreshRoundBoard(){
-  // uppdatera spelare (ifall någon droppat/joinat)
-  try{
-    const lob = await fetchJson(`/api/match/lobby?code=${encodeURIComponent(S.code)}`);
-    if (lob?.players) S.players = lob.players;
-  }catch{}
-
-  let res;
-  try {
-    res = await fetchJson(`/api/match/round_result?code=${encodeURIComponent(S.code)}&round_no=${S.roundNo}`);
-    // kasta bort ev. koordinater så vi inte råkar rita motståndares markörer
-    if (res && Array.isArray(res.leaderboard)) {
-      res.leaderboard = res.leaderboard.map(r => {
-        const { nickname, distance_m } = r ?? {};
-        return { nickname, distance_m };
-      });
-    }
-  } catch(e) { return; }
+  // spelare (ifall någon droppat/joinat) + rundans resultat i samma anrop
+  let st;
+  try { st = await fetchState(S.roundNo); } catch(e) { return; }
+  if (st?.players) S.players = st.players;
+  const res = st?.round_result;
 
-  const board = Array.isArray(res?.leaderboard) ? res.leaderboard : [];
+  // kasta bort ev. koordinater så vi inte råkar rita motståndares markörer
+  const board = Array.isArray(res?.leaderboard)
+    ? res.leaderboard.map(r => { const { nickname, distance_m } = r ?? {}; return { nickname, distance_m }; })
+    : [];
 
   // Normalisera till unika per spelare
   const uniq = Array.from(board.reduce((m, r)=> m.set(r.nickname, r), new Map()).values());
@@ -404,6 +442,23 @@ async function refreshRoundBoard(){
   }
 }
 
+// ===== Push-händelser => uppdatera direkt i stället för att vänta på nästa poll =====
+document.addEventListener('mp:event', async (e)=>{
+  const { type, data } = e.detail || {};
+  if (type === 'player_joined' && Array.isArray(data?.players)) S.players = data.players;
+
+  if (type === 'match_started' && S.lobbyWaiting){
+    clearInterval(S.pollTimer);
+    await enterRound();
+    return;
+  }
+  const inRound = vGame?.style.display === 'block' && !S.roundRevealed;
+  const sameRound = data?.round_no == null || data.round_no === S.roundNo;
+  if (inRound && sameRound && (type === 'guess' || type === 'round_closed' || type === 'player_joined')){
+    await refreshRoundBoard();
+  }
+});
+
 // ===== Facit + nästa/final =====
 async function showSolutionAndButtons(res){
   const sol = res?.solution;
@@ -477,6 +532,7 @@ async function showSolutionAndButtons(res){
 async function showFinal(){
   try{
     const res = await fetchJson(`/api/match/final?code=${encodeURIComponent(S.code)}`);
+    closeMatchEvents();
     vGame.style.display='none';
     vFinal.style.display='block';
 
@@ -512,4 +568,7 @@ window.Utmana = {
   setSession({code, city, rounds, nickname}){ S.code = code; S.city = city; S.rounds = rounds; S.nickname = nickname; },
   enterLobby,
   enterRound,
+  openMatchEvents,
+  closeMatchEvents,
+  skipPoll,
 };